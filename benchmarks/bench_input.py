@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+Benchmark of the input paths of parse_file.
+
+Writes a large text file, and reports the time and throughput in MB/s of
+scanning it with each io mode of BisonParser.parse_file: 'read' (chunks
+pulled through read()), 'fd' (read in one go by the engine) and 'mmap'
+(mapped into memory by the engine). The benchmark parser's rules are all
+native actions, so that the input path dominates.
+
+Usage:
+
+    python benchmarks/bench_input.py [-s SIZE] [-r REPEAT]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bison import BisonParser
+
+IO_MODES = ['read', 'fd', 'mmap']
+
+
+class WordsParser(BisonParser):
+    """
+    Scans lines of words, without creating token values.
+    """
+    start = "input"
+    tokens = ["WORD", "NEWLINE"]
+    precedences = ()
+    options = [
+        "%define api.pure full",
+        "%define api.push-pull push",
+        "%lex-param {yyscan_t scanner}",
+        "%parse-param {yyscan_t scanner}",
+        "%define api.value.type {void *}",
+    ]
+
+    lexscript = r"""
+    %option reentrant bison-bridge bison-locations
+
+    %{
+    #include "tmp.tab.h"
+    #include "Python.h"
+
+    PyMODINIT_FUNC PyInit_WordsParser(void) { /* windows needs this function */ }
+
+    #define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
+    %}
+
+    %%
+
+    [^ \n]+     { *yylval = NULL; return WORD; }
+    \n          { *yylval = NULL; return NEWLINE; }
+    [ ]         { }
+
+    %%
+
+    int yywrap(yyscan_t scanner) { return 1; }
+    """
+
+    native_actions = {
+        "input": "none",
+        "word": "none",
+    }
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input word
+        """
+
+    def on_word(self, target, option, names, values):
+        """
+        word : WORD
+             | NEWLINE
+        """
+
+
+def writeInput(f, size):
+    line = b'the quick brown fox jumps over the lazy dog 0123456789\n'
+    block = line * (1 << 16 // len(line))
+    for _ in range(max(1, size // len(block))):
+        f.write(block)
+    f.flush()
+
+
+def bench(parser, filename, io, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parser.parse_file(filename, io=io)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('-s', '--size', type=int, default=256 << 20,
+                           help="approximate input size in bytes")
+    argparser.add_argument('-r', '--repeat', type=int, default=3,
+                           help="number of timed runs, the best one counts")
+    args = argparser.parse_args()
+
+    parser = WordsParser()
+    with tempfile.NamedTemporaryFile(suffix='.calc') as f:
+        writeInput(f, args.size)
+        size = os.path.getsize(f.name)
+
+        print("{:<8} {:>10} {:>8}".format('io', 'seconds', 'MB/s'))
+        for io in IO_MODES:
+            duration = bench(parser, f.name, io, args.repeat)
+            print("{:<8} {:>10.2f} {:>8.2f}".format(io, duration, size / duration / 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+"""
+Microbenchmark of parser instantiation with a warm engine.
+
+Once a parser class has been instantiated, further instances should neither
+rip the grammar from the class again nor touch the engine cache or reload
+the engine library, so their cost should be close to zero.
+
+Usage:
+
+    python benchmarks/bench_instantiation.py [-n NUMBER]
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'examples', 'json'))
+
+from jsonparser import JSONParser as Parser  # noqa: E402
+from bison.bison_ import hashParserObject  # noqa: E402
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('-n', '--number', type=int, default=1000,
+                           help="number of instantiations to time")
+    args = argparser.parse_args()
+
+    start = time.perf_counter()
+    parser = Parser()
+    first = time.perf_counter() - start
+    print("first instantiation:      {:10.3f} ms".format(first * 1e3))
+
+    warm = timeit.timeit(Parser, number=args.number) / args.number
+    print("warm instantiation:       {:10.3f} us".format(warm * 1e6))
+
+    hashing = timeit.timeit(lambda: hashParserObject(parser),
+                            number=args.number) / args.number
+    print("hashParserObject:         {:10.3f} us".format(hashing * 1e6))
+
+
+if __name__ == '__main__':
+    main()
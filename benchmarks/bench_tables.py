@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark of the scanner and parser table profiles.
+
+Builds the engines of the bundled example grammars with every scanner
+profile and parser table type, and reports the parsing throughput in MB/s
+and the size of the engine library.
+
+Usage:
+
+    python benchmarks/bench_tables.py [-s SIZE] [-r REPEAT]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples')
+sys.path.insert(0, os.path.join(EXAMPLES, 'json'))
+sys.path.insert(0, os.path.join(EXAMPLES, 'calc'))
+
+from jsonparser import JSONParser  # noqa: E402
+from calc import Parser as CalcParser  # noqa: E402
+
+SCANNER_PROFILES = [None, 'compact', 'fast', 'full']
+
+PARSER_TABLES = [
+    None,
+    {'lr.type': 'ielr'},
+    {'lr.default-reduction': 'consistent'},
+]
+
+
+def jsonInput(size):
+    with open(os.path.join(EXAMPLES, 'json', 'example.json')) as f:
+        sample = f.read().strip()
+    n = max(1, size // (len(sample) + 2))
+    return '[' + ',\n'.join([sample] * n) + ']\n'
+
+
+def calcInput(size):
+    line = '(12 + 34) * 5 - 6 / 2 ** 3\n'
+    return line * max(1, size // len(line))
+
+
+def bench(cls, text, repeat, **kw):
+    parser = cls(**kw)
+    data = text.encode('utf-8')
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            parser.run(file=io.BytesIO(data))
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+
+    return len(data) / best / 1e6, os.path.getsize(parser.engine.libFilename_py)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    argparser.add_argument('-s', '--size', type=int, default=1 << 20,
+                           help="approximate input size in bytes")
+    argparser.add_argument('-r', '--repeat', type=int, default=3,
+                           help="number of timed runs, the best one counts")
+    args = argparser.parse_args()
+
+    print("{:<8} {:<10} {:<40} {:>8} {:>10}".format(
+        'grammar', 'scanner', 'parser tables', 'MB/s', '.so bytes'))
+    for name, cls, text in [('json', JSONParser, jsonInput(args.size)),
+                            ('calc', CalcParser, calcInput(args.size))]:
+        for scanner in SCANNER_PROFILES:
+            for tables in PARSER_TABLES:
+                speed, size = bench(cls, text, args.repeat,
+                                    scanner_profile=scanner,
+                                    parser_tables=tables)
+                print("{:<8} {:<10} {:<40} {:>8.2f} {:>10}".format(
+                    name, str(scanner), str(tables), speed, size))
+
+
+if __name__ == '__main__':
+    main()
@@ -758,6 +758,10 @@ class Parser(BisonParser):
     # ----------------------------------------------------------------
     tokens = ['IDENTIFIER', 'CONSTANT', 'STRING_LITERAL', 'SIZEOF', 'PTR_OP', 'INC_OP', 'DEC_OP', 'LEFT_OP', 'RIGHT_OP', 'LE_OP', 'GE_OP', 'EQ_OP', 'NE_OP', 'BOOL_AND_OP', 'BOOL_OR_OP', 'MUL_ASSIGN', 'DIV_ASSIGN', 'MOD_ASSIGN', 'ADD_ASSIGN', 'SUB_ASSIGN', 'LEFT_ASSIGN', 'RIGHT_ASSIGN', 'AND_ASSIGN', 'XOR_ASSIGN', 'OR_ASSIGN', 'TYPE_NAME', 'LPAREN', 'RPAREN', 'LBRACKET', 'RBRACKET', 'LBRACE', 'RBRACE', 'PERIOD', 'COMMA', 'COLON', 'SEMICOLON', 'QUESTIONMARK', 'PLUS', 'MINUS', 'STAR', 'SLASH', 'ASSIGN', 'AND_OP', 'OR_OP', 'BANG', 'TILDE', 'PERCENT', 'CIRCUMFLEX', 'GT_OP', 'LT_OP', 'TYPEDEF', 'EXTERN', 'STATIC', 'AUTO', 'REGISTER', 'CHAR', 'SHORT', 'INT', 'LONG', 'SIGNED', 'UNSIGNED', 'FLOAT', 'DOUBLE', 'CONST', 'VOLATILE', 'VOID', 'STRUCT', 'UNION', 'ENUM', 'ELLIPSIS', 'CASE', 'DEFAULT', 'IF', 'ELSE', 'SWITCH', 'WHILE', 'DO', 'FOR', 'GOTO', 'CONTINUE', 'BREAK', 'RETURN']
 
+    # keywords and punctuation always have the same text
+    token_values = {t: 'interned' for t in tokens
+                    if t not in ('IDENTIFIER', 'CONSTANT', 'STRING_LITERAL', 'TYPE_NAME')}
+
     # ------------------------------
     # precedences
     # ------------------------------
@@ -785,6 +789,21 @@ class Parser(BisonParser):
     # ---------------------------------------------------------------
     start = 'translation_unit'
 
+    # ---------------------------------------------------------------
+    # Collapse the unit chains of expressions, e.g.
+    # expression -> assignment_expression -> ... -> primary_expression,
+    # into their innermost node
+    # ---------------------------------------------------------------
+    elide_units = (
+        'postfix_expression', 'unary_expression', 'cast_expression',
+        'multiplicative_expression', 'additive_expression',
+        'shift_expression', 'relational_expression', 'equality_expression',
+        'and_expression', 'exclusive_or_expression',
+        'inclusive_or_expression', 'logical_and_expression',
+        'logical_or_expression', 'conditional_expression',
+        'assignment_expression', 'expression', 'constant_expression',
+    )
+
     # ---------------------------------------------------------------
     # These methods are the python handlers for the bison targets.
     # (which get called by the bison code each time the corresponding
@@ -1658,10 +1677,8 @@ void count();
 #include <string.h>
 #include "Python.h"
 #include "tmp.tab.h"
-extern void *py_parser;
-extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
-#define returntoken(tok) /*printf("%d=%s\n", tok, yytext);*/ yylval = PyUnicode_FromString(strdup(yytext)); return (tok);
-#define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
+#define returntoken(tok) PYBISON_TOKEN(tok)
+#define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
 
 %}
 
@@ -105,14 +105,9 @@ class Parser(BisonParser):
     %{
     #include "Python.h"
     #include "tmp.tab.h"
-    extern void *py_parser;
-    extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
     PyMODINIT_FUNC PyInit_Parser(void) { /* windows needs this function */ }
-    #define returntoken(tok) \
-            *yylval = (void*)PyUnicode_FromString(strdup(yytext)); return (tok);
-    #define YY_INPUT(buf,result,max_size) { \
-        (*py_input)(py_parser, buf, &result, max_size); \
-    }
+    #define returntoken(tok) PYBISON_TOKEN(tok)
+    #define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
     %}
 
     %%
@@ -43,6 +43,12 @@ class Parser(BisonParser):
     # ----------------------------------------------------------------
     tokens = ['PLUS_TOKEN', 'MINUS_TOKEN', 'MUL_TOKEN', 'DIV_TOKEN', 'MOD_TOKEN', 'SHL_TOKEN', 'SHR_TOKEN', 'SAR_TOKEN', 'AND_TOKEN', 'XOR_TOKEN', 'OR_TOKEN', 'LOGICAL_AND_TOKEN', 'LOGICAL_OR_TOKEN', 'EQ_TOKEN', 'NE_OP_TOKEN', 'GREATER_TOKEN', 'GE_TOKEN', 'LESS_TOKEN', 'LE_TOKEN', 'ADD_ASSIGN_TOKEN', 'SUB_ASSIGN_TOKEN', 'MUL_ASSIGN_TOKEN', 'DIV_ASSIGN_TOKEN', 'MOD_ASSIGN_TOKEN', 'SHL_ASSIGN_TOKEN', 'SHR_ASSIGN_TOKEN', 'SAR_ASSIGN_TOKEN', 'AND_ASSIGN_TOKEN', 'XOR_ASSIGN_TOKEN', 'OR_ASSIGN_TOKEN', 'PUBLIC_TOKEN', 'PRIVATE_TOKEN', 'PROTECTED_TOKEN', 'STATIC_TOKEN', 'FINAL_TOKEN', 'SYNCHRONIZED_TOKEN', 'VOLATILE_TOKEN', 'TRANSIENT_TOKEN', 'NATIVE_TOKEN', 'PAD_TOKEN', 'ABSTRACT_TOKEN', 'MODIFIER_TOKEN', 'STRICT_TOKEN', 'STRICTFP_TOKEN', 'DEC_TOKEN', 'INC_TOKEN', 'DEFAULT_TOKEN', 'IF_TOKEN', 'THROW_TOKEN', 'BOOLEAN_TOKEN', 'DO_TOKEN', 'IMPLEMENTS_TOKEN', 'THROWS_TOKEN', 'BREAK_TOKEN', 'IMPORT_TOKEN', 'ELSE_TOKEN', 'INSTANCEOF_TOKEN', 'RETURN_TOKEN', 'VOID_TOKEN', 'CATCH_TOKEN', 'INTERFACE_TOKEN', 'CASE_TOKEN', 'EXTENDS_TOKEN', 'FINALLY_TOKEN', 'SUPER_TOKEN', 'WHILE_TOKEN', 'CLASS_TOKEN', 'SWITCH_TOKEN', 'CONST_TOKEN', 'TRY_TOKEN', 'FOR_TOKEN', 'NEW_TOKEN', 'CONTINUE_TOKEN', 'GOTO_TOKEN', 'PACKAGE_TOKEN', 'THIS_TOKEN', 'ASSERT_TOKEN', 'BYTE_TOKEN', 'SHORT_TOKEN', 'INT_TOKEN', 'LONG_TOKEN', 'CHAR_TOKEN', 'FLOAT_TOKEN', 'DOUBLE_TOKEN', 'ID_TOKEN', 'CONDITIONAL_TOKEN', 'COLON_TOKEN', 'TILDE_TOKEN', 'NOT_TOKEN', 'ASSIGN_ANY_TOKEN', 'ASSIGNS_TOKEN', 'OPEN_PAREN_TOKEN', 'CLOSE_PAREN_TOKEN', 'OPEN_BRACE_TOKEN', 'CLOSE_BRACE_TOKEN', 'OPEN_BRACKET_TOKEN', 'CLOSE_BRACKET_TOKEN', 'SEMICOLON_TOKEN', 'COMMA_TOKEN', 'PERIOD_TOKEN', 'INTEGER_LITERAL_TOKEN', 'FLOATING_POINT_LITERAL_TOKEN', 'BOOLEAN_LITERAL_TOKEN', 'STRING_LITERAL_TOKEN', 'CHARACTER_LITERAL_TOKEN', 'NULL_TOKEN']
 
+    # keywords and punctuation always have the same text
+    token_values = {t: 'interned' for t in tokens
+                    if t not in ('ID_TOKEN', 'INTEGER_LITERAL_TOKEN', 'FLOATING_POINT_LITERAL_TOKEN',
+                                 'BOOLEAN_LITERAL_TOKEN', 'STRING_LITERAL_TOKEN',
+                                 'CHARACTER_LITERAL_TOKEN')}
+
     # ------------------------------
     # precedences
     # ------------------------------
@@ -1980,10 +1986,8 @@ Escunichar   \\u{H}{H}{H}{H}
 #include <string.h>
 #include "Python.h"
 #include "tmp.tab.h"
-extern void *py_parser;
-extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
-#define returntoken(tok) /*printf("%d=%s\n", tok, yytext);*/ yylval = PyUnicode_FromString(strdup(yytext)); return (tok);
-#define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
+#define returntoken(tok) PYBISON_TOKEN(tok)
+#define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
 
 #include "table.h"
 void comment();
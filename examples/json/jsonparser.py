@@ -43,17 +43,10 @@ class Parser(BisonParser):
 #include "tmp.tab.h"
 #include "Python.h"
 
-extern void *py_parser;
-extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
-
 PyMODINIT_FUNC PyInit_JSONParser(void) { /* windows needs this function */ }
 
-#define returntoken(tok)                                       \
-        *yylval = (void*)PyUnicode_FromString(strdup(yytext)); \
-        return tok;
-#define YY_INPUT(buf,result,max_size) {                        \
-    (*py_input)(py_parser, buf, &result, max_size);            \
-}
+#define returntoken(tok) PYBISON_TOKEN(tok)
+#define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
 %}
 
 %%
@@ -81,8 +74,40 @@ class JSONParser(Parser):
         [ \t\n]                             = _
     """
 
+    # handlers are called as on_target(option, values)
+    handler_convention = 'positional'
+
+    # token values created by the scanner
+    token_values = {
+        'INTEGER': 'int',
+        'FLOAT': 'float',
+        'BOOL': 'interned',
+        'O_START': 'none',
+        'O_END': 'none',
+        'A_START': 'none',
+        'A_END': 'none',
+        'COMMA': 'none',
+        'COLON': 'none',
+    }
+
+    # rule actions carried out by the engine itself
+    native_actions = {
+        ('value', 0): 'passthrough(1)',
+        ('value', 1): 'passthrough(1)',
+        ('value', 2): 'passthrough(1)',
+        ('value', 4): 'passthrough(1)',
+        ('value', 5): 'passthrough(1)',
+        ('object', 0): 'dict_from_pairs',
+        ('object', 1): 'dict_from_pairs(2)',
+        'members': 'list(1)',
+        'pair': 'tuple(1, 3)',
+        ('array', 0): 'tuple',
+        ('array', 1): 'passthrough(2)',
+        'elements': 'list(1)',
+    }
+
     @staticmethod
-    def on_value(target, option, names, values):
+    def on_value(option, values):
         """
         value
         : string
@@ -92,10 +117,6 @@ class JSONParser(Parser):
         | array
         | object
         """
-        if option == 1:
-            return int(values[0])
-        if option == 2:
-            return float(values[0])
         if option == 3:
             return {'false': False,
                     'true': True,
@@ -103,7 +124,7 @@ class JSONParser(Parser):
         return values[0]
 
     @staticmethod
-    def on_string(target, option, names, values):
+    def on_string(option, values):
         """
         string
         : STRING
@@ -111,7 +132,7 @@ class JSONParser(Parser):
         return values[0][1:-1]
 
     @staticmethod
-    def on_object(target, option, names, values):
+    def on_object(option, values):
         """
         object
         : O_START O_END
@@ -120,7 +141,7 @@ class JSONParser(Parser):
         return {} if option == 0 else dict(values[1])
 
     @staticmethod
-    def on_members(target, option, names, values):
+    def on_members(option, values):
         """
         members
         : pair
@@ -131,7 +152,7 @@ class JSONParser(Parser):
         return [values[0]] + values[2]
 
     @staticmethod
-    def on_pair(target, option, names, values):
+    def on_pair(option, values):
         """
         pair
         : string COLON value
@@ -139,7 +160,7 @@ class JSONParser(Parser):
         return values[0], values[2]
 
     @staticmethod
-    def on_array(target, option, names, values):
+    def on_array(option, values):
         """
         array
         : A_START A_END
@@ -150,7 +171,7 @@ class JSONParser(Parser):
         return values[1]
 
     @staticmethod
-    def on_elements(target, option, names, values):
+    def on_elements(option, values):
         """
         elements
         : value
@@ -127,10 +127,8 @@ class Parser(BisonParser):
 #include "tmp.tab.h"
 //int yylineno = 0;
 int yywrap() { return(1); }
-extern void *py_parser;
-extern void (*py_input)(PyObject *parser, char *buf, int *result, int max_size);
-#define returntoken(tok) yylval = PyUnicode_FromString(strdup(yytext)); return (tok);
-#define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
+#define returntoken(tok) PYBISON_TOKEN(tok)
+#define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
 %}
 
 %%
@@ -53,6 +53,8 @@ SETUP_REQUIRES = [
 PACKAGE_DATA = [
     str(Path("c") / "bison_callback.c"),
     str(Path("c") / "bison_callback.h"),
+    str(Path("c") / "bison_input.c"),
+    str(Path("c") / "bison_input.h"),
     str(Path("c") / "bisondynlib.h"),
     str(Path("c") / "bisondynlib-linux.c"),
     str(Path("c") / "bisondynlib-win32.c"),
@@ -60,6 +62,9 @@ PACKAGE_DATA = [
     str(Path("cython") / "bison_.c"),
 ]
 SCRIPTS = [str(Path("utils") / "bison2py")]
+ENTRY_POINTS = {
+    "distutils.commands": ["build_engines = bison.build:build_engines"],
+}
 
 
 ###################################################################
@@ -126,6 +131,7 @@ else:
 SOURCES = [
     str(Path("src") / "bison" / "cython" / "bison_.pyx"),
     str(Path("src") / "bison" / "c" / "bison_callback.c"),
+    str(Path("src") / "bison" / "c" / "bison_input.c"),
     bisondynlibModule
 ]
 
@@ -175,6 +181,7 @@ if __name__ == "__main__":
         cmdclass=cmd_class,
         ext_modules=ext_modules,
         scripts=SCRIPTS,
+        entry_points=ENTRY_POINTS,
         package_dir={"": "src"},
         package_data={'bison': PACKAGE_DATA},
         python_requires='>=3.7',
@@ -25,11 +25,15 @@ from os.path import join
 
 import sys
 import os
+import inspect
+import threading
 import traceback
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 
-from .bison_ import ParserEngine
+from .bison_ import FileBuffer, ParserEngine, TokenSpan, parserGrammar
 from .node import BisonNode
 from .convert import bisonToPython
 
@@ -42,6 +46,13 @@ WIN_CHOCO_DIR = "C:\\ProgramData\\chocolatey\\lib\\winflexbison3\\tools\\"
 WIN_FLEX = join(WIN_CHOCO_DIR, 'win_flex.exe')
 WIN_BISON = join(WIN_CHOCO_DIR, 'win_bison.exe')
 
+# (logging config, logging level) last applied by a parser instance
+_appliedLogging = None
+
+# Thread pool preparing parser engines in the background, see prepare_async
+_prepareExecutor = None
+_prepareExecutorLock = threading.Lock()
+
 
 __version__ = '0.6.4'
 __uri__ = 'https://github.com/lukeparser/pybison'
@@ -50,6 +61,66 @@ __maintainer__ = 'Lukeparser Team'
 __license__ = 'GPLv2'
 
 
+# Argument indices of positional handlers, see _positionalArgs
+_positionalArgsMemo = weakref.WeakKeyDictionary()
+
+# Names of the arguments a handler can ask for, in the order of _handle's
+_HANDLER_ARGS = ('target', 'option', 'names', 'values')
+
+
+def positional(handler):
+    """
+    Decorator marking a target handler as using the positional convention
+    (see BisonParser.handler_convention), regardless of its parser class.
+
+    For static methods, put it below @staticmethod.
+    """
+    handler.handler_convention = 'positional'
+    return handler
+
+
+def _positionalArgs(handler):
+    """
+    Returns the indices into (target, option, names, values) of the
+    arguments of a positional handler, in the order of its parameters.
+    Handlers without named parameters get (option, values).
+    """
+    func = getattr(handler, '__func__', handler)
+    try:
+        return _positionalArgsMemo[func]
+    except (KeyError, TypeError):
+        pass
+
+    params = [p for p in inspect.signature(handler).parameters.values()
+              if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)]
+    if not params:
+        args = (1, 3)
+    else:
+        unknown = [p.name for p in params if p.name not in _HANDLER_ARGS]
+        if unknown:
+            raise TypeError("positional handler {} has unknown parameters {}, "
+                            "expected some of {}".format(
+                                handler.__name__, ', '.join(unknown),
+                                ', '.join(_HANDLER_ARGS)))
+        args = tuple(_HANDLER_ARGS.index(p.name) for p in params)
+
+    try:
+        _positionalArgsMemo[func] = args
+    except TypeError:
+        pass
+    return args
+
+
+def _getPrepareExecutor():
+    """Returns the thread pool shared by all parsers for prepare_async."""
+    global _prepareExecutor
+    with _prepareExecutorLock:
+        if _prepareExecutor is None:
+            _prepareExecutor = ThreadPoolExecutor(
+                thread_name_prefix='pybison-prepare')
+        return _prepareExecutor
+
+
 class BisonSyntaxError(Exception):
     def __init__(self, msg, args=[]):
         super(BisonSyntaxError, self).__init__(msg)
@@ -105,10 +176,24 @@ class BisonParser(object):
         flexCmd = [WIN_FLEX, '--wincompat']
     flexCmd += ['-v', '--header-file="{}"'.format(flexHFile)]
 
+    # Table compression of the scanner, one of None (flex's default),
+    # 'compact' (-Cem), 'fast' (-CF) or 'full' (-Cf). The fast and full
+    # profiles trade a larger engine for a faster scanner, and also pass
+    # -8 and --never-interactive.
+    scanner_profile = None
+
+    # Type and default reductions of the parser tables, as dict of bison's
+    # 'lr.type' ('lalr', 'ielr' or 'canonical-lr') and
+    # 'lr.default-reduction' ('most', 'consistent' or 'accepting').
+    parser_tables = None
+
     # C output file from flex gets renamed to this.
     flexCFile1 = flexCFile  # 'tmp.lex.c'
     flexHFile1 = flexHFile  # 'tmp.lex.h'
 
+    # C file holding the rules hash of the engine.
+    hashCFile = 'tmp.hash.c'
+
     # CFLAGS added before all command line arguments.
     cflags_pre = ['-fPIC'] if sys.platform.startswith('linux') else []
 
@@ -118,6 +203,22 @@ class BisonParser(object):
     # Directory used to store the generated / compiled files.
     buildDirectory = ''
 
+    # Number of engine build steps (bison, flex, compiling) run concurrently.
+    # None uses the default of ThreadPoolExecutor, min(32, CPUs + 4).
+    build_jobs = None
+
+    # Number of outputs kept per build stage (bison, flex, compile, link) in
+    # the build directory, to skip stages whose inputs did not change.
+    stagesKept = 8
+
+    # Root directory of the engine cache, shared by all parser classes.
+    # Defaults to $PYBISON_CACHE_DIR, or 'pybison/cache' in the temp directory.
+    cacheDirectory = None
+
+    # Maximum size in bytes of the engine cache, least recently used engines
+    # are evicted beyond that. Defaults to $PYBISON_CACHE_MAX_SIZE, or 256 MiB.
+    cacheMaxSize = None
+
     # Add debugging symbols to the binary files.
     debugSymbols = 1
 
@@ -134,12 +235,78 @@ class BisonParser(object):
     # Create a marker for input parsing.
     marker = 0
 
+    # Replace CRLF and CR newlines of the input by LF. This is done in C,
+    # on the blocks read by the built-in read() (but not by an overridden
+    # one), and on the input of parse_file and parse_string. Token spans
+    # index the normalized text.
+    normalize_newlines = True
+
     # Last parsed target, top of parse tree.
     last = None
 
+    # (key, table) of the last _handler_table()
+    _handlerTable = None
+
     # Enable this to keep all temporary engine build files.
     keepfiles = 1
 
+    # Files of sample inputs to train the engine on, for profile-guided
+    # optimized engine builds (gcc only). The engine gets built with
+    # -fprofile-generate, run on every file, and rebuilt with -fprofile-use.
+    pgo_corpus = None
+
+    # How target handlers get called: 'keyword' calls
+    # on_target(target=..., option=..., names=..., values=...), while
+    # 'positional' calls on_target(option, values) positionally, which is
+    # considerably faster. Positional handlers may ask for any of target,
+    # option, names and values, by naming their parameters accordingly,
+    # e.g. on_target(self, target, option, values). Single handlers can be
+    # marked positional with the @positional decorator.
+    handler_convention = 'keyword'
+
+    # Rule actions carried out in C by the engine, without calling a target
+    # handler, as dict mapping targets, or (target, option) tuples, to one of
+    #   - 'passthrough(n)' - the value of the n-th symbol
+    #   - 'tuple(i, j, ...)' - a tuple of the values of the given symbols
+    #   - 'list' - a list of the values of a left- or right-recursive list
+    #     rule, e.g. 'elements : value | value COMMA elements', built in
+    #     linear time; 'list(n)' names the symbol to collect
+    #   - 'list_append' - a list of the only symbol's value, or the list of
+    #     the first symbol (left recursion) with the last symbol's value
+    #     appended; 'list_append(n)' and 'list_append(l, n)' name the symbols
+    #   - 'dict_from_pairs(n)' - a dict of the n-th symbol's (key, value)
+    #     pairs, or an empty dict without argument
+    #   - 'none' - None
+    # Symbols are numbered from 1, like bison's $n. Native actions bypass
+    # target handlers and hook_handler, even if verbose.
+    native_actions = None
+
+    # Targets whose unit rules, i.e. rules of a single symbol like
+    # 'expr : term', are elided by the engine: the reduction passes on the
+    # symbol's value, without calling the target handler or creating a
+    # node. Either a collection of target names, or True for all targets.
+    # Native actions declared for a rule take precedence.
+    elide_units = None
+
+    # Values of the tokens returned with PYBISON_TOKEN(tok) by the lex
+    # script, created by the scanner from the matched text, as dict mapping
+    # tokens to one of
+    #   - 'str' - the text, the default
+    #   - 'interned' - the text as interned str, which is reused as long as
+    #     the token's text stays the same, e.g. for keywords and punctuation
+    #   - 'int', 'float' - the number, as int(text) or float(text) would
+    #     give (ints with 0x, 0o or 0b prefixes are read accordingly)
+    #   - 'bytes' - the text as bytes
+    #   - 'span' - a TokenSpan, the position of the token in the parsed
+    #     buffer, which only decodes the text when asked for (str when the
+    #     input is read through read())
+    #   - 'none' - None
+    token_values = None
+
+    # Enable this to defer building/loading the engine until it is first
+    # needed, i.e. the first run(), or to prepare()/prepare_async().
+    lazy = False
+
     # Enable this to handle all error exceptions by error-rules
     handlesErrorRules = 0
 
@@ -203,6 +370,27 @@ class BisonParser(object):
               files get deleted upon a successful engine build
             - defaultNodeClass - the class to use for creating parse nodes, default
               is self.defaultNodeClass (in this base class, BisonNode)
+            - cacheDirectory - root directory of the engine cache, default is
+              self.cacheDirectory
+            - cacheMaxSize - maximum size in bytes of the engine cache, default
+              is self.cacheMaxSize
+            - build_jobs - number of engine build steps run concurrently, default
+              is self.build_jobs
+            - scanner_profile - table compression of the scanner, default is
+              self.scanner_profile
+            - parser_tables - dict of bison lr.* table settings, default is
+              self.parser_tables
+            - pgo_corpus - files of sample inputs to build a profile-guided
+              optimized engine with, default is self.pgo_corpus
+            - native_actions - rule actions carried out in C, default is
+              self.native_actions
+            - elide_units - targets whose unit rules pass on their value
+              without calling a handler, default is self.elide_units
+            - token_values - kinds of the values of tokens, default is
+              self.token_values
+            - lazy - if True, the engine is not built/loaded by the constructor,
+              but when first needed (see prepare and prepare_async), default
+              is self.lazy
         """
         self.debug = kw.get('debug', False)
 
@@ -214,7 +402,6 @@ class BisonParser(object):
         if self.debug:
             self.cflags_post = ['-O0', '-g'] if sys.platform.startswith('linux') else []
             shutil.rmtree(self.buildDirectory, ignore_errors=True)
-        Path(self.buildDirectory).mkdir(parents=True, exist_ok=True)
 
         # setup
         read = kw.get('read', None)
@@ -245,9 +432,12 @@ class BisonParser(object):
         if self.debug:
             self.logging_level = logging.DEBUG
 
-        # setup logging with dict config
-        self._set_logging_level()
-        logging.config.dictConfig(self.logging_config)
+        # setup logging with dict config, unless it is already in effect
+        global _appliedLogging
+        if _appliedLogging != (id(self.logging_config), self.logging_level):
+            self._set_logging_level()
+            logging.config.dictConfig(self.logging_config)
+            _appliedLogging = (id(self.logging_config), self.logging_level)
 
 
         self.interactive = kw.get('interactive', False)
@@ -256,17 +446,94 @@ class BisonParser(object):
         if 'keepfiles' in kw:
             self.keepfiles = kw['keepfiles']
 
+        if 'cacheDirectory' in kw:
+            self.cacheDirectory = kw['cacheDirectory']
+        if 'cacheMaxSize' in kw:
+            self.cacheMaxSize = kw['cacheMaxSize']
+        if 'build_jobs' in kw:
+            self.build_jobs = kw['build_jobs']
+        if self.build_jobs is not None and (
+                not isinstance(self.build_jobs, int) or self.build_jobs < 1):
+            raise ValueError("Invalid build_jobs {!r}, expected a positive int or None".format(
+                self.build_jobs))
+
         # if engine lib name not declared, invent ont
         if not self.bisonEngineLibName:
             self.bisonEngineLibName = self.__class__.__module__.split('.')[-1] + '_parser'
 
+        if 'scanner_profile' in kw:
+            self.scanner_profile = kw['scanner_profile']
+        if 'parser_tables' in kw:
+            self.parser_tables = kw['parser_tables']
+        if 'pgo_corpus' in kw:
+            self.pgo_corpus = kw['pgo_corpus']
+        if 'native_actions' in kw:
+            self.native_actions = kw['native_actions']
+        if 'elide_units' in kw:
+            self.elide_units = kw['elide_units']
+        if 'token_values' in kw:
+            self.token_values = kw['token_values']
+        if 'lazy' in kw:
+            self.lazy = kw['lazy']
+
         # get an engine
         if not hasattr(self, "options"):
             self.options = []
-        self.engine = ParserEngine(self)
+        self._engine = None
+        self._engineLock = threading.Lock()
+        if not self.lazy:
+            self.prepare()
 
         self.BisonSyntaxError = BisonSyntaxError
 
+    @property
+    def engine(self):
+        """
+        The ParserEngine of this parser, built/loaded on first access if the
+        parser is lazy.
+        """
+        engine = self._engine
+        if engine is None:
+            engine = self.prepare()
+        return engine
+
+    def prepare(self):
+        """
+        Builds or loads the engine of this parser, unless that happened
+        already, and returns it.
+
+        Blocks while another thread prepares the engine.
+        """
+        with self._engineLock:
+            if self._engine is None:
+                self._engine = ParserEngine(self)
+                # resolve the handlers now, so that misconfigured ones
+                # raise here rather than in the midst of a parse
+                self._handler_table()
+            return self._engine
+
+    def prepare_async(self, executor=None):
+        """
+        Builds or loads the engine of this parser in the background, so that
+        e.g. a service can initialize other things (or other parsers) while
+        the engine gets compiled.
+
+        Arguments:
+            - executor - a concurrent.futures.Executor to prepare the engine
+              on, defaults to a thread pool shared by all parsers
+
+        Returns a concurrent.futures.Future, whose result is the engine. Using
+        the parser before the future is done just waits for the engine.
+        """
+        if self._engine is not None:
+            future = Future()
+            future.set_result(self._engine)
+            return future
+
+        if executor is None:
+            executor = _getPrepareExecutor()
+        return executor.submit(self.prepare)
+
     def __getitem__(self, idx):
         return self.last[idx]
 
@@ -275,6 +542,59 @@ class BisonParser(object):
         for logger in self.logging_config["loggers"]:
             self.logging_config["loggers"][logger]["level"] = self.logging_level
 
+    def _handler_table(self):
+        """
+        Resolves the handler of every reduction of the grammar, before the
+        engine runs, so that the engine can call right into it.
+
+        Returns a tuple indexed by the reduction numbers of the generated
+        parser actions, of (handler, call, target, option, hook, names)
+        tuples, where handler is the on_<target> method and call is either
+        True, for calling it with keyword arguments as by _handle(), or the
+        argument indices of a positional handler (see _positionalArgs). If
+        call is False, handler is _handle() itself. hook is the hook_handler
+        method, or None, and names the tuple of right-hand side symbols.
+
+        The table is kept until the engine, the handler convention, verbose,
+        or handlers set on the instance change.
+        """
+        key = (self._engine, self.handler_convention, bool(self.verbose),
+               tuple((name, value) for name, value in self.__dict__.items()
+                     if name.startswith('on_') or name == 'hook_handler'))
+        cached = self._handlerTable
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        hook = getattr(self, 'hook_handler', None)
+        # verbose logging and overridden _handle() methods need _handle()
+        generic = self.verbose or type(self)._handle is not BisonParser._handle
+
+        handlers = {}
+        table = []
+        # numbered as the engine's reductions, even if handlers set on the
+        # instance since changed the order of the rules
+        for target, option, names in self.engine.grammar.reductions:
+            if target not in handlers:
+                handler = getattr(self, 'on_' + target, None)
+                if not handler or generic:
+                    handlers[target] = (self._handle, False)
+                elif self._handler_convention(handler) == 'positional':
+                    handlers[target] = (handler, _positionalArgs(handler))
+                else:
+                    handlers[target] = (handler, True)
+            handler, call = handlers[target]
+            table.append((handler, call, target, option, hook, names))
+        table = tuple(table)
+        self._handlerTable = (key, table)
+        return table
+
+    def _handler_convention(self, handler):
+        """Returns the calling convention of a target handler."""
+        convention = getattr(handler, 'handler_convention', self.handler_convention)
+        if convention not in ('keyword', 'positional'):
+            raise ValueError("Unknown handler convention {!r}".format(convention))
+        return convention
+
     def _handle(self, targetname, option, names, values):
         """
         Callback which receives a target from parser, as a targetname
@@ -296,7 +616,11 @@ class BisonParser(object):
                     hdlrline, str((targetname, option, names, values)))
                 )
             try:
-                self.last = handler(target=targetname, option=option, names=names, values=values)
+                if self._handler_convention(handler) == 'positional':
+                    args = (targetname, option, names, values)
+                    self.last = handler(*[args[i] for i in _positionalArgs(handler)])
+                else:
+                    self.last = handler(target=targetname, option=option, names=names, values=values)
             except Exception as e:
                 self.last = e
                 return e
@@ -325,13 +649,97 @@ class BisonParser(object):
         self.engine.reset()
 
     def parse_string(self, string, debug=False):
-        """Supply file-like object containing the string."""
+        """
+        Parses a string, encoded as UTF-8.
+
+        Unless read() is overridden or read hooks are defined, the encoded
+        string is scanned directly (see parse_buffer), after normalizing its
+        newlines (see normalize_newlines).
+        """
+        if not self._reads_input():
+            if self.normalize_newlines and '\r' in string:
+                string = string.replace('\r\n', '\n').replace('\r', '\n')
+            return self.parse_bytes(string.encode('utf-8'), debug=debug)
         file = BytesIO(string.encode('utf-8'))
         return self.run(file=file, debug=debug)
 
-    def parse_file(self, filename):
-        """Better interface."""
-        return self.run(file=filename)
+    def parse_bytes(self, data, debug=False):
+        """
+        Parses bytes (or any other bytes-like object), see parse_buffer.
+        """
+        return self.parse_buffer(data, debug=debug)
+
+    def parse_buffer(self, buffer, debug=False):
+        """
+        Parses the contents of an object supporting the buffer protocol,
+        e.g. bytes, bytearray, memoryview or mmap.
+
+        The buffer is scanned by flex as it is, without calling read() or
+        the read hooks, and without newline normalization. It stays exported
+        (so e.g. a bytearray cannot be resized, or an mmap closed) until the
+        parse is done. Writable buffers ending with two NUL bytes, such as
+        bytearray(data + b'\0\0'), are scanned in place without any copy;
+        flex temporarily writes into them while scanning.
+
+        As with read() input, the parser runs until the end of the buffer:
+        a run aborted by a syntax error is followed by another one on the
+        rest of the buffer.
+        """
+        return self.run(buffer=buffer, debug=debug)
+
+    def _builtin_read(self):
+        """
+        Returns whether read() is the one of BisonParser, not overridden.
+        """
+        return getattr(self.read, '__func__', None) is BisonParser.read
+
+    def _reads_input(self):
+        """
+        Returns whether the parser's input must be read through read(),
+        because it is overridden, or because read hooks are defined.
+        """
+        return not self._builtin_read() \
+            or hasattr(self, 'hook_read_before') \
+            or hasattr(self, 'hook_read_after')
+
+    def _input_readinto(self):
+        """
+        Returns the readinto() method of self.file, which the engine calls
+        instead of the built-in read(), to read blocks straight into the
+        scanner's buffer; or None if read() must be called, because it is
+        overridden, for its logging or line by line reading, or for
+        hook_read_after.
+        """
+        if not self._builtin_read() or self.verbose or self.interactive \
+                or hasattr(self, 'hook_read_after'):
+            return None
+        return getattr(self.file, 'readinto', None)
+
+    def parse_file(self, filename, io=None, debug=False):
+        """
+        Parses the file `filename`.
+
+        `io` selects how the file gets to the scanner:
+            - 'mmap' - mapped into memory by the engine, and scanned in place
+            - 'fd' - read by the engine in one go, and scanned in place
+            - 'read' - read chunk by chunk through read()
+        Defaults to 'mmap', unless read() is overridden or read hooks are
+        defined. Either way, newlines are normalized (see normalize_newlines).
+        """
+        if io is None:
+            io = 'read' if self._reads_input() else 'mmap'
+        if io == 'read':
+            return self.run(file=filename, debug=debug)
+
+        buffer = FileBuffer(filename, io, self.normalize_newlines)
+        try:
+            return self.run(buffer=buffer, filename=filename, debug=debug)
+        finally:
+            try:
+                buffer.close()
+            except BufferError:
+                # still held by token spans, and released along with them
+                pass
 
     def run(self, **kw):
         """
@@ -340,16 +748,26 @@ class BisonParser(object):
         Keywords:
             - file - either a string, comprising a file to open and read input from, or
               a Python file object
+            - buffer - an object supporting the buffer protocol, to parse
+              instead of a file, see parse_buffer
+            - filename - name of the buffer's file, for error reports
             - debug - enables garrulous parser debugging output, default 0
         """
         if self.verbose:
             LOGGER.info('Parser.run: calling engine')
 
+        # misconfigured handlers raise, rather than counting as parse errors
+        self.engine
+        self._handler_table()
+
         filename = None
         # grab keywords
         i_opened_a_file = False
-        fileobj = kw.get('file', self.file)
-        if isinstance(fileobj, str):
+        buffer = kw.get('buffer', None)
+        fileobj = kw.get('file', self.file) if buffer is None else None
+        if buffer is not None:
+            filename = kw.get('filename', None)
+        elif isinstance(fileobj, str):
             filename = fileobj
             try:
                 fileobj = open(fileobj, 'rb')
@@ -387,10 +805,8 @@ class BisonParser(object):
         # TODO: add option to fail on first error.
         while not self.marker:
             # do the parsing job, spew if error
-            self.engine.reset()
-
             try:
-                self.engine.runEngine(debug)
+                self.engine.runEngine(debug, buffer)
             except Exception as e:
                 error_count += 1
 
@@ -399,6 +815,10 @@ class BisonParser(object):
 
                 self.report_last_error(filename, e)
 
+            # a buffer is parsed at once
+            if buffer is not None:
+                self.marker = 1
+
             if self.verbose:
                 LOGGER.info('Parser.run: back from engine')
 
@@ -431,16 +851,27 @@ class BisonParser(object):
         """
         Override this in your subclass, if you desire.
 
+        Reads the next block of input from self.file, filling as much of
+        the scanner's buffer as possible, or the next line in interactive
+        mode. Unless this is overridden, the engine reads the blocks
+        straight into its buffer instead, where the file has readinto().
+
         Arguments:
             - nbytes - the maximum length of the string which you may return.
               DO NOT return a string longer than this, or else Bad Things will
               happen.
+
+        Returns bytes; an override may also return any other object
+        supporting the buffer protocol.
         """
         # default to stdin
         if self.verbose:
             LOGGER.info('Parser.read: want %s bytes' % nbytes)
 
-        _bytes = self.file.readline(nbytes).replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        if self.interactive:
+            _bytes = self.file.readline(nbytes)
+        else:
+            _bytes = self.file.read(nbytes)
 
         if self.verbose:
             LOGGER.info('Parser.read: got %s bytes' % len(_bytes))
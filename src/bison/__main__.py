@@ -0,0 +1,43 @@
+"""
+Command line interface of pybison.
+
+    python -m bison build [-o DIRECTORY] module:ClassName [module:ClassName ...]
+
+builds the engines of the given parser classes ahead of time, and installs
+them next to the modules defining the classes (see bison.build).
+"""
+import argparse
+import sys
+
+from .build import buildEngine
+
+
+def main(argv=None):
+    argparser = argparse.ArgumentParser(prog='python -m bison')
+    commands = argparser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser(
+        'build', help='build parser engines ahead of time')
+    build.add_argument(
+        'parsers', nargs='+', metavar='module:ClassName',
+        help='parser classes to build the engines of')
+    build.add_argument(
+        '-o', '--output-dir', default=None,
+        help='directory to put the engines into, defaults to the directory '
+             'of each parser module')
+    build.add_argument(
+        '-v', '--verbose', action='store_true',
+        help='enable verbose output while building')
+
+    args = argparser.parse_args(argv)
+
+    if args.command == 'build':
+        for spec in args.parsers:
+            filename = buildEngine(spec, args.output_dir, verbose=args.verbose)
+            print('{}: {}'.format(spec, filename))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
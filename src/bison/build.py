@@ -0,0 +1,148 @@
+"""
+Ahead-of-time compilation of parser engines.
+
+Builds the bison/flex engine of parser classes at packaging time, and
+installs the engine library next to the module defining the parser class.
+At runtime, ParserEngine then only checks the engine's hash and loads it,
+which works without bison, flex, a C compiler or a writable file system.
+
+Either use the command line:
+
+    python -m bison build mypkg.parsers:JSONParser [mypkg.other:Parser ...]
+
+or hook the 'build_engines' command into setuptools' build_ext:
+
+    from bison.build import build_engines, build_ext
+
+    setup(
+        ...,
+        cmdclass={'build_ext': build_ext, 'build_engines': build_engines},
+        options={'build_engines': {'parsers': 'mypkg.parsers:JSONParser'}},
+    )
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+"""
+import importlib
+import logging
+import os
+import re
+import sys
+
+from setuptools import Command
+from setuptools.command.build_ext import build_ext as _build_ext
+
+LOGGER = logging.getLogger(__name__)
+
+
+def loadParserClass(spec):
+    """
+    Imports and returns the parser class named by `spec`, which has the
+    form 'package.module:ClassName'.
+    """
+    if isinstance(spec, type):
+        return spec
+
+    moduleName, sep, className = spec.partition(':')
+    if not sep or not moduleName or not className:
+        raise ValueError("Expected 'module:ClassName', got {!r}".format(spec))
+
+    obj = importlib.import_module(moduleName)
+    for name in className.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def buildEngine(spec, directory=None, **kw):
+    """
+    Builds the engine of a parser class and installs it next to the module
+    defining the class (or into `directory`).
+
+    Arguments:
+        - spec - the parser class, or a 'module:ClassName' string
+        - directory - where to put the engine library, defaults to the
+          directory of the parser's module
+
+    Keyword arguments are passed on to the parser's constructor.
+
+    Returns the filename of the installed engine library.
+    """
+    parser = loadParserClass(spec)(**kw)
+    return parser.engine.exportLib(directory)
+
+
+def splitParserSpecs(specs):
+    """Splits a comma and/or whitespace separated list of parser specs."""
+    if specs is None:
+        return []
+    if isinstance(specs, str):
+        specs = re.split(r'[\s,]+', specs)
+    return [s for s in specs if s]
+
+
+class build_engines(Command):
+    """
+    Setuptools command building the engines of the configured parser
+    classes into the build directory (or into the source tree, with
+    --inplace), so they get installed alongside the parser modules.
+    """
+
+    description = "build the bison/flex engines of parser classes"
+
+    user_options = [
+        ('parsers=', 'p',
+         "comma or whitespace separated list of 'module:ClassName' parsers"),
+        ('build-lib=', 'b',
+         "directory containing the built python packages"),
+        ('inplace', 'i',
+         "put the engines next to the parser modules in the source tree"),
+    ]
+
+    boolean_options = ['inplace']
+
+    def initialize_options(self):
+        self.parsers = None
+        self.build_lib = None
+        self.inplace = None
+
+    def finalize_options(self):
+        self.set_undefined_options('build_ext',
+                                   ('build_lib', 'build_lib'),
+                                   ('inplace', 'inplace'))
+        self.parsers = splitParserSpecs(self.parsers)
+
+    def run(self):
+        if not self.parsers:
+            return
+
+        if not self.inplace:
+            # import the parser modules from the build directory, so that the
+            # engines end up next to the modules which get installed
+            self.run_command('build_py')
+            sys.path.insert(0, os.path.abspath(self.build_lib))
+        try:
+            for spec in self.parsers:
+                filename = buildEngine(spec)
+                LOGGER.info("built engine {} for {}".format(filename, spec))
+        finally:
+            if not self.inplace:
+                sys.path.remove(os.path.abspath(self.build_lib))
+
+
+class build_ext(_build_ext):
+    """
+    Drop-in replacement of setuptools' build_ext, which builds the parser
+    engines (see build_engines) after all extension modules.
+    """
+
+    sub_commands = _build_ext.sub_commands + [('build_engines', None)]
+
+    def run(self):
+        super().run()
+        for cmd in self.get_sub_commands():
+            self.run_command(cmd)
@@ -34,6 +34,9 @@
 #include <stdio.h>
 #include <string.h>
 
+#include "bison_input.h"
+#include "bison_callback.h"
+
 #ifdef _WIN32
 #define likely(x)       (x)
 #define unlikely(x)     (x)
@@ -42,18 +45,25 @@
 #define unlikely(x) __builtin_expect(!!(x), 0)
 #endif
 
-static PyObject *py_attr_hook_handler_name;
 static PyObject *py_attr_hook_read_after_name;
 static PyObject *py_attr_hook_read_before_name;
 
-static PyObject *py_attr_handle_name;
+static PyObject *py_attr_last_name;
+static PyObject *py_attr_target_name;
+static PyObject *py_attr_option_name;
+static PyObject *py_attr_names_name;
+static PyObject *py_attr_values_name;
+#if PY_VERSION_HEX >= 0x03090000
+static PyObject *py_handler_kwnames;
+#else
+static PyObject *py_empty_tuple;
+#endif
 static PyObject *py_attr_read_name;
 static PyObject *py_attr_file_name;
 static PyObject *py_attr_input_marker;
-static PyObject *py_attr_close_name;
 
-// Construct attribute names (only the first time)
-// TODO: where do we Py_DECREF(handle_name) ??
+// Construct attribute names (only the first time). The names are kept for
+// the lifetime of the process, like interned strings.
 #ifdef PY3
 #define INIT_ATTR(variable, name, failure) \
     if (unlikely(!variable)) { \
@@ -73,135 +83,302 @@ static PyObject *py_attr_close_name;
         assert(Py_REFCNT(variable) == count); \
     }
 
+/*
+ * Calls callable(*args), without an intermediate argument tuple where the
+ * python version allows.
+ */
+static PyObject* call_positional(PyObject *callable, PyObject **args, Py_ssize_t nargs) {
+#if PY_VERSION_HEX >= 0x03090000
+    return PyObject_Vectorcall(callable, args, nargs, NULL);
+#else
+    Py_ssize_t i;
+    PyObject *res, *tuple = PyTuple_New(nargs);
+    if (unlikely(!tuple)) return NULL;
+
+    for (i = 0; i < nargs; i++) {
+        Py_INCREF(args[i]);
+        PyTuple_SET_ITEM(tuple, i, args[i]);
+    }
+
+    res = PyObject_Call(callable, tuple, NULL);
+    Py_DECREF(tuple);
+    return res;
+#endif
+}
+
+/*
+ * Calls handler(target=..., option=..., names=..., values=...).
+ */
+static PyObject* call_handler(PyObject *handler, PyObject **args) {
+    INIT_ATTR(py_attr_target_name, "target", return NULL);
+    INIT_ATTR(py_attr_option_name, "option", return NULL);
+    INIT_ATTR(py_attr_names_name, "names", return NULL);
+    INIT_ATTR(py_attr_values_name, "values", return NULL);
+
+#if PY_VERSION_HEX >= 0x03090000
+    if (unlikely(!py_handler_kwnames)) {
+        py_handler_kwnames = PyTuple_Pack(4, py_attr_target_name,
+                                          py_attr_option_name,
+                                          py_attr_names_name,
+                                          py_attr_values_name);
+        if (!py_handler_kwnames) return NULL;
+    }
+
+    return PyObject_Vectorcall(handler, args, 0, py_handler_kwnames);
+#else
+    if (unlikely(!py_empty_tuple)) {
+        py_empty_tuple = PyTuple_New(0);
+        if (!py_empty_tuple) return NULL;
+    }
+
+    PyObject *res, *kwargs = PyDict_New();
+    if (unlikely(!kwargs)) return NULL;
+
+    if (PyDict_SetItem(kwargs, py_attr_target_name, args[0]) ||
+        PyDict_SetItem(kwargs, py_attr_option_name, args[1]) ||
+        PyDict_SetItem(kwargs, py_attr_names_name, args[2]) ||
+        PyDict_SetItem(kwargs, py_attr_values_name, args[3])) {
+        Py_DECREF(kwargs);
+        return NULL;
+    }
+
+    res = PyObject_Call(handler, py_empty_tuple, kwargs);
+    Py_DECREF(kwargs);
+    return res;
+#endif
+}
+
 /*
  * Callback function which is invoked by target handlers within the C yyparse()
- * function. This callback function will return parser._handle's python object
+ * function. This callback function will return the handler's python object
  * or, on failure, NULL is returned.
+ *
+ * `handlers` is the tuple of the parser's handlers, as resolved by
+ * BisonParser._handler_table() before the parser engine runs, and `rule` the
+ * index of the reduction's entry:
+ *
+ *     (handler, call, target, option, hook, names)
+ *
+ * Unless call is False, the handler is the parser's on_<target> method, which
+ * gets called right away, like BisonParser._handle would do: with keyword
+ * arguments if call is True, otherwise positionally, with the arguments
+ * picked by the indices in the call tuple. If call is False, the handler is
+ * BisonParser._handle itself.
+ *
+ * The variable arguments are the `nargs` values of the right-hand side
+ * symbols, whose names are the (interned) `names` tuple of the entry. So the
+ * values tuple is the only object allocated here for a reduction.
  */
-PyObject* py_callback(PyObject *parser, char *target, int option, int nargs, ...) {
+PyObject* py_callback(PyObject *parser, PyObject *handlers, int rule, int nargs, ...) {
     va_list ap;
     int i;
 
     PyObject *res;
+    PyObject *values = PyTuple_New(nargs);
 
-    PyObject *names = PyList_New(nargs),
-        *values = PyList_New(nargs);
+    if (unlikely(!values)) return NULL;
 
     va_start(ap, nargs);
 
-    // Construct the names and values list from the variable argument list.
+    // Construct the values tuple from the variable argument list.
     for(i = 0; i < nargs; i++) {
-      #ifdef PY3
-        PyObject *name = PyUnicode_FromString(va_arg(ap, char *));
-      #else
-        PyObject *name = PyString_FromString(va_arg(ap, char *));
-      #endif
-        if(!name){
-          Py_INCREF(Py_None);
-          name = Py_None;
-        }
-        PyList_SetItem(names, i, name);
-
         PyObject *value = va_arg(ap, PyObject *);
         if(!value){
-          Py_INCREF(Py_None);
           value = Py_None;
         }
         Py_INCREF(value);
-        PyList_SetItem(values, i, value);
+        PyTuple_SET_ITEM(values, i, value);
     }
 
     va_end(ap);
 
-    INIT_ATTR(py_attr_handle_name, "_handle", return NULL);
-    INIT_ATTR(py_attr_hook_handler_name, "hook_handler", return NULL);
-
-    // Call the handler with the arguments
-    PyObject *handle = PyObject_GetAttr(parser, py_attr_handle_name);
-
-    if (unlikely(!handle)) return NULL;
-
-    PyObject *arglist = Py_BuildValue("(siOO)", target, option, names, values);
-    if (unlikely(!arglist)) { Py_DECREF(handle); return NULL; }
-
-    res = PyObject_CallObject(handle, arglist);
-
-    Py_DECREF(handle);
-    Py_DECREF(arglist);
+    INIT_ATTR(py_attr_last_name, "last", goto failed);
+
+    PyObject *entry = PyTuple_GET_ITEM(handlers, rule);
+    PyObject *handler = PyTuple_GET_ITEM(entry, 0);
+    PyObject *hook = PyTuple_GET_ITEM(entry, 4);
+
+    // target, option, names, values, and room for the handler's result
+    PyObject *args[5] = {
+        PyTuple_GET_ITEM(entry, 2),
+        PyTuple_GET_ITEM(entry, 3),
+        PyTuple_GET_ITEM(entry, 5),
+        values,
+        NULL
+    };
+
+    PyObject *call = PyTuple_GET_ITEM(entry, 1);
+
+    if (call != Py_False) {
+        if (call == Py_True) {
+            res = call_handler(handler, args);
+        } else {
+            // positional handler, asking for some of the four arguments
+            PyObject *picked[4];
+            Py_ssize_t n = PyTuple_GET_SIZE(call);
+            for (i = 0; i < n; i++)
+                picked[i] = args[PyLong_AS_LONG(PyTuple_GET_ITEM(call, i))];
+            res = call_positional(handler, picked, n);
+        }
 
-    if (unlikely(!res)) return res;
+        // as in BisonParser._handle, exceptions raised by the handler are
+        // passed on as the target's value
+        if (unlikely(!res)) {
+            if (!PyErr_ExceptionMatches(PyExc_Exception)) goto failed;
+
+            PyObject *type, *traceback;
+            PyErr_Fetch(&type, &res, &traceback);
+            PyErr_NormalizeException(&type, &res, &traceback);
+            if (traceback) PyException_SetTraceback(res, traceback);
+            Py_XDECREF(type);
+            Py_XDECREF(traceback);
+        }
 
-    // Check if the "hook_handler" callback exists
-    handle = PyObject_GetAttr(parser, py_attr_hook_handler_name);
+        if (unlikely(PyObject_SetAttr(parser, py_attr_last_name, res))) {
+            Py_DECREF(res);
+            goto failed;
+        }
+    } else {
+        res = call_positional(handler, args, 4);
+        if (unlikely(!res)) goto failed;
+    }
 
-    if (!handle) {
-        PyErr_Clear();
-        return res;
+    // Call the "hook_handler" callback, if the parser has one
+    if (hook != Py_None) {
+        args[4] = res;
+        PyObject *hooked = call_positional(hook, args, 5);
+        Py_DECREF(res);
+        res = hooked;
     }
 
-    // XXX: PyObject_GetAttr increases the refcnt of py_attr_hook_handler_name
-    // by one.
-    //debug_refcnt(py_attr_hook_handler_name, 1);
+    Py_DECREF(values);
+    return res;
 
-    // Call the "hook_handler" callback
-    arglist = Py_BuildValue("(siOOO)", target, option, names, values, res);
-    if (unlikely(!arglist)) { Py_DECREF(handle); return res; }
+failed:
+    Py_DECREF(values);
+    return NULL;
+}
 
-    res = PyObject_CallObject(handle, arglist);
+/*
+ * Releases the methods resolved by py_input_begin().
+ */
+void py_input_end(bison_input_state *state) {
+    Py_CLEAR(state->read);
+    Py_CLEAR(state->readinto);
+    Py_CLEAR(state->hook_before);
+    Py_CLEAR(state->hook_after);
+}
 
-    PyObject *exc = PyErr_Occurred();
-    if(unlikely(exc)){
-      printf("exception in callback!!\n");
-      return NULL;
+/*
+ * Prepares `state` for py_input() reading the input of a parser run:
+ * resolves the parser's read() method and read hooks once, rather than on
+ * every read. With `normalize`, CRLF and CR newlines are replaced by LF
+ * while copying the blocks returned by read() into flex's buffer.
+ *
+ * Unless `readinto` is None, py_input() calls it rather than read(), to
+ * read the blocks straight into flex's buffer.
+ *
+ * Every run has a state of its own, so parsers may run in several threads
+ * at once. Release it with py_input_end(), even if this fails.
+ *
+ * Returns 0, or -1 with an exception set.
+ */
+int py_input_begin(bison_input_state *state, PyObject *parser, int normalize,
+                   PyObject *readinto) {
+    memset(state, 0, sizeof(*state));
+
+    INIT_ATTR(py_attr_hook_read_after_name, "hook_read_after", return -1);
+    INIT_ATTR(py_attr_hook_read_before_name, "hook_read_before", return -1);
+    INIT_ATTR(py_attr_read_name, "read", return -1);
+    INIT_ATTR(py_attr_file_name, "file", return -1);
+    INIT_ATTR(py_attr_input_marker, "marker", return -1);
+
+    state->parser = parser;
+    state->read = PyObject_GetAttr(parser, py_attr_read_name);
+    if (unlikely(!state->read)) return -1;
+
+    state->hook_before = PyObject_GetAttr(parser, py_attr_hook_read_before_name);
+    if (!state->hook_before) PyErr_Clear();
+    state->hook_after = PyObject_GetAttr(parser, py_attr_hook_read_after_name);
+    if (!state->hook_after) PyErr_Clear();
+
+    if (readinto != Py_None) {
+        state->readinto = readinto;
+        Py_INCREF(readinto);
     }
-    Py_DECREF(handle);
-    Py_DECREF(arglist);
 
-    return res;
+    state->has_file = PyObject_HasAttr(parser, py_attr_file_name);
+    state->normalize = normalize;
+    return 0;
 }
 
-void py_input(PyObject *parser, char *buf, int *result, int max_size) {
-    PyObject *handle, *arglist, *res;
-    char *bufstr;
-
-    INIT_ATTR(py_attr_hook_read_after_name, "hook_read_after", return);
-    INIT_ATTR(py_attr_hook_read_before_name, "hook_read_before", return);
-    INIT_ATTR(py_attr_read_name, "read", return);
-    INIT_ATTR(py_attr_file_name, "file", return);
-    INIT_ATTR(py_attr_input_marker, "marker", return);
-    INIT_ATTR(py_attr_close_name, "close", return);
-
-    // Check if the "hook_READ_BEFORE" callback exists
-    if (PyObject_HasAttr(parser, py_attr_hook_read_before_name))
-    {
-        handle = PyObject_GetAttr(parser, py_attr_hook_read_before_name);
-        if (unlikely(!handle)) return;
+/*
+ * Reads at most `max_size` bytes into `buf`, by calling `readinto` with a
+ * memoryview of it. Returns the number of bytes read, 0 at the end of the
+ * input (or if a non-blocking file has no data), or -1 with an exception
+ * set.
+ */
+static Py_ssize_t read_into(PyObject *readinto, char *buf, int max_size) {
+    PyObject *view, *res;
+    Py_ssize_t len;
+
+    view = PyMemoryView_FromMemory(buf, max_size, PyBUF_WRITE);
+    if (unlikely(!view)) return -1;
+    res = call_positional(readinto, &view, 1);
+    Py_DECREF(view);
+    if (unlikely(!res)) return -1;
+
+    len = res == Py_None ? 0 : PyLong_AsSsize_t(res);
+    Py_DECREF(res);
+    if (unlikely(len == -1 && PyErr_Occurred())) return -1;
+    if (unlikely(len < 0 || len > max_size)) {
+        PyErr_Format(PyExc_ValueError, "readinto() returned %zd", len);
+        return -1;
+    }
+    return len;
+}
 
-        // Call the "hook_READ_BEFORE" callback
-        arglist = PyTuple_New(0);
-        if (unlikely(!arglist)) { Py_DECREF(handle); return; }
+/*
+ * Reads the next block of input into flex's buffer `buf`, by calling the
+ * parser's read() method, which may return bytes or any other object
+ * supporting the buffer protocol, or the file's readinto() method (see
+ * py_input_begin). Blocks may contain NUL bytes.
+ */
+void py_input(bison_input_state *state, char *buf, int *result, int max_size) {
+    PyObject *res, *arg;
+    Py_ssize_t len;
 
-        res = PyObject_CallObject(handle, arglist);
+    // nothing read, unless a block is copied below (flex takes that for the
+    // end of the input, and finds any exception raised once parsing ends)
+    *result = 0;
 
-        Py_DECREF(handle);
-        Py_DECREF(arglist);
+    if (unlikely(!state || !state->read)) {
+        PyErr_SetString(PyExc_RuntimeError, "py_input() called outside of a parser run");
+        return;
+    }
 
+read_block:
+    // Call the "hook_READ_BEFORE" callback, if the parser has one
+    if (state->hook_before) {
+        res = call_positional(state->hook_before, NULL, 0);
         if (unlikely(!res)) return;
+        Py_DECREF(res);
     }
 
-    // Read the input string and catch keyboard interrupt exceptions.
-    handle = PyObject_GetAttr(parser, py_attr_read_name);
-    if (unlikely(!handle)) return;
-
-    arglist = Py_BuildValue("(i)", max_size);
-    if (unlikely(!arglist)) { Py_DECREF(handle); return; }
-
-    res = PyObject_CallObject(handle, arglist);
-
-    Py_DECREF(handle);
-    Py_DECREF(arglist);
+    if (state->readinto) {
+        len = read_into(state->readinto, buf, max_size);
+        res = NULL;
+    } else {
+        // Read the input string
+        arg = PyLong_FromLong(max_size);
+        if (unlikely(!arg)) return;
+
+        res = call_positional(state->read, &arg, 1);
+        Py_DECREF(arg);
+        len = res ? 0 : -1;
+    }
 
-    if (unlikely(!res)) {
+    if (unlikely(len < 0)) {
         // Catch and reset KeyboardInterrupt exception
         PyObject *given = PyErr_Occurred();
         if (given && PyErr_GivenExceptionMatches(given, PyExc_KeyboardInterrupt)) {
@@ -211,60 +388,59 @@ void py_input(PyObject *parser, char *buf, int *result, int max_size) {
         return;
     }
 
-    // Check if the "hook_read_after" callback exists
-    if (unlikely(!PyObject_HasAttr(parser, py_attr_hook_read_after_name)))
-        goto finish_input;
-
-    handle = PyObject_GetAttr(parser, py_attr_hook_read_after_name);
-    if (unlikely(!handle)) return;
-
-    // Call the "hook_READ_AFTER" callback
-    arglist = Py_BuildValue("(O)", res);
-    if (unlikely(!arglist)) { Py_DECREF(handle); return; }
-
-    res = PyObject_CallObject(handle, arglist);
-
-    Py_XDECREF(res);
-    Py_DECREF(handle);
-    Py_DECREF(arglist);
-
-    if (unlikely(!res)) return;
-
-finish_input:
+    if (res) {
+        // Call the "hook_READ_AFTER" callback, if the parser has one, with
+        // bytes (readinto() is not used along with it)
+        if (state->hook_after) {
+            if (!PyBytes_Check(res)) {
+                PyObject *data = PyBytes_FromObject(res);
+                Py_DECREF(res);
+                if (unlikely(!data)) return;
+                res = data;
+            }
+
+            arg = res;
+            res = call_positional(state->hook_after, &arg, 1);
+            Py_DECREF(arg);
+
+            if (unlikely(!res)) return;
+        }
 
-    // Copy the read python input string to the buffer
-    #ifdef PY3
-    bufstr = PyBytes_AsString(res);
-    #else
-    bufstr = PyString_AsString(res);
-    #endif
+        // Copy the read block to the buffer, at most max_size bytes of it
+        if (PyBytes_Check(res)) {
+            len = PyBytes_GET_SIZE(res);
+            if (len > max_size) len = max_size;
+            memcpy(buf, PyBytes_AS_STRING(res), len);
+        } else {
+            Py_buffer view;
+            if (PyObject_GetBuffer(res, &view, PyBUF_SIMPLE) < 0) { Py_DECREF(res); return; }
+            len = view.len < max_size ? view.len : max_size;
+            memcpy(buf, view.buf, len);
+            PyBuffer_Release(&view);
+        }
+        Py_DECREF(res);
+    }
 
-    if(!bufstr){
-      return;
+    if (state->normalize && len) {
+        size_t n = bison_input_normalize_newlines(buf, (size_t)len, &state->pending_cr);
+        // the block held just the LF of a CRLF split by the previous block,
+        // which is not the end of the input yet
+        if (!n)
+            goto read_block;
+        len = (Py_ssize_t)n;
     }
-    *result = strlen(bufstr);
-    memcpy(buf, bufstr, *result);
+    *result = (int)len;
 
     // Close the read buffer if nothing is read. Marks the Python file object
     // as being closed from Python's point of view. This does not close the
     // associated C stream (which is not necessary here, otherwise use
     // "os.close(0)").
-    if (!*result && PyObject_HasAttr(parser, py_attr_file_name)) {
-        // don't mark the file as closed
-        // set a marker that there is no more input
-        PyObject *marker_handle = PyObject_GetAttr(parser, py_attr_input_marker);
-        if (unlikely(!marker_handle)) return;
-        // create a int object containing a '1'
-        PyObject* po_long1 = PyLong_FromLong(1);
-        // execute attribute setting
-        int success = PyObject_SetAttr(parser, py_attr_input_marker, po_long1);
-        if (success != 0)
-            return;
-        Py_DECREF(marker_handle);
-        Py_DECREF(po_long1);
-
-        // TODO: something went wrong while closing the buffer.
-        if (unlikely(!res)) return;
-        Py_XDECREF(res);
+    if (!*result && state->has_file) {
+        // don't mark the file as closed, but set a marker that there is no
+        // more input (small ints are cached, so this allocates nothing)
+        PyObject *one = PyLong_FromLong(1);
+        if (unlikely(!one)) return;
+        PyObject_SetAttr(state->parser, py_attr_input_marker, one);
+        Py_DECREF(one);
     }
 }
@@ -1,5 +1,22 @@
 #include "Python.h"
 #include "stdarg.h"
 
-PyObject* py_callback(PyObject *, char *, int, int,...);
-void py_input(PyObject *, char *, int *, int);
+/*
+ * State of the input of a parser run, set up by py_input_begin(), and
+ * passed to py_input() by the engine.
+ */
+typedef struct {
+    PyObject *parser;       // the parser (borrowed)
+    PyObject *read;         // its read() method
+    PyObject *readinto;     // readinto() of its file, used instead, or NULL
+    PyObject *hook_before;  // its hook_read_before() method, or NULL
+    PyObject *hook_after;   // its hook_read_after() method, or NULL
+    int has_file;           // the parser has a file attribute
+    int normalize;          // replace CRLF and CR newlines by LF
+    int pending_cr;         // the last block ended with a CR
+} bison_input_state;
+
+PyObject* py_callback(PyObject *, PyObject *, int, int,...);
+void py_input(bison_input_state *, char *, int *, int);
+int py_input_begin(bison_input_state *, PyObject *, int, PyObject *);
+void py_input_end(bison_input_state *);
@@ -0,0 +1,167 @@
+/*
+ * Input routines of the parser engines.
+ *
+ * Files are loaded into buffers which flex can scan in place, i.e. which
+ * are writable and followed by two NUL bytes (see yy_scan_buffer), either
+ * by mapping them into memory, or by reading them in one go.
+ *
+ * Released under the GNU General Public License, a copy of which should appear
+ * in this distribution in the file called 'COPYING'. If this file is missing,
+ * then you can obtain a copy of the GPL license document from the GNU website
+ * at http://www.gnu.org.
+ *
+ * This software is released with no warranty whatsoever. Use it at your own
+ * risk.
+ */
+
+#include "bison_input.h"
+
+#include <errno.h>
+#include <stdlib.h>
+#include <string.h>
+
+#ifdef _WIN32
+#include <io.h>
+#define read _read
+#else
+#include <sys/mman.h>
+#include <unistd.h>
+#endif
+
+/*
+ * Maps `size` bytes of the file `fd` privately (copy-on-write) into memory,
+ * followed by at least two NUL bytes. The file is mapped over an anonymous
+ * mapping, whose pages beyond the end of the file read as zeros.
+ *
+ * Returns the buffer and sets `mapped` to the length of the mapping, or
+ * returns NULL and sets errno.
+ */
+char *bison_input_map(int fd, size_t size, size_t *mapped) {
+#ifdef _WIN32
+    errno = ENOSYS;
+    return NULL;
+#else
+    size_t page = (size_t)sysconf(_SC_PAGESIZE);
+    size_t length = (size + 2 + page - 1) / page * page;
+    char *buf;
+
+    buf = mmap(NULL, length, PROT_READ | PROT_WRITE,
+               MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+    if (buf == MAP_FAILED)
+        return NULL;
+
+    if (size && mmap(buf, size, PROT_READ | PROT_WRITE,
+                     MAP_PRIVATE | MAP_FIXED, fd, 0) == MAP_FAILED) {
+        int err = errno;
+        munmap(buf, length);
+        errno = err;
+        return NULL;
+    }
+
+#ifdef MADV_SEQUENTIAL
+    madvise(buf, length, MADV_SEQUENTIAL);
+#endif
+
+    *mapped = length;
+    return buf;
+#endif
+}
+
+void bison_input_unmap(char *buf, size_t mapped) {
+#ifndef _WIN32
+    munmap(buf, mapped);
+#endif
+}
+
+/*
+ * Reads up to `size` bytes of the file `fd` into a new buffer, followed by
+ * two NUL bytes. Does not need the GIL.
+ *
+ * Returns the buffer, to be freed with bison_input_free(), and sets `got` to
+ * the number of bytes read, or returns NULL and sets errno.
+ */
+char *bison_input_read(int fd, size_t size, size_t *got) {
+    char *buf = malloc(size + 2);
+    size_t pos = 0;
+
+    if (!buf)
+        return NULL;
+
+    while (pos < size) {
+        size_t want = size - pos;
+        long n;
+
+        // stay within what read() can handle in one call everywhere
+        if (want > 0x40000000)
+            want = 0x40000000;
+        n = read(fd, buf + pos, (unsigned int)want);
+        if (n < 0) {
+            if (errno == EINTR)
+                continue;
+            free(buf);
+            return NULL;
+        }
+        if (n == 0)
+            break;
+        pos += (size_t)n;
+    }
+
+    buf[pos] = buf[pos + 1] = '\0';
+    *got = pos;
+    return buf;
+}
+
+void bison_input_free(char *buf) {
+    free(buf);
+}
+
+/*
+ * Replaces CRLF and CR newlines of the `len` bytes at `buf` by LF in place,
+ * like BisonParser.read() used to do.
+ *
+ * The input may come in blocks, so a CR ending a block may be the first
+ * half of a CRLF: it becomes a LF right away, and `pending_cr` is set to
+ * drop a LF starting the next block. Pass the same flag, initially zero,
+ * for all blocks of an input.
+ *
+ * Returns the new length, which is zero for a block holding just the LF of
+ * a split CRLF.
+ */
+size_t bison_input_normalize_newlines(char *buf, size_t len, int *pending_cr) {
+    char *src = buf;
+    char *end = buf + len;
+    char *dst;
+
+    if (*pending_cr && len) {
+        *pending_cr = 0;
+        if (*src == '\n')
+            src++;
+    }
+
+    dst = src;
+    src = memchr(src, '\r', end - src);
+    if (!src) {
+        if (dst != buf)
+            memmove(buf, dst, end - dst);
+        return (size_t)(end - dst);
+    }
+
+    // move the part before the first CR into place
+    if (dst != buf)
+        memmove(buf, dst, src - dst);
+    dst = buf + (src - dst);
+
+    for (; src < end; src++) {
+        if (*src == '\r') {
+            *dst++ = '\n';
+            if (src + 1 == end)
+                *pending_cr = 1;
+            else if (src[1] == '\n')
+                src++;
+        } else {
+            *dst++ = *src;
+        }
+    }
+
+    return (size_t)(dst - buf);
+}
@@ -0,0 +1,11 @@
+/*
+ * common interface to the input routines of the parser engines
+ */
+
+#include <stddef.h>
+
+char *bison_input_map(int fd, size_t size, size_t *mapped);
+void bison_input_unmap(char *buf, size_t mapped);
+char *bison_input_read(int fd, size_t size, size_t *got);
+void bison_input_free(char *buf);
+size_t bison_input_normalize_newlines(char *buf, size_t len, int *pending_cr);
@@ -6,22 +6,21 @@
 #include <stdio.h>
 #include <dlfcn.h>
 
-void (*reset_flex_buffer)(void) = NULL;
-
 void *bisondynlib_open(char *filename) {
     void *handle;
 
-    handle = dlopen(filename, (RTLD_NOW|RTLD_GLOBAL));
+    /*
+     * RTLD_LOCAL: all engines define yyparse(), yylex(), py_parser etc., so
+     * their symbols must not become visible to engines loaded later on,
+     * which would then run the scanner of another parser class.
+     */
+    handle = dlopen(filename, (RTLD_NOW|RTLD_LOCAL));
 
     dlerror();
 
     if (!handle)
         return NULL;
 
-    reset_flex_buffer = dlsym(handle, "reset_flex_buffer");
-
-    dlerror();
-
     return handle;
 }
 
@@ -29,10 +28,15 @@ int bisondynlib_close(void *handle) {
     return dlclose(handle);
 }
 
-void bisondynlib_reset(void) {
-    if (reset_flex_buffer) {
-        reset_flex_buffer();
-    }
+/*
+ * Returns the optional reset_flex_buffer() function of the engine, or NULL.
+ */
+void (*bisondynlib_lookup_reset(void *handle))(void) {
+    void (*reset_flex_buffer)(void) = dlsym(handle, "reset_flex_buffer");
+
+    dlerror();
+
+    return reset_flex_buffer;
 }
 
 char *bisondynlib_err() {
@@ -49,39 +53,71 @@ char *bisondynlib_lookup_hash(void *handle) {
     return hash ? *hash : NULL;
 }
 
-PyObject *bisondynlib_run(void *handle, PyObject *parser, void *cb, void *in, int debug) {
-    if(!handle)
+/*
+ * Runs the engine's do_parse() function, as returned by
+ * bisondynlib_lookup_parser(), which reads its input by calling `in` with
+ * the run's `input` state.
+ */
+PyObject *bisondynlib_run(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in, void *input, int debug) {
+    if (!pparser) {
+        PyErr_SetString(PyExc_RuntimeError, "bisondynlib_lookup_parser() returned NULL");
+        return NULL;
+    }
+
+    (*(void (*)(PyObject *, PyObject *, void *, void *, void *, int))pparser)(parser, handlers, cb, in, input, debug);
+
+    // Do not ignore a raised exception, but pass the exception through.
+    if (PyErr_Occurred()) {
         return NULL;
+    }
 
-    PyObject *(*pparser)(PyObject *, void *, void *, int);
+    Py_INCREF(Py_None);
+    return Py_None;
 
-    pparser = bisondynlib_lookup_parser(handle);
+}
 
+/*
+ * Runs the engine's do_parse_buffer() function, as returned by
+ * bisondynlib_lookup_buffer_parser(), on the `len` bytes at `buf`. Unless
+ * NULL, `span` creates the values of span tokens over the buffer, pinned
+ * by `source`.
+ */
+PyObject *bisondynlib_run_buffer(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in,
+                                 void *span, void *source, char *buf, size_t len, int inplace, int debug) {
     if (!pparser) {
-        PyErr_SetString(PyExc_RuntimeError, "bisondynlib_lookup_parser() returned NULL");
+        PyErr_SetString(PyExc_RuntimeError, "bisondynlib_lookup_buffer_parser() returned NULL");
         return NULL;
     }
 
-    (*pparser)(parser, cb, in, debug);
+    (*(void (*)(PyObject *, PyObject *, void *, void *, void *, void *, char *, size_t, int, int))pparser)(
+        parser, handlers, cb, in, span, source, buf, len, inplace, debug);
 
-    // Do not ignore a raised exception, but pass the exception through.
     if (PyErr_Occurred()) {
         return NULL;
     }
 
     Py_INCREF(Py_None);
     return Py_None;
-
 }
 
 /*
- * function(void *) returns a pointer to a function(PyObject *, char *)
- * returning PyObject*
+ * Returns a pointer to the engine's do_parse() function.
  */
-PyObject *(*bisondynlib_lookup_parser(void *handle))(PyObject *, void *, void *, int) {
-    PyObject *(*do_parse)(PyObject *, void *, void *, int) = dlsym(handle, "do_parse");
+void *bisondynlib_lookup_parser(void *handle) {
+    void *do_parse = dlsym(handle, "do_parse");
 
     dlerror();
 
     return do_parse;
 }
+
+/*
+ * Returns a pointer to the engine's do_parse_buffer() function.
+ */
+void *bisondynlib_lookup_buffer_parser(void *handle) {
+    void *do_parse_buffer = dlsym(handle, "do_parse_buffer");
+
+    dlerror();
+
+    return do_parse_buffer;
+}
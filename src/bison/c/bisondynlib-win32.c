@@ -8,13 +8,10 @@
 #include "windows.h"
 
 
-void (*reset_flex_buffer)(void) = NULL;
-
 void * bisondynlib_open(char *filename) {
     HINSTANCE hinstLib;
 
     hinstLib = LoadLibrary(filename);
-    reset_flex_buffer = (void (*)(void)) GetProcAddress(hinstLib, "reset_flex_buffer");
     return (void *)hinstLib;
 }
 
@@ -26,9 +23,11 @@ char * bisondynlib_err() {
     return NULL;
 }
 
-void bisondynlib_reset(void) {
-    if (reset_flex_buffer)
-        reset_flex_buffer();
+/*
+ * Returns the optional reset_flex_buffer() function of the engine, or NULL.
+ */
+void (*bisondynlib_lookup_reset(void *handle))(void) {
+    return (void (*)(void)) GetProcAddress((HINSTANCE)handle, "reset_flex_buffer");
 }
 
 char * bisondynlib_lookup_hash(void *handle) {
@@ -39,23 +38,45 @@ char * bisondynlib_lookup_hash(void *handle) {
     return hash;
 }
 
-PyObject * bisondynlib_run(void *handle, PyObject *parser, void *cb, void *in, int debug) {
-  PyObject *(*pparser)(PyObject *, void *, void *, int);
-    pparser = bisondynlib_lookup_parser(handle);
-    (*pparser)(parser, cb, in, debug);
+PyObject * bisondynlib_run(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in, void *input, int debug) {
+    if (!pparser) {
+        PyErr_SetString(PyExc_RuntimeError, "bisondynlib_lookup_parser() returned NULL");
+        return NULL;
+    }
+    (*(void (*)(PyObject *, PyObject *, void *, void *, void *, int))pparser)(parser, handlers, cb, in, input, debug);
+    if (PyErr_Occurred()){
+        return NULL;
+    }
+    Py_INCREF(Py_None);
+    return Py_None;
+
+}
+
+PyObject * bisondynlib_run_buffer(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in,
+                                  void *span, void *source, char *buf, size_t len, int inplace, int debug) {
+    if (!pparser) {
+        PyErr_SetString(PyExc_RuntimeError, "bisondynlib_lookup_buffer_parser() returned NULL");
+        return NULL;
+    }
+    (*(void (*)(PyObject *, PyObject *, void *, void *, void *, void *, char *, size_t, int, int))pparser)(
+        parser, handlers, cb, in, span, source, buf, len, inplace, debug);
     if (PyErr_Occurred()){
         return NULL;
     }
     Py_INCREF(Py_None);
     return Py_None;
+}
 
+/*
+ * Returns a pointer to the engine's do_parse() function.
+ */
+void * bisondynlib_lookup_parser(void *handle) {
+    return (void *)GetProcAddress((HINSTANCE)handle, "do_parse");
 }
 
 /*
- * function(void *) returns a pointer to a function(PyObject *, char *) returning PyObject*
+ * Returns a pointer to the engine's do_parse_buffer() function.
  */
-PyObject *(*bisondynlib_lookup_parser(void *handle))(PyObject *, void *, void *, int) {
-    PyObject *(*pparser)(PyObject *, void *, void *, int);
-    pparser = (PyObject *(*)(PyObject *, void *, void *, int))GetProcAddress((HINSTANCE)handle, "do_parse");
-    return pparser;
+void * bisondynlib_lookup_buffer_parser(void *handle) {
+    return (void *)GetProcAddress((HINSTANCE)handle, "do_parse_buffer");
 }
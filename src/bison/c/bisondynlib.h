@@ -7,11 +7,14 @@
 
 void *bisondynlib_open(char *filename);
 int bisondynlib_close(void *handle);
-void bisondynlib_reset(void);
 char *bisondynlib_err(void);
 
-PyObject *(*bisondynlib_lookup_parser(void *handle))(PyObject *, void *, void *, int);
+void *bisondynlib_lookup_parser(void *handle);
+void *bisondynlib_lookup_buffer_parser(void *handle);
+void (*bisondynlib_lookup_reset(void *handle))(void);
 
 char *bisondynlib_lookup_hash(void *handle);
 
-PyObject *bisondynlib_run(void *handle, PyObject *parser, void *cb, void *in, int debug);
+PyObject *bisondynlib_run(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in, void *input, int debug);
+PyObject *bisondynlib_run_buffer(void *pparser, PyObject *parser, PyObject *handlers, void *cb, void *in,
+                                 void *span, void *source, char *buf, size_t len, int inplace, int debug);
@@ -0,0 +1,296 @@
+"""
+Content-addressed store for compiled parser engine libraries.
+
+Engines are stored under a key which covers everything that goes into a
+build (grammar, lex script, options, compiler flags, python ABI and the
+bison/flex versions), so that parser classes, processes and hosts sharing
+the same cache directory can reuse each other's engines instead of
+running bison, flex and the C compiler again.
+
+Released under the GNU General Public License, a copy of which should appear in
+this distribution in the file called 'COPYING'. If this file is missing, then
+you can obtain a copy of the GPL license document from the GNU website at
+http://www.gnu.org.
+
+This software is released with no warranty whatsoever. Use it at your own
+risk.
+"""
+import contextlib
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+from importlib import machinery
+
+if sys.platform == 'win32':
+    import msvcrt
+else:
+    import fcntl
+
+LOGGER = logging.getLogger(__name__)
+
+
+# Root directory of the engine cache, unless overridden by the parser.
+DEFAULT_CACHE_DIRECTORY = os.environ.get(
+    'PYBISON_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'pybison', 'cache')
+)
+
+# Maximum size in bytes of all engines in the cache, unless overridden by
+# the parser.
+DEFAULT_CACHE_MAX_SIZE = int(os.environ.get('PYBISON_CACHE_MAX_SIZE',
+                                            256 * 1024 * 1024))
+
+
+class EngineCache(object):
+    """
+    Directory of engine libraries, keyed by the engine cache key.
+
+    Every engine is stored as '<root>/<key><extension suffix>', so that a
+    lookup is a single stat of that file. The modification time of the file
+    records its last use, and the index file '<root>/index.json' the sizes
+    of all engines, which is only read and written when engines are stored
+    or removed. Once the cache grows beyond 'maxSize' bytes, the least
+    recently used engines are evicted, along with their lock files.
+
+    The index is only bookkeeping: an engine file that exists but is
+    missing from the index (e.g. written by another host sharing the
+    directory) is adopted by the next store.
+
+    Files belonging to an engine, like its profile data, can be stored
+    alongside it by passing a `suffix`, which replaces the extension
+    suffix of the engine's filename. They are indexed (and evicted) like
+    engines, under '<key><suffix>'.
+
+    Engines are published with an atomic rename, and updates of the index
+    are serialized by a lock file, so the cache can be shared by any number
+    of processes. Builds of the same engine are serialized with lock(key).
+    """
+
+    indexName = 'index.json'
+
+    def __init__(self, root=None, maxSize=None):
+        self.root = os.path.abspath(root or DEFAULT_CACHE_DIRECTORY)
+        self.maxSize = DEFAULT_CACHE_MAX_SIZE if maxSize is None else maxSize
+        self.indexFile = os.path.join(self.root, self.indexName)
+
+    def path(self, key, suffix=None):
+        """Returns the filename of the engine stored under `key`."""
+        if suffix is None:
+            suffix = machinery.EXTENSION_SUFFIXES[0]
+        return os.path.join(self.root, key + suffix)
+
+    def lookup(self, key, suffix=None):
+        """
+        Returns the filename of the engine stored under `key`, or None if
+        there is no such engine. Marks the engine as recently used.
+        """
+        filename = self.path(key, suffix)
+        try:
+            os.utime(filename)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            # a read-only cache is still usable for lookups
+            if not os.path.isfile(filename):
+                return None
+        return filename
+
+    def store(self, key, filename, suffix=None):
+        """
+        Copies the engine library `filename` into the cache under `key`,
+        evicting least recently used engines if the cache grows too big.
+
+        Returns the filename of the cached engine.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        target = self.path(key, suffix)
+
+        # copy next to the target first, so the engine shows up atomically
+        fd, tmpname = tempfile.mkstemp(prefix='.' + key, dir=self.root)
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmpname)
+            os.replace(tmpname, target)
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+        entryKey = self._entryKey(key, suffix)
+        with self._lockedIndex() as index:
+            index[entryKey] = self._entry(os.path.getsize(target), suffix)
+            self._adopt(index)
+            self._evict(index, keep=entryKey)
+        return target
+
+    def remove(self, key, suffix=None):
+        """Removes the engine stored under `key` from the cache."""
+        entryKey = self._entryKey(key, suffix)
+        with self._lockedIndex() as index:
+            index.pop(entryKey, None)
+            self._unlink(entryKey, self._entry(0, suffix))
+
+    def clear(self):
+        """Removes all engines from the cache."""
+        with self._lockedIndex() as index:
+            self._adopt(index)
+            for key, entry in index.items():
+                self._unlink(key, entry, lock=True)
+            index.clear()
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """
+        Context manager holding an exclusive, cross-process lock for `key`.
+
+        Used to make sure that only one process builds a given engine, while
+        all others wait for it and then load the published engine.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, key + '.lock'), 'a+b') as f:
+            _lockFile(f)
+            try:
+                yield
+            finally:
+                _unlockFile(f)
+
+    def size(self):
+        """Returns the total size in bytes of all engines."""
+        index = self._readIndex()
+        self._adopt(index)
+        return sum(entry['size'] for entry in index.values())
+
+    def _adopt(self, index):
+        """Adds the engines missing from the index to it."""
+        suffix = machinery.EXTENSION_SUFFIXES[0]
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.name.endswith(suffix):
+                continue
+            key = entry.name[:-len(suffix)]
+            if key not in index:
+                LOGGER.debug("adopting unindexed engine {}".format(entry.path))
+                try:
+                    index[key] = self._entry(entry.stat().st_size, None)
+                except OSError:
+                    pass
+
+    def _lastUse(self, entryKey, entry):
+        """Returns the time of the last lookup or store of an entry."""
+        try:
+            return os.path.getmtime(self._filename(entryKey, entry))
+        except OSError:
+            return 0
+
+    def _evict(self, index, keep=None):
+        """Drops least recently used engines until the cache fits maxSize."""
+        total = sum(entry['size'] for entry in index.values())
+        if total <= self.maxSize:
+            return
+        lru = sorted(index, key=lambda k: self._lastUse(k, index[k]))
+        for key in lru:
+            if total <= self.maxSize:
+                break
+            if key == keep:
+                continue
+            LOGGER.info("evicting engine {} from cache".format(key))
+            entry = index.pop(key)
+            total -= entry['size']
+            self._unlink(key, entry, lock=True)
+
+    @staticmethod
+    def _entryKey(key, suffix):
+        return key if suffix is None else key + suffix
+
+    @staticmethod
+    def _entry(size, suffix):
+        entry = {'size': size}
+        if suffix is not None:
+            entry['suffix'] = suffix
+        return entry
+
+    def _filename(self, entryKey, entry):
+        if 'suffix' in entry:
+            return os.path.join(self.root, entryKey)
+        return self.path(entryKey)
+
+    def _unlink(self, entryKey, entry, lock=False):
+        """
+        Removes the file of an entry, and with `lock` also the lock file of
+        an engine. A process still waiting for the removed lock file at
+        worst builds the engine once more.
+        """
+        filenames = [self._filename(entryKey, entry)]
+        if lock and 'suffix' not in entry:
+            filenames.append(os.path.join(self.root, entryKey + '.lock'))
+        for filename in filenames:
+            try:
+                os.unlink(filename)
+            except OSError:
+                # already gone, or still mapped on platforms that do not allow
+                # removing loaded libraries
+                pass
+
+    @contextlib.contextmanager
+    def _lockedIndex(self):
+        """Context manager for a read-modify-write cycle of the index."""
+        with contextlib.ExitStack() as stack:
+            try:
+                stack.enter_context(self.lock('index'))
+                writable = True
+            except OSError as e:
+                # a read-only cache is still usable for lookups
+                LOGGER.debug("cannot lock engine cache index: {}".format(e))
+                writable = False
+
+            index = self._readIndex()
+            yield index
+            if writable:
+                self._writeIndex(index)
+
+    def _readIndex(self):
+        try:
+            with open(self.indexFile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _writeIndex(self, index):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd, tmpname = tempfile.mkstemp(prefix='.index', dir=self.root)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmpname, self.indexFile)
+        except OSError as e:
+            # a read-only cache is still usable for lookups
+            LOGGER.debug("cannot write engine cache index: {}".format(e))
+
+
+def _lockFile(f):
+    """Blocks until an exclusive lock on the open file `f` is acquired."""
+    if sys.platform == 'win32':
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                # LK_LOCK gives up after 10 seconds, keep waiting
+                continue
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlockFile(f):
+    if sys.platform == 'win32':
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
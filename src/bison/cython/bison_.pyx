@@ -8,6 +8,8 @@ LOGGER = logging.getLogger(__name__)
 
 cdef extern from "Python.h":
     object PyBytes_FromString(char *)
+    object PyBytes_FromStringAndSize(char *, Py_ssize_t)
+    object PyUnicode_DecodeUTF8(char *, Py_ssize_t, char *)
     object PyUnicode_FromString(char *)
     char *PyBytes_AsString(object o)
     object PyInt_FromLong(long ival)
@@ -50,20 +52,39 @@ cdef extern from "string.h":
 # Callback function which is invoked by target handlers
 # within the C yyparse() function.
 cdef extern from "../c/bison_callback.h":
-    object py_callback(object, char *, int, int,...)
-    void py_input(object, char *, int *, int)
+    ctypedef struct bison_input_state:
+        pass
+    object py_callback(object, object, int, int,...)
+    void py_input(bison_input_state *, char *, int *, int)
+    int py_input_begin(bison_input_state *, object, int, object) except -1
+    void py_input_end(bison_input_state *)
 
 cdef extern from "../c/bisondynlib.h":
     void *bisondynlib_open(char *filename)
     int bisondynlib_close(void *handle)
-    void bisondynlib_reset()
     char *bisondynlib_err()
-    object (*bisondynlib_lookup_parser(void *handle))(object, char *)
+    void *bisondynlib_lookup_parser(void *handle)
+    void *bisondynlib_lookup_buffer_parser(void *handle)
+    void (*bisondynlib_lookup_reset(void *handle))()
     char *bisondynlib_lookup_hash(void *handle)
-    object bisondynlib_run(void *handle, object parser, void *cb, void *pyin, int debug)
+    object bisondynlib_run(void *pparser, object parser, object handlers, void *cb, void *pyin,
+                           void *input, int debug)
+    object bisondynlib_run_buffer(void *pparser, object parser, object handlers, void *cb, void *pyin,
+                                  void *span, void *source, char *buf, size_t len, int inplace, int debug)
 
     #int bisondynlib_build(char *libName, char *includedir)
 
+cdef extern from "../c/bison_input.h":
+    char *bison_input_map(int fd, size_t size, size_t *mapped) nogil
+    void bison_input_unmap(char *buf, size_t mapped) nogil
+    char *bison_input_read(int fd, size_t size, size_t *got) nogil
+    void bison_input_free(char *buf) nogil
+    size_t bison_input_normalize_newlines(char *buf, size_t len, int *pending_cr) nogil
+
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE, PyBUF_WRITABLE
+from cpython.buffer cimport PyBuffer_FillInfo
+from libc.errno cimport errno
+
 
 import sys, os, hashlib, re, traceback
 import shutil
@@ -73,13 +94,210 @@ import sysconfig
 import subprocess
 from pathlib import Path
 from importlib import machinery
+import tempfile
 import textwrap
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import EngineCache
 
 reSpaces = re.compile("\\s+")
 
+# Version of the interface between this module and the generated engines
+# (do_parse and the callbacks), engines of other versions get rebuilt
+ENGINE_ABI = '10'
+
+# flex options of the scanner table profiles, see BisonParser.scanner_profile
+SCANNER_PROFILES = {
+    'compact': ['-Cem'],
+    'fast': ['-CF', '-8', '--never-interactive'],
+    'full': ['-Cf', '-8', '--never-interactive'],
+}
+
+# bison variables of the parser table settings, and their possible values,
+# see BisonParser.parser_tables
+PARSER_TABLES = {
+    'lr.type': ('lalr', 'ielr', 'canonical-lr'),
+    'lr.default-reduction': ('most', 'consistent', 'accepting'),
+}
+
+# Native rule actions (see BisonParser.native_actions), and the numbers of
+# arguments they take (None for any number)
+NATIVE_ACTIONS = {
+    'passthrough': (1,),
+    'tuple': None,
+    'list': (0, 1),
+    'list_append': (0, 1, 2),
+    'dict_from_pairs': (0, 1),
+    'none': (0,),
+}
+
+# C helpers building the values of native rule actions, added to the
+# prologue of the grammar file. Missing values (NULL) are taken as None, and
+# all helpers return a new reference, or NULL with an exception set.
+NATIVE_ACTIONS_C = r'''
+static PyObject *native_passthrough(PyObject *v)
+{
+    if (!v) v = Py_None;
+    Py_INCREF(v);
+    return v;
+}
+
+static PyObject *native_tuple(int n, ...)
+{
+    va_list ap;
+    int i;
+    PyObject *t = PyTuple_New(n);
+    if (!t) return NULL;
+    va_start(ap, n);
+    for (i = 0; i < n; i++)
+        PyTuple_SET_ITEM(t, i, native_passthrough(va_arg(ap, PyObject *)));
+    va_end(ap);
+    return t;
+}
+
+static PyObject *native_list(PyObject *item)
+{
+    PyObject *list = PyList_New(item ? 1 : 0);
+    if (list && item) PyList_SET_ITEM(list, 0, native_passthrough(item));
+    return list;
+}
+
+static PyObject *native_list_append(PyObject *list, PyObject *item)
+{
+    if (!list || !PyList_CheckExact(list)) {
+        PyErr_SetString(PyExc_TypeError, "list_append: value is not a list");
+        return NULL;
+    }
+    if (PyList_Append(list, item ? item : Py_None) < 0) return NULL;
+    Py_INCREF(list);
+    return list;
+}
+
+static void native_list_finish(PyObject *list)
+{
+    if (list && PyList_CheckExact(list))
+        PyList_Reverse(list);
+}
+
+static PyObject *native_dict_from_pairs(PyObject *pairs)
+{
+    PyObject *d = PyDict_New();
+    if (d && pairs && pairs != Py_None && PyDict_MergeFromSeq2(d, pairs, 1) < 0) {
+        Py_DECREF(d);
+        return NULL;
+    }
+    return d;
+}
+'''
+
+# Kinds of token values (see BisonParser.token_values)
+TOKEN_VALUES = ('none', 'interned', 'str', 'int', 'float', 'bytes', 'span')
+
+# C helpers creating token values from the matched text, added to the
+# prologue of the grammar file. The text is NUL terminated, as yytext is
+# while a scanner action runs.
+TOKEN_VALUES_C = r'''
+static PyObject *token_interned(PyObject **cached, const char *text, int len)
+{
+    PyObject *s = *cached;
+    const char *u;
+    Py_ssize_t n;
+    if (s && (u = PyUnicode_AsUTF8AndSize(s, &n)) && n == len && !memcmp(u, text, len)) {
+        Py_INCREF(s);
+        return s;
+    }
+    s = PyUnicode_FromStringAndSize(text, len);
+    if (!s) return NULL;
+    PyUnicode_InternInPlace(&s);
+    Py_XDECREF(*cached);
+    Py_INCREF(s);
+    *cached = s;
+    return s;
+}
+
+static PyObject *token_int(const char *text, int len)
+{
+    PyObject *v = PyLong_FromString(text, NULL, 0);
+    if (!v && PyErr_ExceptionMatches(PyExc_ValueError)) {
+        // leading zeros, as in 007, are only valid in base 10
+        PyErr_Clear();
+        v = PyLong_FromString(text, NULL, 10);
+    }
+    return v;
+}
+
+static PyObject *token_float(const char *text, int len)
+{
+    char *end;
+    double d = PyOS_string_to_double(text, &end, NULL);
+    if (d == -1.0 && PyErr_Occurred()) return NULL;
+    if (end != text + len) {
+        PyErr_Format(PyExc_ValueError, "could not convert string to float: '%s'", text);
+        return NULL;
+    }
+    return PyFloat_FromDouble(d);
+}
+'''
+
+# Suffix of the profile data of an engine in the engine cache
+PROFILE_SUFFIX = '.profile.zip'
+
+# Engine libraries loaded by this process, by engine hash
+_libraries = {}
+_librariesLock = threading.Lock()
+
 unquoted = '[^\'"]%s[^\'"]?'
 
 
+cdef class EngineLibrary:
+    """
+    A loaded parser engine library, together with the symbols used from it.
+
+    Libraries are shared by all ParserEngines with the same engine hash in
+    a process, and are only closed once the last of them went away.
+    """
+    cdef void *handle
+    cdef char *libHash
+    cdef void *parse
+    cdef void *parseBuffer
+    cdef void (*resetFlexBuffer)()
+    cdef readonly object filename
+    cdef readonly object engineHash
+    cdef readonly int users
+    cdef readonly object lock
+    cdef object owner
+
+    def __cinit__(self):
+        # serializes the runs of engines which are not reentrant, and keep
+        # the state of their scanner and parser in globals of the library
+        self.lock = threading.Lock()
+        self.owner = None
+
+    def acquire(self):
+        """
+        Takes the lock of the library, for a run or reset of an engine which
+        is not reentrant.
+
+        Raises RuntimeError if the calling thread holds it already, i.e. if
+        a target handler parses with the same engine, as the inner run would
+        overwrite the state of the outer one.
+        """
+        if self.owner == threading.get_ident():
+            raise RuntimeError("runs of parser engines which are not reentrant "
+                               "can't nest, e.g. by parsing within a target handler")
+        self.lock.acquire()
+        self.owner = threading.get_ident()
+
+    def release(self):
+        """
+        Releases the lock taken by acquire().
+        """
+        self.owner = None
+        self.lock.release()
+
+
 cdef class ParserEngine:
     """
     Wraps the interface to the binary bison/lex-generated parser engine dynamic
@@ -98,7 +316,13 @@ cdef class ParserEngine:
     """
     cdef object parser
     cdef object parserHash # hash of current python parser object
-    cdef object libFilename_py
+    cdef object engineHash # hash of everything the compiled engine depends on
+    cdef object cacheKey # key of the engine in the engine cache
+    cdef object cache
+    cdef readonly object libFilename_py
+    cdef readonly object grammar # grammar the engine is built from
+    cdef bint serialized # whether runs of the engine must not overlap
+    cdef EngineLibrary library # shared, loaded library
 
     cdef void *libHandle
 
@@ -112,26 +336,35 @@ cdef class ParserEngine:
         Arguments:
             - parser - an instance of a subclass of Parser
 
-        In the course of initialisation, we check the library against the
-        parser object's rules. If the lib doesn't exist, or can't be loaded, or
-        doesn't match, we build a new library.
+        In the course of initialisation, we look up the library in the engine
+        cache and check it against the parser object's rules. If the lib
+        doesn't exist, or can't be loaded, or doesn't match, we build a new
+        library and store it in the cache. Libraries already loaded by
+        another ParserEngine of this process are reused right away.
 
         Either way, we end up with a binary parser engine which matches the
         current rules in the parser object.
         """
         self.parser = parser
-
-        self.libFilename_py = parser.buildDirectory \
-                              + parser.bisonEngineLibName \
-                              + machinery.EXTENSION_SUFFIXES[0]
+        self.libFilename_py = None
+        self.grammar = parserGrammar(parser)
+        # engines which are not reentrant keep their state in globals, and
+        # so do scanners still reading their input by the py_input and
+        # py_parser globals, rather than by PYBISON_INPUT
+        self.serialized = "%define api.pure full" not in parser.options \
+            or re.search(r'\bpy_(input|parser)\b', parser.lexscript or '') is not None
 
         self.parserHash = hashParserObject(self.parser)
-
+        self.engineHash = hashEngineSpec(self.parser, self.parserHash)
+        self.cache = EngineCache(parser.cacheDirectory, parser.cacheMaxSize)
 
         if parser._buildOnlyCFiles:
             self.buildLib()
             return
+        if self.acquireLib():
+            return
         self.openCurrentLib()
+        self.registerLib()
 
     @staticmethod
     def distutils_dir_name(dname):
@@ -145,12 +378,70 @@ cdef class ParserEngine:
     def reset(self):
         """
         Reset Flex's buffer and state.
+
+        runEngine() does so before every run anyway.
+        """
+        if self.library is not None and self.library.resetFlexBuffer != NULL:
+            self.library.acquire()
+            try:
+                self.library.resetFlexBuffer()
+            finally:
+                self.library.release()
+
+    def acquireLib(self):
+        """
+        Takes the library of this engine from the libraries already loaded
+        by this process, without touching the file system.
+
+        Returns True on success, False if the library needs to be opened.
         """
-        bisondynlib_reset()
+        cdef EngineLibrary library
+
+        with _librariesLock:
+            library = _libraries.get(self.engineHash)
+            if library is None:
+                return False
+            library.users += 1
+
+        self.library = library
+        self.libHandle = library.handle
+        self.libHash = library.libHash
+        self.libFilename_py = library.filename
+        return True
+
+    def registerLib(self):
+        """
+        Makes the library opened by openCurrentLib available to all other
+        engines with the same engine hash in this process.
+        """
+        cdef EngineLibrary library
+
+        with _librariesLock:
+            library = _libraries.get(self.engineHash)
+            if library is None:
+                library = EngineLibrary()
+                library.handle = self.libHandle
+                library.libHash = self.libHash
+                library.parse = bisondynlib_lookup_parser(self.libHandle)
+                library.parseBuffer = bisondynlib_lookup_buffer_parser(self.libHandle)
+                library.resetFlexBuffer = bisondynlib_lookup_reset(self.libHandle)
+                library.filename = self.libFilename_py
+                library.engineHash = self.engineHash
+                _libraries[self.engineHash] = library
+            else:
+                # another thread was faster, drop our reference; dlopen
+                # counts every open, even when it returns the same handle
+                bisondynlib_close(self.libHandle)
+            library.users += 1
+
+        self.library = library
+        self.libHandle = library.handle
+        self.libHash = library.libHash
 
     def openCurrentLib(self):
         """
-        Tests if library exists and is current. If not, builds a fresh one.
+        Looks up the library in the engine cache and checks that it is
+        current. If not, builds a fresh one and stores it in the cache.
 
         Opens the library and imports the parser entry point.
         """
@@ -161,47 +452,145 @@ cdef class ParserEngine:
         if verbose:
             setuptools.logging.set_threshold(1)
 
-        # search for a shared object
-        filenames = self.possible_so(parser.buildDirectory)
+        if self.openPrebuiltLib():
+            return
 
-        self.libFilename_py = ""
-        if len(filenames) == 1:
-            self.libFilename_py = filenames[0]
+        # the cache key depends on the bison and flex versions, which are
+        # only looked up when there is no ahead-of-time built engine
+        self.cacheKey = engineCacheKey(parser, self.engineHash)
 
-        if not os.path.isfile(self.libFilename_py):
-            self.buildLib()
-            # search for a shared object
-            filenames = self.possible_so(parser.buildDirectory)
+        if self.openCachedLib():
+            return
+
+        # Only one process builds the engine, all others wait for the lock
+        # and then find the freshly published engine in the cache.
+        with self.cache.lock(self.cacheKey):
+            if self.openCachedLib():
+                return
+            self.libFilename_py = self.cache.store(self.cacheKey, self.buildLib())
+
+        self.openLib()
+
+    def prebuiltLibName(self):
+        """
+        Returns the file name of the ahead-of-time built engine, made of the
+        engine library name and the qualified name of the parser class, as
+        all parser classes of a module share the default library name.
+        """
+        parser = self.parser
+        className = re.sub(r'\W', '_', type(parser).__qualname__)
+        return '{}.{}{}'.format(parser.bisonEngineLibName, className,
+                                machinery.EXTENSION_SUFFIXES[0])
+
+    def prebuiltLibFilename(self):
+        """
+        Returns the filename of the ahead-of-time built engine, which lives
+        next to the module defining the parser class (see exportLib).
+        """
+        parser = self.parser
+        module = sys.modules.get(type(parser).__module__)
+        moduleFile = getattr(module, '__file__', None)
+        if not moduleFile:
+            return None
+        return os.path.join(os.path.dirname(os.path.abspath(moduleFile)),
+                            self.prebuiltLibName())
+
+    def openPrebuiltLib(self):
+        """
+        Opens the ahead-of-time built library, if there is one and it matches
+        the parser object's rules. Neither the build directory nor the engine
+        cache are touched in that case.
 
-            self.libFilename_py = ""
-            if len(filenames) == 1:
-                self.libFilename_py = filenames[0]
+        Returns True on success, False otherwise.
+        """
+        filename = self.prebuiltLibFilename()
+        if not filename or not os.path.isfile(filename):
+            return False
 
+        self.libFilename_py = filename
         self.openLib()
 
-        # hash parser spec, compare to hash val stored in lib
-        libHash = PyUnicode_FromString(self.libHash)
-        if self.parserHash != libHash:
+        libHash = PyUnicode_FromString(self.libHash) if self.libHash else None
+        if self.engineHash == libHash:
+            if self.parser.verbose:
+                LOGGER.info("Using prebuilt engine {}".format(filename))
+            return True
+
+        LOGGER.warning("Ignoring outdated prebuilt engine {}".format(filename))
+        self.closeLib()
+        return False
+
+    def exportLib(self, directory=None):
+        """
+        Copies the engine library next to the module defining the parser
+        class (or into `directory`), where openCurrentLib picks it up
+        without ever building or consulting the engine cache.
+
+        Returns the filename of the exported library.
+        """
+        parser = self.parser
+        if directory is None:
+            target = self.prebuiltLibFilename()
+        else:
+            target = os.path.join(directory, self.prebuiltLibName())
+        if target is None:
+            raise Exception("Cannot locate the module of {}".format(type(parser).__name__))
+        if os.path.abspath(target) == os.path.abspath(self.libFilename_py):
+            return target
+
+        fd, tmpname = tempfile.mkstemp(prefix='.' + parser.bisonEngineLibName,
+                                       dir=os.path.dirname(target))
+        os.close(fd)
+        try:
+            shutil.copyfile(self.libFilename_py, tmpname)
+            os.replace(tmpname, target)
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+
+        if parser.verbose:
+            LOGGER.info("Exported engine {} => {}".format(self.libFilename_py, target))
+        return target
+
+    def openCachedLib(self):
+        """
+        Opens the library from the engine cache, if it is there and matches
+        the parser object's rules.
+
+        Returns True on success, False if a new library needs to be built.
+        """
+        parser = self.parser
+        verbose = parser.verbose
+
+        self.libFilename_py = self.cache.lookup(self.cacheKey)
+        if not self.libFilename_py:
             if verbose:
-                LOGGER.info("Hash discrepancy, need to rebuild bison lib")
-                LOGGER.info("  current parser class: %s" % self.parserHash)
-                LOGGER.info("         bison library: %s" % libHash)
-            self.closeLib()
-            self.buildLib()
+                LOGGER.info("Engine {} not in cache {}".format(self.cacheKey, self.cache.root))
+            return False
+
+        try:
             self.openLib()
-        else:
+        except Exception as e:
+            # e.g. evicted by another process since the lookup
+            LOGGER.warning("Cannot load cached engine {}: {}".format(self.libFilename_py, e))
+            self.cache.remove(self.cacheKey)
+            return False
+
+        # hash engine spec, compare to hash val stored in lib
+        libHash = PyUnicode_FromString(self.libHash) if self.libHash else None
+        if self.engineHash == libHash:
             if verbose:
                 LOGGER.info("Hashes match, no need to rebuild bison engine lib")
+            return True
 
-    def possible_so(self, so_dir):
-        LOGGER.debug("call def possible_so")
-        import fnmatch
-        regex_str =  '*' + self.parser.bisonEngineLibName + machinery.EXTENSION_SUFFIXES[0]
-        return [
-            os.path.join(dirpath, f)
-            for dirpath, dirnames, files in os.walk(so_dir)
-            for f in fnmatch.filter(files, regex_str)
-        ]
+        if verbose:
+            LOGGER.info("Hash discrepancy, need to rebuild bison lib")
+            LOGGER.info("  current parser class: %s" % self.engineHash)
+            LOGGER.info("         bison library: %s" % libHash)
+        self.closeLib()
+        self.cache.remove(self.cacheKey)
+        return False
 
     def openLib(self):
         """
@@ -258,6 +647,8 @@ cdef class ParserEngine:
                 PyObject* obj = PyErr_Occurred();
                 if (obj) {
                       // yyerror(&yylloc, "exception raised");
+                      // the value is not pushed, bison won't release it
+                      Py_XDECREF($$);
                       YYERROR;
                 }
             }'''
@@ -265,7 +656,45 @@ cdef class ParserEngine:
 
     def buildLib(self):
         """
-        Creates the parser engine lib
+        Creates the parser engine lib, and returns its filename
+
+        The engine is built in a private directory below the parser's build
+        directory, so that concurrent builds never see each other's files.
+        Once finished, the library (and, if keepfiles is set, all generated
+        files) are moved into the build directory with atomic renames.
+        """
+        LOGGER.debug("call def buildLib")
+        parser = self.parser
+
+        Path(parser.buildDirectory).mkdir(parents=True, exist_ok=True)
+        privateDirectory = tempfile.mkdtemp(prefix='build-', dir=parser.buildDirectory)
+
+        libFileName = None
+        try:
+            if parser.pgo_corpus and not parser._buildOnlyCFiles \
+                    and supportsProfiles():
+                libFileName = self.buildProfiledLibIn(privateDirectory + os.path.sep)
+            else:
+                libFileName = self.buildLibIn(privateDirectory + os.path.sep)
+        finally:
+            published = None
+            for name in os.listdir(privateDirectory):
+                src = os.path.join(privateDirectory, name)
+                dst = os.path.join(parser.buildDirectory, name)
+                if src == libFileName:
+                    published = dst
+                elif not (parser.keepfiles or parser._buildOnlyCFiles) \
+                        or not os.path.isfile(src):
+                    continue
+                os.replace(src, dst)
+            shutil.rmtree(privateDirectory, ignore_errors=True)
+
+        return published
+
+    def buildLibIn(self, buildDirectory, profile=None):
+        """
+        Creates the parser engine lib in `buildDirectory`, and returns its
+        filename
 
         This consists of:
             1. Ripping the tokens list, precedences, start target, handler docstrings
@@ -274,22 +703,16 @@ cdef class ParserEngine:
             3. Compiling bison/lex files to C
             4. Compiling the C files, and link into a dynamic lib
         """
-        LOGGER.debug("call def buildLib")
+        LOGGER.debug("call def buildLibIn")
         # -------------------------------------------------
         # rip the pertinent grammar specs from parser class
         parser = self.parser
 
-        # get target handler methods, in the order of appearance in the
-        # source file.
-        attribs = dir(parser)
-        gHandlers = []
-
-        for a in attribs:
-            if a.startswith('on_'):
-                method = getattr(parser, a)
-                gHandlers.append(method)
-
-        gHandlers.sort(key=keyLines)
+        # get target handler methods and their rules, in the order of
+        # appearance in the source file.
+        grammar = parserGrammar(parser)
+        natives = nativeActions(parser)
+        reversedLists = reversedListTargets(natives)
 
         # get start symbol, tokens, precedences, lex script
         gOptions = parser.options
@@ -298,13 +721,8 @@ cdef class ParserEngine:
         gPrecedences = parser.precedences
         gLex = parser.lexscript
 
-        buildDirectory = parser.buildDirectory
-
         # ------------------------------------------------
         # now, can generate the grammar file
-        if os.path.isfile(buildDirectory + parser.bisonFile):
-            os.unlink(buildDirectory + parser.bisonFile)
-
         if parser.verbose:
             LOGGER.info("build directory: {}".format(buildDirectory))
             LOGGER.debug("generating bison file: {}".format(buildDirectory + parser.bisonFile))
@@ -319,7 +737,8 @@ cdef class ParserEngine:
 
 
         # define yyerror for reentrant/nonreentrant parser
-        if "%define api.pure full" in gOptions:
+        reentrant = "%define api.pure full" in gOptions
+        if reentrant:
             error_def = 'void yyerror(YYLTYPE *locp, yyscan_t scanner, char const *msg);'
         else:
             error_def = 'int yyerror(char *msg);'
@@ -334,13 +753,43 @@ cdef class ParserEngine:
             '#include "Python.h"',
             # '' if sys.platform == 'win32' else 'extern int yylineno;'
             # '#define YYSTYPE void*',
-            #'extern void *py_callback(void *, char *, int, void*, ...);',
-            'void *(*py_callback)(void *, char *, int, int, ...);',
+            '',
+            # everything a parser run needs, passed around rather than kept
+            # in globals, so that reentrant engines may run in several
+            # threads at once
+            'struct pybison_context {',
+            '    void *parser;',
+            '    void *handlers;',
+            '    void *(*callback)(void *, void *, int, int, ...);',
+            '    void (*input)(void *, char *, int *, int);',
+            '    void *input_state;',
+            '    void *(*token_span)(void *, size_t, size_t);',
+            '    void *token_source;',
+            '};',
+            # the scanner's extra data of reentrant engines, a global of the
+            # others, which can't run concurrently anyway. lex.yy.h defines
+            # it for scanner actions, by yyextra, which the parser lacks
+            '#undef PYBISON_CONTEXT\n#define PYBISON_CONTEXT ((struct pybison_context *)yyget_extra(scanner))' if reentrant else
+            'struct pybison_context *pybison_ctx;\n#define PYBISON_CONTEXT pybison_ctx',
+            '',
+            # for lex scripts still reading their input with
+            # (*py_input)(py_parser, ...), which unlike PYBISON_INPUT only
+            # works as long as a single thread is parsing
             'void (*py_input)(void *, char *, int *, int);',
             'void *py_parser;',
-            export + 'char *rules_hash = "%s";' % self.parserHash,
-            '#define YYERROR_VERBOSE 1',
             '',
+            'void pybison_input(struct pybison_context *ctx, char *buf, int *result, int max_size)',
+            '{',
+            '    ctx->input(ctx->input_state, buf, result, max_size);',
+            '}',
+            '',
+            '#define YYERROR_VERBOSE 1',
+            NATIVE_ACTIONS_C if natives else '',
+            tokenValuesCode(tokenValues(parser)),
+            # tokens returned without setting yylval have no value, rather
+            # than the (released) value of the previous token
+            '' if reentrant else
+            '#define yylex() (yylval = NULL, yylex())',
             '}',
             '',
             '%code requires {',
@@ -374,58 +823,67 @@ cdef class ParserEngine:
         for p in gPrecedences:
             write("%%%s  %s\n" % (p[0], " ".join(p[1])))
 
+        # values are python objects owned by the parser stack, release those
+        # bison discards during error recovery or when aborting
+        write("\n%destructor { Py_XDECREF((PyObject *)$$); } <> <*>\n")
+
         write("\n\n%%\n\n")
 
         if parser.raw_c_rules:
             write(parser.raw_c_rules)
 
-        # carve up docstrings
-        rules = []
-        for h in gHandlers:
-
-            doc = h.__doc__.strip()
-
-            # added by Eugene Oden
-            #target, options = doc.split(":")
-            doc = re.sub(unquoted % ";", "", doc)
-
-            s = re.split(unquoted % ":", doc)
-
-            target, options = s
-            target = target.strip()
-
-            options = options.strip()
-            tmp = []
-
-            #opts = options.split("|")
-            r = unquoted % r"\|"
-            opts1 = re.split(r, " " + options)
-
-            for o in opts1:
-                o = o.strip()
-
-                tmp.append(reSpaces.split(o))
-            options = tmp
-
-            rules.append((target, options))
-
-        # and render rules to grammar file
-        for rule in rules:
+        # and render rules to grammar file; the actions pass the number of
+        # their reduction, which indexes the parser's handler table (see
+        # BisonParser._handler_table), unless they are native actions
+        ruleNumber = 0
+        for rule in grammar.rules:
             try:
                 write("%s\n    : " % rule[0])
                 options = []
-                idx = 0
                 for option in rule[1]:
                     nterms = len(option)
                     if nterms == 1 and option[0] == '':
                         nterms = 0
                         option = []
                     action = '\n        {\n'
+                    target, optionNumber, names = grammar.reductions[ruleNumber]
+                    native = natives.get((target, optionNumber))
+
+                    # lists built in reverse order are complete once used by
+                    # another rule
+                    for i, name in enumerate(names):
+                        if name in reversedLists and not (
+                                name == target and native is not None
+                                and native[0] == 'list_reversed'):
+                            action = action + '          native_list_finish($%d);\n' % (i + 1)
+
+                    # the right-hand side values are released once the
+                    # action is done with them
+                    release = ''.join(['          Py_XDECREF($%d);\n' % (i + 1)
+                                       for i, name in enumerate(names)
+                                       if name != 'error'])
+
+                    if native is not None:
+                        if native[0] == 'list_rotated':
+                            option = rotatedListSymbols(names, native)
+                        # built right here, without calling back into python
+                        action = action + '          $$ = %s;\n' % nativeActionCode(
+                            native, len(names))
+                        if rule[0] == gStart:
+                            action = action + '          if ($$) PyObject_SetAttrString((PyObject*)PYBISON_CONTEXT->parser, "last", $$);\n'
+                        action = action + release
+                        action = action + self.generate_exception_handler() + '        }\n'
+                        options.append(" ".join(option) + action)
+                        ruleNumber = ruleNumber + 1
+                        continue
                     if 'error' in option:
-                        action = action + "             yyerrok;\n"
-                        action = action + "             PyObject* lasterr = PyObject_GetAttrString((PyObject*)py_parser, \"lasterror\");;\n"
-                    action = action + '          $$ = (*py_callback)(\n            py_parser, "%s", %s, %%s' % \
-                                      (rule[0], idx) # note we're deferring the substitution of 'nterms' (last arg)
+                        # the handler gets the last syntax error as value of
+                        # the error token, which has none
+                        action = action + "          yyerrok;\n"
+                        action = action + "          PyObject *lasterr = PyObject_GetAttrString((PyObject*)PYBISON_CONTEXT->parser, \"lasterror\");\n"
+                        action = action + "          if (!lasterr) PyErr_Clear();\n"
+                    action = action + '          $$ = PYBISON_CONTEXT->callback(\n            PYBISON_CONTEXT->parser, PYBISON_CONTEXT->handlers, %s, %%s' % \
+                                      (ruleNumber) # note we're deferring the substitution of 'nterms' (last arg)
                     args = []
                     i = -1
 
@@ -436,11 +894,10 @@ cdef class ParserEngine:
                             if option[i] == '%prec':
                                 i = i - 1
                                 break # hack for rules using '%prec'
-                            o = option[i].replace('"', '\\"')
-                            if o == 'error':
-                                args.append('"%s", lasterr' % (o))
+                            if option[i] == 'error':
+                                args.append('lasterr')
                             else:
-                                args.append('"%s", $%d' % (o, i+1))
+                                args.append('$%d' % (i+1))
 
                     # now, we have the correct terms count
                     action = action % (i + 1)
@@ -448,60 +905,125 @@ cdef class ParserEngine:
                     # assemble the full rule + action, add to list
                     action = action + ",\n            "
                     action = action + ",\n            ".join(args) + "\n            );\n"
+                    action = action + release
 
                     if 'error' in option:
-                        action = action + " PyObject_SetAttrString(py_parser, \"lasterror\", Py_None);\n"
-                        action = action + "             Py_DECREF(lasterr);\n"
-                        action = action + "             Py_INCREF(Py_None);\n"
-                        action = action + "             yyclearin;\n"
+                        # the error is handled, and the lookahead token,
+                        # if any, dropped (which yyclearin doesn't release)
+                        action = action + "          Py_XDECREF(lasterr);\n"
+                        action = action + "          if (!PyErr_Occurred()) PyObject_SetAttrString((PyObject*)PYBISON_CONTEXT->parser, \"lasterror\", Py_None);\n"
+                        action = action + "          if (yychar != YYEMPTY) { Py_XDECREF(yylval); yylval = NULL; }\n"
+                        action = action + "          yyclearin;\n"
 
-                    else:
-                        action = action + self.generate_exception_handler()
+                    action = action + self.generate_exception_handler()
 
                     action = action + '        }\n'
 
                     options.append(" ".join(option) + action)
-                    idx = idx + 1
+                    ruleNumber = ruleNumber + 1
                 write("    | ".join(options) + "    ;\n\n")
             except:
                 traceback.print_exc()
 
         write('\n\n%%\n\n')
 
-        # now generate C code
+        # now generate C code: do_parse() reads its input through the
+        # parser's read() method (see py_input, which gets the run's input
+        # state), while do_parse_buffer()
+        # scans a buffer in memory, which is done in place if it is
+        # writable and ends with two NUL bytes (see flex's yy_scan_buffer),
+        # and may create token spans over it
         epilogue = '\n'.join([
+            'static void parse(void *parser1,',
+            '                  void *handlers,',
+            '                  void *(*cb)(void *, void *, int, int, ...),',
+            '                  void (*in)(void *, char*, int *, int), void *input,',
+            '                  void *(*span)(void *, size_t, size_t), void *source,',
+            '                  char *buf, size_t len, int inplace,',
+            '                  int debug);',
+            '',
             export + 'void do_parse(void *parser1,',
-            '              void *(*cb)(void *, char *, int, int, ...),',
+            '              void *handlers,',
+            '              void *(*cb)(void *, void *, int, int, ...),',
             '              void (*in)(void *, char*, int *, int),',
+            '              void *input,',
             '              int debug',
             '              )',
             '{',
-            '   py_callback = cb;',
+            '   parse(parser1, handlers, cb, in, input, NULL, NULL, NULL, 0, 0, debug);',
+            '}',
+            '',
+            export + 'void do_parse_buffer(void *parser1,',
+            '              void *handlers,',
+            '              void *(*cb)(void *, void *, int, int, ...),',
+            '              void (*in)(void *, char*, int *, int),',
+            '              void *(*span)(void *, size_t, size_t), void *source,',
+            '              char *buf, size_t len, int inplace,',
+            '              int debug',
+            '              )',
+            '{',
+            '   parse(parser1, handlers, cb, in, NULL, span, source, buf, len, inplace, debug);',
+            '}',
+            '',
+            # BisonParser.run() runs the engine on read() input again and
+            # again, until the input is exhausted, even if syntax errors
+            # aborted a run; a buffer is parsed the same way, by going on
+            # with the scanner where the aborted run left it. Exceptions
+            # pending from the aborted run are dropped, as run() does
+            'static int resume(void)',
+            '{',
+            '   if (!PyErr_Occurred()) return 1;',
+            '   if (!PyErr_ExceptionMatches(PyExc_Exception)) return 0;',
+            '   PyErr_Clear();',
+            '   return 1;',
+            '}',
+            '',
+            'static void parse(void *parser1,',
+            '                  void *handlers,',
+            '                  void *(*cb)(void *, void *, int, int, ...),',
+            '                  void (*in)(void *, char*, int *, int), void *input,',
+            '                  void *(*span)(void *, size_t, size_t), void *source,',
+            '                  char *buf, size_t len, int inplace,',
+            '                  int debug)',
+            '{',
+            '   struct pybison_context ctx = {parser1, handlers, cb, in, input, span, source};',
             '   py_input = in;',
-            '   py_parser = parser1;',
-            '   yydebug = debug; // For Bison (still global, even in a reentrant parser)',
+            '   py_parser = input;',
+            # bison's debug flag is global, even in a reentrant parser, so
+            # only debug runs touch it
+            '   if (debug) yydebug = 1;',
             '',
         ])
 
         if "%define api.pure full" in gOptions:
             epilogue += '\n'.join([
                 'yyscan_t scanner;',
-                'yylex_init(&scanner);',
+                'yylex_init_extra(&ctx, &scanner);',
+                'if (buf) {',
+                '  if (inplace) yy_scan_buffer(buf, len, scanner);',
+                '  else yy_scan_bytes(buf, len, scanner);',
+                '}',
 
                 'if (debug) yyset_debug(1, scanner); // For Flex (no longer a global, but rather a member of yyguts_t)',
                 '',
                 '',
-                'int status;',
-                'yypstate *ps = yypstate_new ();',
+                'int status, token;',
+                'yypstate *ps;',
                 'YYSTYPE pushed_value;',
                 'YYLTYPE yylloc;',
                 'yylloc.first_line = yylloc.first_column = yylloc.last_line = yylloc.last_column = 1;',
                 'do {',
-                '  int token = yylex(&pushed_value,&yylloc, scanner);',
-                '  status = yypush_parse (ps, token , &pushed_value, &yylloc, scanner);',
-                '} while (status == YYPUSH_MORE);',
-                'yypstate_delete(ps);',
-                'yylex_destroy(scanner);'
+                '  ps = yypstate_new ();',
+                '  do {',
+                '    pushed_value = NULL; // tokens without a value',
+                '    token = yylex(&pushed_value,&yylloc, scanner);',
+                '    status = yypush_parse (ps, token , &pushed_value, &yylloc, scanner);',
+                '  } while (status == YYPUSH_MORE);',
+                '  yypstate_delete(ps);',
+                '  // an aborted run dropped its lookahead token, so the next one gets on',
+                '} while (buf && status == 1 && token != 0 && resume());',
+                'yylex_destroy(scanner);',
+                'if (debug) yydebug = 0;',
                 'return;',
             '}',
             '',
@@ -510,7 +1032,7 @@ cdef class ParserEngine:
             '',
             '  PyObject *error = PyErr_Occurred();',
             '  if(error) PyErr_Clear();',
-            '  PyObject *fn = PyObject_GetAttrString((PyObject *)py_parser,',
+            '  PyObject *fn = PyObject_GetAttrString((PyObject *)PYBISON_CONTEXT->parser,',
             '                                        "report_syntax_error");',
             '  if (!fn)',
             '      return;',
@@ -520,8 +1042,10 @@ cdef class ParserEngine:
             '                       locp->first_line, locp->first_column,',
             '                       locp->last_line, locp->last_column);',
             '',
-            '  if (!args)',
+            '  if (!args) {',
+            '      Py_DECREF(fn);',
             '      return;',
+            '  }',
             '',
             # '  fprintf(stderr, "%d.%d-%d.%d: error: \'%s\' before \'%s\'.",',
             # '          locp->first_line, locp->first_column,',
@@ -529,7 +1053,7 @@ cdef class ParserEngine:
             '',
             '  PyObject *res = PyObject_CallObject(fn, args);',
             '  Py_DECREF(args);',
-            #'  Py_DECREF(fn);',
+            '  Py_DECREF(fn);',
             '',
             '  if (!res)',
             '      return;',
@@ -541,7 +1065,19 @@ cdef class ParserEngine:
 
         else:
             epilogue += '\n'.join([
-            '   yyparse();',
+            '   YY_BUFFER_STATE buffer = NULL;',
+            '   pybison_ctx = &ctx;',
+            '   if (buf)',
+            '      buffer = inplace ? yy_scan_buffer(buf, len) : yy_scan_bytes(buf, len);',
+            '   /* an aborted run dropped its lookahead token, if any, so the next',
+            '      one gets on */',
+            '   while (yyparse() == 1 && buffer && yychar != YYEOF && yychar != YYEMPTY && resume())',
+            '      ;',
+            '   /* drops the deleted buffer, which is still the current one, and',
+            '      starts the next run with a freshly initialized scanner */',
+            '   if (buffer) yylex_destroy();',
+            '   pybison_ctx = NULL;',
+            '   if (debug) yydebug = 0;',
             '}',
             '',
             # 'extern char *yytext;',
@@ -550,7 +1086,7 @@ cdef class ParserEngine:
             '{',
             '  PyObject *error = PyErr_Occurred();',
             '  if(error) PyErr_Clear();',
-            '  PyObject *fn = PyObject_GetAttrString((PyObject *)py_parser,',
+            '  PyObject *fn = PyObject_GetAttrString((PyObject *)PYBISON_CONTEXT->parser,',
             '                                        "report_syntax_error");',
             '  if (!fn)',
             '      return 1;',
@@ -560,8 +1096,10 @@ cdef class ParserEngine:
             '                       yylloc.first_line, yylloc.first_column,',
             '                       yylloc.last_line, yylloc.last_column);',
             '',
-            '  if (!args)',
+            '  if (!args) {',
+            '      Py_DECREF(fn);',
             '      return 1;',
+            '  }',
             #'',
             #'  fprintf(stderr, "%d.%d-%d.%d: error: \'%s\' before \'%s\'.",',
             #'          yylloc.first_line, yylloc.first_column,',
@@ -569,6 +1107,7 @@ cdef class ParserEngine:
             '',
             '  PyObject *res = PyObject_CallObject(fn, args);',
             '  Py_DECREF(args);',
+            '  Py_DECREF(fn);',
             '',
             '  if (!res)',
             '      return 1;',
@@ -585,6 +1124,7 @@ cdef class ParserEngine:
         # -----------------------------------------------
         # now generate the lex script
         f = open(buildDirectory + parser.flexFile, 'w')
+        f.write(tokenMacros(gLex))
         f.write(textwrap.dedent(gLex))
         f.close()
 
@@ -616,69 +1156,154 @@ cdef class ParserEngine:
                 LOGGER.info("Copying file {} => {}".format(inc_f, buildDirectory + inc_f))
             shutil.copy(inc_f, buildDirectory + inc_f)
 
+        # Every following stage is skipped, if its outputs for the very same
+        # inputs are still around from an earlier build (see runStage). So
+        # e.g. a lex script edit neither reruns bison nor recompiles its output.
+        def readFile(name):
+            with open(buildDirectory + name, 'rb') as f:
+                return f.read()
+
         # --------------------------------- #
         # Now run bison on the grammar file #
         # --------------------------------- #
-        bisonCmd = parser.bisonCmd + [parser.bisonFile]
+        bisonCmd = bisonCommand(parser) + [parser.bisonFile]
 
-        if parser.verbose:
-            LOGGER.info("bison cmd: {}".format(' '.join(bisonCmd)))
+        def runBison():
+            if parser.verbose:
+                LOGGER.info("bison cmd: {}".format(' '.join(bisonCmd)))
 
-        proc = subprocess.Popen(' '.join(bisonCmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=buildDirectory)
-        (out, err) = proc.communicate()
-        if proc.returncode:
-            LOGGER.error(out)
-            raise Exception(err)
+            proc = subprocess.Popen(' '.join(bisonCmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=buildDirectory)
+            (out, err) = proc.communicate()
+            if proc.returncode:
+                LOGGER.error(out)
+                raise Exception(err)
 
-        if parser.verbose:
-            LOGGER.info("CMD Output: {}".format(out))
-            LOGGER.info("bison C file: {}{}".format(buildDirectory, parser.bisonCFile1))
-            LOGGER.info("bison H file: {}{}".format(buildDirectory, parser.bisonHFile1))
+            if parser.verbose:
+                LOGGER.info("CMD Output: {}".format(out))
 
         # -----------------------------------------
         # Now run lex on the lex file
-        flexCmd = parser.flexCmd + [parser.flexFile]
+        flexCmd = flexCommand(parser) + [parser.flexFile]
 
-        if parser.verbose:
-            LOGGER.info("flex cmd: {}".format(' '.join(flexCmd)))
-
-        proc = subprocess.Popen(' '.join(flexCmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=buildDirectory)
-        (out, err) = proc.communicate()
-        if proc.returncode:
-            raise Exception(err)
+        def runFlex():
+            if parser.verbose:
+                LOGGER.info("flex cmd: {}".format(' '.join(flexCmd)))
 
-        if parser.verbose:
-            LOGGER.info("CMD Output: {}".format(out))
-            LOGGER.info("flex C file: {}{}".format(buildDirectory, parser.flexCFile1))
-            LOGGER.info("flex H file: {}{}".format(buildDirectory, parser.flexHFile1))
+            proc = subprocess.Popen(' '.join(flexCmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, cwd=buildDirectory)
+            (out, err) = proc.communicate()
+            if proc.returncode:
+                raise Exception(err)
 
-        if parser._buildOnlyCFiles:
-            return
+            if parser.verbose:
+                LOGGER.info("CMD Output: {}".format(out))
 
         libFileName = buildDirectory + parser.bisonEngineLibName \
                       + machinery.EXTENSION_SUFFIXES[0]
 
-        if parser.verbose:
-            LOGGER.info("Compiling: {}".format(libFileName))
+        # -----------------------------------------
+        # Compiling a file into an object, see below
+        def compileStage(source, dependencies, profileFlags=()):
+            obj = os.path.splitext(source)[0] + env.obj_extension
+
+            def compileSource():
+                compiled, = env.compile([buildDirectory + source],
+                                        output_dir=buildDirectory,
+                                        extra_preargs=parser.cflags_pre,
+                                        extra_postargs=parser.cflags_post
+                                        + list(profileFlags),
+                                        debug=parser.debugSymbols)
+                os.replace(compiled, buildDirectory + obj)
+
+            if profileFlags and profile[0] == 'use':
+                dependencies = dependencies + [placeProfileData(source)]
+
+            self.runStage('compile', buildDirectory, compileSource, [obj],
+                          [readFile(source)] + dependencies + compilerFlags
+                          + list(profileFlags))
+            return buildDirectory + obj
 
         # -----------------------------------------
-        # Now compile the files into a shared lib
+        # Profile-guided optimization (see buildProfiledLibIn): the parser
+        # and scanner get instrumented, or optimized using the profile data
+        # of the training run.
+        profileFlags = []
+        linkFlags = []
+        if profile is not None:
+            mode, profileDirectory = profile
+            profileFlags = ['-fprofile-{}={}'.format(mode, profileDirectory.rstrip(os.sep))]
+            if mode == 'generate':
+                linkFlags = ['-fprofile-generate']
+            else:
+                profileFlags += ['-fprofile-correction', '-Wno-missing-profile']
+
+        def placeProfileData(source):
+            # gcc looks for the profile data of an object at its full path
+            # below the profile directory
+            obj, = env.object_filenames([buildDirectory + source],
+                                        output_dir=buildDirectory)
+            name = os.path.splitext(source)[0] + '.gcda'
+            data = profileDirectory.rstrip(os.sep) + os.path.splitext(obj)[0] + '.gcda'
+            if not os.path.isfile(profileDirectory + name):
+                LOGGER.warning("no profile data for {}".format(source))
+                return ''
+            os.makedirs(os.path.dirname(data), exist_ok=True)
+            shutil.copyfile(profileDirectory + name, data)
+            with open(data, 'rb') as f:
+                return f.read()
+
+        compilerFlags = [' '.join(env.compiler_so), repr(env.include_dirs),
+                         repr(env.macros), ' '.join(parser.cflags_pre),
+                         ' '.join(parser.cflags_post), str(parser.debugSymbols)]
+
+        # the rules hash gets a translation unit of its own, so that it does
+        # not invalidate the bison and flex outputs on every grammar change
+        with open(buildDirectory + parser.hashCFile, 'w') as f:
+            f.write('%schar *rules_hash = "%s";\n' % (export, self.engineHash))
+
+        # Independent steps run concurrently: bison, flex and compiling the
+        # rules hash first, then compiling the bison and flex outputs (each
+        # of which includes the other's header).
+        with ThreadPoolExecutor(max_workers=parser.build_jobs) as pool:
+            bisonDone = pool.submit(
+                self.runStage, 'bison', buildDirectory, runBison,
+                [parser.bisonCFile1, parser.bisonHFile1],
+                [readFile(parser.bisonFile), ' '.join(bisonCmd),
+                 toolVersion(parser.bisonCmd[0])],
+                optional=['tmp.output'])
+            flexDone = pool.submit(
+                self.runStage, 'flex', buildDirectory, runFlex,
+                [parser.flexCFile1, parser.flexHFile1],
+                [readFile(parser.flexFile), ' '.join(flexCmd),
+                 toolVersion(parser.flexCmd[0])])
+            if not parser._buildOnlyCFiles:
+                hashObj = pool.submit(compileStage, parser.hashCFile, [])
+
+            bisonDone.result()
+            if parser.verbose:
+                LOGGER.info("bison C file: {}{}".format(buildDirectory, parser.bisonCFile1))
+                LOGGER.info("bison H file: {}{}".format(buildDirectory, parser.bisonHFile1))
 
-        # cd to buildDirectory
-        wd = os.getcwd()
-        os.chdir(buildDirectory)
+            flexDone.result()
+            if parser.verbose:
+                LOGGER.info("flex C file: {}{}".format(buildDirectory, parser.flexCFile1))
+                LOGGER.info("flex H file: {}{}".format(buildDirectory, parser.flexHFile1))
+
+            if parser._buildOnlyCFiles:
+                return
 
-        objs = env.compile([parser.bisonCFile1,
-                            parser.flexCFile1],
-                           extra_preargs=parser.cflags_pre,
-                           extra_postargs=parser.cflags_post,
-                           debug=parser.debugSymbols)
+            if parser.verbose:
+                LOGGER.info("Compiling: {}".format(libFileName))
 
-        if os.path.isfile(libFileName+".bak"):
-            os.unlink(libFileName+".bak")
+            # -----------------------------------------
+            # Now compile the files into a shared lib
+            headers = [readFile(parser.bisonHFile1), readFile(parser.flexHFile1)]
+            bisonObj = pool.submit(compileStage, parser.bisonCFile1, headers,
+                                   profileFlags)
+            flexObj = pool.submit(compileStage, parser.flexCFile1,
+                                  headers + [readFile(inc_f) for inc_f in included_files],
+                                  profileFlags)
 
-        if os.path.isfile(libFileName):
-            os.rename(libFileName, libFileName+".bak")
+            objs = [bisonObj.result(), flexObj.result(), hashObj.result()]
 
         if parser.verbose:
             LOGGER.info("linking: {} => {}".format(', '.join(objs), libFileName))
@@ -690,75 +1315,294 @@ cdef class ParserEngine:
             env.linker_so += ["-undefined", "dynamic_lookup"]
 
         # link 'em into a shared lib
-        env.link_shared_object(objs, libFileName)
-
-        # move back to working directory
-        os.chdir(wd)
+        self.runStage('link', buildDirectory,
+                      lambda: env.link_shared_object(objs, libFileName,
+                                                     extra_postargs=linkFlags),
+                      [os.path.basename(libFileName)],
+                      [readFile(os.path.basename(o)) for o in objs]
+                      + [' '.join(env.linker_so), repr(env.libraries),
+                         repr(env.library_dirs)] + linkFlags)
 
         #cdef char *incdir
         #incdir = PyString_AsString(get_python_inc())
         #bisondynlib_build(self.libFilename_py, incdir)
 
-        # --------------------------------------------
-        # clean up, if we succeeded
-        # hitlist = objs[:]
-        hitlist = []
-
-        if os.path.isfile(self.libFilename_py):
-            for name in ['bisonFile', 'bisonCFile', 'bisonHFile',
-                         'bisonCFile1', 'bisonHFile1', 'flexFile',
-                         'flexCFile', 'flexCFile1',
-                         ] + objs:
-                if hasattr(parser, name):
-                    fname = buildDirectory + getattr(parser, name)
-                else:
-                    fname = None
-                if fname and os.path.isfile(fname):
-                    hitlist.append(fname)
-
-        if not parser.keepfiles:
-            for f in hitlist:
-                try:
-                    os.remove(f)
-                except:
-                    LOGGER.warning("failed to delete temporary file {}".format(f))
+        return libFileName
+
+    def buildProfiledLibIn(self, buildDirectory):
+        """
+        Creates a profile-guided optimized parser engine lib in
+        `buildDirectory`, and returns its filename:
+
+            1. builds an engine instrumented with -fprofile-generate
+            2. runs the parser with it on every input of parser.pgo_corpus
+            3. rebuilds the engine with -fprofile-use
+
+        The profile data is stored in the engine cache alongside the engine,
+        so later rebuilds of the same engine on an unchanged corpus skip the
+        first two steps.
+        """
+        LOGGER.debug("call def buildProfiledLibIn")
+        parser = self.parser
+
+        profileDirectory = buildDirectory + 'profile' + os.path.sep
+        os.makedirs(profileDirectory)
+        archive = buildDirectory + 'profile.zip'
+
+        # the samples are only read when an engine is actually built
+        profileKey = profileCacheKey(self.cacheKey, parser.pgo_corpus) \
+            if self.cacheKey else None
+        cached = self.cache.lookup(profileKey, PROFILE_SUFFIX) \
+            if profileKey else None
+        if cached:
+            if parser.verbose:
+                LOGGER.info("using cached profile data {}".format(cached))
+            with zipfile.ZipFile(cached) as z:
+                z.extractall(profileDirectory)
+        else:
+            self.trainLib(self.buildLibIn(buildDirectory,
+                                          ('generate', profileDirectory)))
+
+            # gcc writes the profile data of every object at the object's
+            # full path below the profile directory, flatten that
+            with zipfile.ZipFile(archive, 'w') as z:
+                for root, dirs, files in os.walk(profileDirectory):
+                    for name in files:
+                        if name.endswith('.gcda'):
+                            z.write(os.path.join(root, name), name)
+            with zipfile.ZipFile(archive) as z:
+                if not z.namelist():
+                    raise Exception('training the parser engine produced no profile data')
+                shutil.rmtree(profileDirectory)
+                z.extractall(profileDirectory)
+            if profileKey:
+                self.cache.store(profileKey, archive, PROFILE_SUFFIX)
+
+        return self.buildLibIn(buildDirectory, ('use', profileDirectory))
+
+    def trainLib(self, filename):
+        """
+        Runs the parser with the (instrumented) engine library `filename`
+        on every input of parser.pgo_corpus, then closes the library, which
+        writes out its profile data.
+        """
+        LOGGER.debug("call def trainLib")
+        cdef EngineLibrary library = EngineLibrary()
+        parser = self.parser
+
+        filename_bytes = filename.encode("ascii")
+        library.handle = bisondynlib_open(PyBytes_AsString(filename_bytes))
+        if library.handle == NULL:
+            raise Exception('library loading failed!')
+        library.parse = bisondynlib_lookup_parser(library.handle)
+        library.parseBuffer = bisondynlib_lookup_buffer_parser(library.handle)
+        library.resetFlexBuffer = bisondynlib_lookup_reset(library.handle)
+
+        # the parser runs on this engine while training
+        engine = parser._engine
+        self.library = library
+        parser._engine = self
+        try:
+            for sample in parser.pgo_corpus:
+                if parser.verbose:
+                    LOGGER.info("training parser engine on {}".format(sample))
+                parser.run(file=sample)
+        finally:
+            parser._engine = engine
+            parser.last = None
+            self.library = None
+            bisondynlib_close(library.handle)
+
+    def runStage(self, name, buildDirectory, action, outputs, inputs, optional=()):
+        """
+        Runs one stage of the engine build, unless it already ran for the
+        very same inputs.
+
+        Arguments:
+            - name - name of the stage, e.g. 'bison' or 'compile'
+            - buildDirectory - the directory the stage runs in
+            - action - callable running the stage
+            - outputs - names of the files produced by the stage
+            - inputs - list of str/bytes, everything the outputs depend on
+            - optional - names of further files produced by the stage
+
+        The outputs of every stage are kept below the parser's build
+        directory in 'stages/<name>-<hash of inputs>', and copied into
+        `buildDirectory` instead of running the stage again.
+        """
+        parser = self.parser
+
+        hasher = hashlib.new('sha1')
+        for part in inputs:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            hasher.update(hashlib.sha1(part).digest())
+        stagesDirectory = os.path.join(parser.buildDirectory, 'stages')
+        stageDirectory = os.path.join(stagesDirectory, name + '-' + hasher.hexdigest())
 
+        if all(os.path.isfile(os.path.join(stageDirectory, o)) for o in outputs):
             if parser.verbose:
-                LOGGER.info("Deleting temporary bison output files:")
+                LOGGER.info("{} stage is up to date: {}".format(
+                    name, ', '.join(outputs)))
+            try:
+                for o in list(outputs) + list(optional):
+                    if os.path.isfile(os.path.join(stageDirectory, o)):
+                        shutil.copyfile(os.path.join(stageDirectory, o), buildDirectory + o)
+                os.utime(stageDirectory)
+                return
+            except FileNotFoundError:
+                # pruned by a concurrent build in the meantime (see
+                # pruneStages), so the stage runs after all
+                LOGGER.debug("{} stage vanished: {}".format(name, stageDirectory))
+
+        action()
+
+        # publish the outputs under the input hash; if a concurrent build
+        # was faster, its outputs are identical and ours are dropped
+        os.makedirs(stagesDirectory, exist_ok=True)
+        tmpDirectory = tempfile.mkdtemp(prefix='.' + name, dir=stagesDirectory)
+        for o in list(outputs) + list(optional):
+            if os.path.isfile(buildDirectory + o):
+                shutil.copyfile(buildDirectory + o, os.path.join(tmpDirectory, o))
+        try:
+            os.rename(tmpDirectory, stageDirectory)
+        except OSError:
+            shutil.rmtree(tmpDirectory, ignore_errors=True)
 
-            for f in [parser.bisonCFile, parser.bisonHFile, parser.flexCFile, "tmp.output"]:
-                if os.path.isfile(f):
-                    if parser.verbose:
-                        LOGGER.info('rm {}'.format(f))
-                    os.remove(f)
+        self.pruneStages(stagesDirectory, name)
+
+    def pruneStages(self, stagesDirectory, name):
+        """
+        Removes all but the most recently used outputs of a build stage.
+        """
+        def lastUse(stageDirectory):
+            try:
+                return os.path.getmtime(stageDirectory)
+            except OSError:
+                # pruned by a concurrent build
+                return 0
+
+        prefix = name + '-'
+        stages = sorted([os.path.join(stagesDirectory, d)
+                         for d in os.listdir(stagesDirectory)
+                         if d.startswith(prefix)],
+                        key=lastUse, reverse=True)
+        for stageDirectory in stages[self.parser.stagesKept:]:
+            shutil.rmtree(stageDirectory, ignore_errors=True)
 
     def closeLib(self):
         """
-        Does the necessary cleanups and closes the parser library
+        Does the necessary cleanups and closes the parser library, unless
+        it is still used by other engines
         """
         LOGGER.debug("call def closeLib")
-        bisondynlib_close(self.libHandle)
-
-    def runEngine(self, debug=0):
+        cdef EngineLibrary library = self.library
+
+        if library is not None:
+            with _librariesLock:
+                library.users -= 1
+                if library.users == 0:
+                    del _libraries[library.engineHash]
+                    bisondynlib_close(library.handle)
+            self.library = None
+        elif self.libHandle != NULL:
+            bisondynlib_close(self.libHandle)
+
+        self.libHandle = NULL
+        self.libHash = NULL
+
+    def runEngine(self, debug=0, buffer=None):
         """
         Runs the binary parser engine, as loaded from the lib
+
+        The engine reads its input through the parser's read() method,
+        unless `buffer` is given, an object supporting the buffer protocol
+        (bytes, bytearray, memoryview, mmap, ...), which is then scanned by
+        flex directly. The buffer is held for the duration of the parse.
+        Writable buffers ending with two NUL bytes are scanned in place,
+        all others are copied once into a flex buffer.
+
+        Reentrant engines (with '%define api.pure full') keep all state of
+        a run to themselves, so several threads may run them at once, while
+        the runs of other engines, and of engines whose scanner reads its
+        input by the py_input and py_parser globals, are serialized, and
+        can't nest.
         """
         LOGGER.debug("call def runEngine")
-        cdef void *handle
+        if self.library is None:
+            raise Exception('parser engine library is not loaded')
+
+        if not self.serialized:
+            return self.runEngineIn(debug, buffer)
+        self.library.acquire()
+        try:
+            return self.runEngineIn(debug, buffer)
+        finally:
+            self.library.release()
 
+    cdef runEngineIn(self, debug, buffer):
+        """
+        Runs the engine, see runEngine.
+        """
         cdef void *cbvoid
         cdef void *invoid
+        cdef bison_input_state state
+        cdef Py_buffer view
+        cdef char *data
+        cdef int inplace = 0
+        cdef void *spanvoid = NULL
+        cdef _TokenSource source = None
 
-        handle = self.libHandle
         parser = self.parser
+        if self.library.resetFlexBuffer != NULL:
+            self.library.resetFlexBuffer()
 
         cbvoid = <void *>py_callback
         invoid = <void *>py_input
+        handlers = parser._handler_table()
+
+        if buffer is None:
+            # only the built-in reader's input is normalized, and read
+            # straight into the scanner's buffer where possible
+            normalize = bool(parser.normalize_newlines) and parser._builtin_read()
+            readinto = parser._input_readinto()
+            try:
+                py_input_begin(&state, parser, normalize, readinto)
+                try:
+                    ret = bisondynlib_run(self.library.parse, parser,
+                                          handlers, cbvoid, invoid,
+                                          <void *>&state, debug)
+                except Exception as e:
+                    ret=None
+            finally:
+                py_input_end(&state)
+
+            return ret
+
+        # span tokens keep their own hold on the buffer, for as long as any
+        # of them is alive
+        if 'span' in tokenValues(parser).values():
+            source = _TokenSource(buffer)
+            spanvoid = <void *>makeTokenSpan
 
         try:
-            ret = bisondynlib_run(handle, parser, cbvoid, invoid, debug)
-        except Exception as e:
-            ret=None
+            PyObject_GetBuffer(buffer, &view, PyBUF_WRITABLE)
+            data = <char *>view.buf
+            inplace = view.len >= 2 and data[view.len - 1] == 0 and data[view.len - 2] == 0
+        except BufferError:
+            PyObject_GetBuffer(buffer, &view, PyBUF_SIMPLE)
+        try:
+            if not inplace and view.len > 0x7fffffff:
+                raise OverflowError("buffer too large to be copied into a flex buffer")
+            try:
+                ret = bisondynlib_run_buffer(self.library.parseBuffer, parser,
+                                             handlers, cbvoid, invoid,
+                                             spanvoid, <void *>source,
+                                             <char *>view.buf, view.len, inplace, debug)
+            except Exception as e:
+                ret=None
+        finally:
+            PyBuffer_Release(&view)
 
         return ret
 
@@ -770,6 +1614,162 @@ cdef class ParserEngine:
         self.closeLib()
 
 
+cdef class FileBuffer:
+    """
+    The contents of a file, loaded for flex to scan it in place: the buffer
+    (see the buffer protocol) is writable, and ends with two NUL bytes,
+    which are not part of the file.
+
+    The file is either mapped into memory copy-on-write (io='mmap', not on
+    Windows, where it falls back to 'fd'), or read in one go with read(2)
+    without holding the GIL (io='fd'). With `newlines`, CRLF and CR newlines
+    are replaced by LF, like BisonParser.read() does.
+    """
+    cdef char *data
+    cdef size_t size
+    cdef size_t mapped
+    cdef int exports
+    cdef readonly object io
+
+    def __cinit__(self, path, io='mmap', newlines=True):
+        cdef int fd
+        cdef int pendingCR = 0
+        cdef size_t size, got = 0
+
+        if io not in ('mmap', 'fd'):
+            raise ValueError("Unknown io {!r}, expected 'mmap' or 'fd'".format(io))
+
+        with open(path, 'rb') as f:
+            fd = f.fileno()
+            size = os.fstat(fd).st_size
+            if io == 'mmap':
+                self.data = bison_input_map(fd, size, &self.mapped)
+                if self.data == NULL:
+                    LOGGER.debug("cannot map {}, reading it instead".format(path))
+                    io = 'fd'
+            if io == 'fd':
+                with nogil:
+                    self.data = bison_input_read(fd, size, &got)
+                if self.data == NULL:
+                    raise OSError(errno, os.strerror(errno), path)
+                size = got
+
+        self.io = io
+        self.size = size
+        if newlines:
+            with nogil:
+                self.size = bison_input_normalize_newlines(self.data, size, &pendingCR)
+            self.data[self.size] = self.data[self.size + 1] = 0
+
+    def __len__(self):
+        return self.size
+
+    def __getbuffer__(self, Py_buffer *view, int flags):
+        if self.data == NULL:
+            raise ValueError("file buffer is closed")
+        PyBuffer_FillInfo(view, self, self.data, self.size + 2, 0, flags)
+        self.exports += 1
+
+    def __releasebuffer__(self, Py_buffer *view):
+        self.exports -= 1
+
+    def close(self):
+        """Releases the buffer, unless it is still exported."""
+        if self.exports:
+            raise BufferError("file buffer is still in use")
+        if self.data != NULL:
+            if self.mapped:
+                bison_input_unmap(self.data, self.mapped)
+            else:
+                bison_input_free(self.data)
+            self.data = NULL
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __dealloc__(self):
+        if self.data != NULL:
+            if self.mapped:
+                bison_input_unmap(self.data, self.mapped)
+            else:
+                bison_input_free(self.data)
+
+
+cdef class _TokenSource:
+    """
+    The buffer scanned by a parser run, held for the token spans over it.
+    """
+    cdef Py_buffer view
+
+    def __cinit__(self, buffer):
+        PyObject_GetBuffer(buffer, &self.view, PyBUF_SIMPLE)
+
+    def __dealloc__(self):
+        PyBuffer_Release(&self.view)
+
+
+cdef class TokenSpan:
+    """
+    The value of a 'span' token (see BisonParser.token_values): the position
+    of the token in the parsed buffer, as byte offsets `start` and `end`.
+    The token's text is only decoded when asked for, by str() or `text`.
+
+    The offsets index the text as scanned: for parse_file and parse_string,
+    that is after normalize_newlines, so with CRLF input they fall short of
+    those in the file, unless normalization is turned off.
+
+    Spans hold on to the parsed buffer, and compare equal to the spans and
+    strings of the same text.
+    """
+    cdef _TokenSource source
+    cdef readonly Py_ssize_t start
+    cdef readonly Py_ssize_t end
+    cdef object _text
+
+    def __init__(self):
+        raise TypeError("token spans are created by the scanner")
+
+    @property
+    def text(self):
+        """The text of the token, as str."""
+        if self._text is None:
+            self._text = PyUnicode_DecodeUTF8(<char *>self.source.view.buf + self.start,
+                                              self.end - self.start, NULL)
+        return self._text
+
+    def __str__(self):
+        return self.text
+
+    def __bytes__(self):
+        return PyBytes_FromStringAndSize(<char *>self.source.view.buf + self.start,
+                                         self.end - self.start)
+
+    def __eq__(self, other):
+        if isinstance(other, TokenSpan):
+            other = (<TokenSpan>other).text
+        elif not isinstance(other, str):
+            return NotImplemented
+        return self.text == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __repr__(self):
+        return 'TokenSpan({}, {}, {!r})'.format(self.start, self.end, self.text)
+
+
+cdef object makeTokenSpan(void *source, size_t start, size_t length):
+    """Creates the value of a span token, called by the engine."""
+    cdef TokenSpan span = TokenSpan.__new__(TokenSpan)
+    span.source = <_TokenSource>source
+    span.start = start
+    span.end = start + length
+    return span
+
+
 def cmpLines(meth1, meth2):
     """
     Used as a sort() argument for sorting parse target handler methods by
@@ -797,6 +1797,149 @@ def keyLines(meth):
     return line
 
 
+class ParserGrammar(object):
+    """
+    The grammar rules of a parser class, as ripped from the docstrings of
+    its target handler methods:
+
+        - handlers - list of (name, handler) tuples of the target handlers,
+          in order of appearance in the source file
+        - rules - list of (target, options) tuples, one per handler, where
+          options is a list of the alternatives' symbol lists
+        - reductions - list of (target, option, names) tuples, one per
+          alternative of every rule, in the order of the generated parser
+          actions, where names is the tuple of the right-hand side symbols
+          passed to handlers. All strings are interned.
+
+    Grammar rules are class-level facts, so they are ripped once per class
+    by parserGrammar(), rather than on every instantiation.
+    """
+
+    def __init__(self, parser):
+        """
+        Rips the grammar rules from `parser`, a parser class or instance.
+        """
+        handlers = []
+        for name in dir(parser):
+            if name.startswith('on_'):
+                handlers.append((name, getattr(parser, name)))
+
+        handlers.sort(key=lambda nh: keyLines(nh[1]))
+        self.handlers = handlers
+        self.rules = [parseRule(h.__doc__) for name, h in handlers]
+
+        self.reductions = []
+        for target, options in self.rules:
+            for option, symbols in enumerate(options):
+                names = [s for s in symbols if s]
+                if '%prec' in names:
+                    names = names[:names.index('%prec')]
+                self.reductions.append((sys.intern(target), option,
+                                        tuple(sys.intern(n) for n in names)))
+
+        # (lex script, tokens, precedences) the hash was last calculated
+        # for, and the hash
+        self._lastHash = None
+
+    def hash(self, parser):
+        """
+        Returns the sha1 hex 'hash' of the lex script, tokens, precedences
+        and grammar rules of `parser` (see hashParserObject).
+
+        The hash is only recalculated if the lex script, tokens or
+        precedences of `parser` differ from last time.
+        """
+        hashed = (parser.lexscript, tuple(parser.tokens),
+                  tuple((direction, tuple(tokens)) for direction, tokens in parser.precedences))
+        last = self._lastHash
+        if last is None or any(a is not b and a != b
+                               for a, b in zip(hashed, last[0])):
+            last = self._lastHash = (hashed, self.calculateHash(*hashed))
+        return last[1]
+
+    def calculateHash(self, lexscript, tokens, precedences):
+        hasher = hashlib.new('sha1')
+
+        def update(o):
+            if type(o) == type(""):
+                o=o.encode("utf-8")
+            hasher.update(o)
+
+        # add the lex script
+        update(lexscript)
+
+        # add all tokens, and every precedence with all of its tokens
+        update("\0" + ",".join(tokens))
+        for direction, tokens in precedences:
+            update("\0" + direction + ":" + ",".join(tokens))
+
+        # now add in the callable handlers' docstrings, in the order of the
+        # grammar: it numbers the reductions passed by the engine's actions,
+        # so engines with the same rules in another order can't be shared
+        for name, h in self.handlers:
+            if callable(h):
+                update(h.__doc__)
+
+        # done
+        return hasher.hexdigest()
+
+
+def parserGrammar(parser):
+    """
+    Returns the ParserGrammar of a parser object.
+
+    The grammar is memoized in the '_grammar' attribute of the parser's
+    class (not inherited by subclasses, which have their own rules), so
+    only the first instantiation of a class pays for scanning the handler
+    methods and splitting their docstrings. A redefined class is a new
+    class object, and starts with an empty memo.
+
+    Parser objects defining handlers per instance get a fresh, unmemoized
+    grammar.
+    """
+    if any(name.startswith('on_') for name in vars(parser)):
+        return ParserGrammar(parser)
+
+    cls = type(parser)
+    grammar = cls.__dict__.get('_grammar')
+    if grammar is None:
+        grammar = ParserGrammar(cls)
+        cls._grammar = grammar
+    return grammar
+
+
+def parseRule(doc):
+    """
+    Carves up the docstring of a target handler into a (target, options)
+    tuple, where options is a list of the alternatives' symbol lists.
+    """
+    doc = doc.strip()
+
+    # added by Eugene Oden
+    #target, options = doc.split(":")
+    doc = re.sub(unquoted % ";", "", doc)
+
+    s = re.split(unquoted % ":", doc)
+
+    target, options = s
+    target = target.strip()
+
+    options = options.strip()
+    tmp = []
+
+    #opts = options.split("|")
+    r = unquoted % r"\|"
+    opts1 = re.split(r, " " + options)
+
+    for o in opts1:
+        o = o.strip()
+
+        tmp.append(reSpaces.split(o))
+    options = tmp
+
+    return target, options
+
+
 def hashParserObject(parser):
     """
     Calculates an sha1 hex 'hash' of the lex script
@@ -807,54 +1950,440 @@ def hashParserObject(parser):
 
     Used to detect if someone has changed any grammar rules or
     lex script, and therefore, whether a shared parser lib rebuild
-    is required.
+    is required. The hash is memoized per parser class, see
+    parserGrammar.
+    """
+    return parserGrammar(parser).hash(parser)
+
+
+def hashEngineSpec(parser, parserHash):
+    """
+    Calculates an sha1 hex 'hash' of everything a compiled parser engine
+    depends on, apart from the tools building it.
+
+    On top of the grammar rules and lex script (see hashParserObject), this
+    covers the start target, the bison options, the scanner and parser
+    table settings, the native rule actions and elided unit rules, the
+    token values, the raw C rules, the compiler flags, the python ABI the
+    engine is compiled against, and whether it is profile-guided optimized.
+    The training corpus itself is left out, so neither its location nor
+    its presence matter once the engine is built (see profileCacheKey).
+
+    The hash is embedded into the engine library, and checked against the
+    parser object when loading the library.
     """
     hasher = hashlib.new('sha1')
 
-    def update(o):
-        if type(o) == type(""):
-            o=o.encode("utf-8")
-        hasher.update(o)
+    for part in [ENGINE_ABI, parserHash, parser.start, parser.raw_c_rules] \
+            + list(parser.options) \
+            + scannerProfileOptions(parser) + parserTablesOptions(parser) \
+            + [repr(sorted(nativeActions(parser).items())),
+               repr(sorted(tokenValues(parser).items()))] \
+            + list(parser.cflags_pre) + list(parser.cflags_post) \
+            + [str(parser.debugSymbols),
+               sys.implementation.cache_tag,
+               sysconfig.get_platform(),
+               machinery.EXTENSION_SUFFIXES[0]] \
+            + (['pgo'] if parser.pgo_corpus else []):
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
 
-    # add the lex script
-    update(parser.lexscript)
+    return hasher.hexdigest()
 
-    # add the tokens
-    # workaround pyrex weirdness
-    # tokens = list(parser.tokens)
-    tokens = parser.tokens[0]
-    update(",".join(tokens))
 
-    # add the precedences
-    for direction, tokens in parser.precedences:
-        tokens = tokens[0]
-        update(direction + "".join(tokens))
+def engineCacheKey(parser, engineHash):
+    """
+    Calculates the key of a parser engine in the engine cache.
 
-    # extract the parser target handler names
-    handlerNames = dir(parser)
+    This extends the engine hash (see hashEngineSpec) by the bison and flex
+    command lines and versions, so that upgrading either tool results in a
+    fresh build rather than in a stale engine being reused.
+    """
+    hasher = hashlib.new('sha1')
+
+    for part in [engineHash,
+                 ' '.join(bisonCommand(parser)), toolVersion(parser.bisonCmd[0]),
+                 ' '.join(flexCommand(parser)), toolVersion(parser.flexCmd[0])]:
+        hasher.update(part.encode("utf-8"))
+        hasher.update(b"\0")
+
+    return hasher.hexdigest()
+
+
+def scannerProfileOptions(parser):
+    """
+    Returns the flex options of the parser's scanner_profile.
+    """
+    if parser.scanner_profile is None:
+        return []
+    try:
+        return list(SCANNER_PROFILES[parser.scanner_profile])
+    except KeyError:
+        raise ValueError("Unknown scanner profile {!r}, expected one of {}".format(
+            parser.scanner_profile, ', '.join(sorted(SCANNER_PROFILES))))
+
+
+def parserTablesOptions(parser):
+    """
+    Returns the bison options defining the parser's parser_tables.
+    """
+    options = []
+    for name, value in sorted((parser.parser_tables or {}).items()):
+        if value not in PARSER_TABLES.get(name, ()):
+            raise ValueError("Invalid parser table setting {}={!r}".format(name, value))
+        options.append('-D{}={}'.format(name, value))
+    return options
+
+
+def nativeActions(parser):
+    """
+    Returns the native rule actions of a parser (see
+    BisonParser.native_actions), as dict mapping (target, option) to
+    (action, arguments) tuples, e.g. ('tuple', (1, 3)). This includes the
+    passthrough actions of the unit rules elided by BisonParser.elide_units.
+
+    Raises ValueError for unknown actions, wrong numbers of arguments, and
+    arguments not referring to a right-hand side symbol of the rule.
+    """
+    declared = parser.native_actions or {}
+    elided = parser.elide_units
+    if isinstance(elided, str):
+        elided = (elided,)
+    actions = {}
+    for target, option, names in parserGrammar(parser).reductions:
+        spec = declared.get((target, option), declared.get(target))
+        if spec is None:
+            # unit rules of elided targets pass on their only value
+            if elided and len(names) == 1 and names[0] != 'error' \
+                    and (elided is True or target in elided):
+                actions[target, option] = ('passthrough', (1,))
+            continue
+
+        m = re.match(r'^\s*(\w+)\s*(?:\((.*)\))?\s*$', spec)
+        if m is None or m.group(1) not in NATIVE_ACTIONS:
+            raise ValueError("Unknown native action {!r} of {}, option {}".format(
+                spec, target, option))
+        name = m.group(1)
+        try:
+            args = tuple(int(a) for a in (m.group(2) or '').split(',') if a.strip())
+        except ValueError:
+            raise ValueError("Invalid native action {!r} of {}, option {}".format(
+                spec, target, option))
+
+        arities = NATIVE_ACTIONS[name]
+        if arities is not None and len(args) not in arities:
+            raise ValueError("Wrong number of arguments to native action {!r} of {}, option {}".format(
+                spec, target, option))
+        if 'error' in names or any(not 1 <= a <= len(names) for a in args):
+            raise ValueError("Native action {!r} does not fit {}, option {}: {}".format(
+                spec, target, option, ' '.join(names)))
+        if name == 'list':
+            name, args = listAction(target, option, names, args)
+        actions[target, option] = (name, args)
+
+    rotateLists(parserGrammar(parser), actions)
+    reversedLists = reversedListTargets(actions)
+    for (t, o), (name, args) in actions.items():
+        if t in reversedLists and name == 'list_append' and len(args) == 2:
+            raise ValueError("List {} is both left and right recursive".format(t))
+    if parser.start in reversedLists:
+        raise ValueError("Right-recursive list {} cannot be the start target".format(
+            parser.start))
+    return actions
+
+
+def listAction(target, option, names, args):
+    """
+    Resolves the 'list' native action of a rule into the list_append action
+    building or extending the list, e.g. ('list_append', (1, 3)) for the
+    left-recursive 'elements : elements COMMA value'.
+
+    Right-recursive rules like 'elements : value COMMA elements' resolve to
+    ('list_reversed', (3, 1)): their values get appended in reverse order,
+    and the list gets reversed once, by the rule using it (see
+    reversedListTargets). Either way, the list is built in linear time.
+    """
+    def fail():
+        raise ValueError("Native action list does not fit {}, option {}: {}".format(
+            target, option, ' '.join(names)))
+
+    nterms = len(names)
+    if target not in names:
+        if args:
+            return 'list_append', args
+        if nterms > 1:
+            fail()
+        return 'list_append', tuple(range(1, nterms + 1))
+    if nterms > 1 and names[0] == target and target not in names[1:]:
+        return 'list_append', (1, args[0] if args else nterms)
+    if nterms > 1 and names[-1] == target and target not in names[:-1]:
+        return 'list_reversed', (nterms, args[0] if args else 1)
+    fail()
+
+
+def rotateLists(grammar, actions):
+    """
+    Turns the right-recursive native lists of `actions` (see nativeActions)
+    into left-recursive ones, where this keeps the language of the grammar.
+
+    A right-recursive list 'L : B | B S L' is rotated into 'L : B | L S B',
+    when the B's of its recursive rules are the same as its other rules,
+    and all share the same separator S. Bison then parses the list in
+    constant stack depth, and its values get appended in order. The rotated
+    rules' actions become ('list_rotated', (len(B), item)).
+    """
+    options = {}
+    for target, option, names in grammar.reductions:
+        options.setdefault(target, []).append((option, names))
+
+    symbols = {}
+    for target, alternatives in grammar.rules:
+        for option, alternative in enumerate(alternatives):
+            symbols[target, option] = alternative
+
+    for target, alternatives in options.items():
+        kinds = [actions.get((target, o), (None,))[0] for o, names in alternatives]
+        if 'list_reversed' not in kinds or any(
+                k not in ('list_append', 'list_reversed') for k in kinds):
+            continue
+
+        bases = set(names for o, names in alternatives
+                    if actions[target, o][0] == 'list_append')
+        prefixes = set()
+        separators = set()
+        rotated = {}
+        for o, names in alternatives:
+            name, args = actions[target, o]
+            if name != 'list_reversed':
+                continue
+            for b in bases:
+                if names[:len(b)] == b and args[1] <= len(b) \
+                        and '%prec' not in symbols[target, o]:
+                    prefixes.add(b)
+                    separators.add(names[len(b):-1])
+                    rotated[target, o] = ('list_rotated', (len(b), args[1]))
+                    break
+            else:
+                break
+        else:
+            if prefixes == bases and len(separators) == 1:
+                actions.update(rotated)
+
+
+def rotatedListSymbols(names, action):
+    """
+    Returns the right-hand side symbols of a rule rotated by rotateLists.
+    """
+    n = action[1][0]
+    return list(names[-1:]) + list(names[n:-1]) + list(names[:n])
+
+
+def reversedListTargets(actions):
+    """
+    Returns the targets of the native actions `actions` (see nativeActions),
+    whose lists are built in reverse order.
+    """
+    return set(t for (t, o), (name, args) in actions.items()
+               if name == 'list_reversed')
+
+
+def nativeActionCode(action, nterms):
+    """
+    Returns the C expression computing the value of a native rule action,
+    as returned by nativeActions, for a rule with `nterms` right-hand side
+    symbols.
+    """
+    name, args = action
+    values = ['$%d' % a for a in args]
+    if name == 'tuple':
+        return 'native_tuple(%s)' % ', '.join([str(len(args))] + values)
+    if name == 'list_rotated':
+        return 'native_list_append($1, $%d)' % (nterms - args[0] + args[1])
+    if name == 'list_reversed':
+        return 'native_list_append(%s)' % ', '.join(values)
+    if name == 'list_append':
+        # without arguments, start a list with the only value, or append
+        # the last value to the list of a left-recursive rule
+        if not args:
+            values = ['$1', '$%d' % nterms] if nterms > 1 else ['$1'] if nterms else []
+        if len(values) == 2:
+            return 'native_list_append(%s)' % ', '.join(values)
+        return 'native_list(%s)' % (values[0] if values else 'NULL')
+    if name == 'dict_from_pairs':
+        return 'native_dict_from_pairs(%s)' % (values[0] if values else 'NULL')
+    if name == 'none':
+        return 'native_passthrough(NULL)'
+    return 'native_passthrough(%s)' % values[0]
+
+
+def tokenMacros(lexscript):
+    """
+    Returns the flex %top block prepended to `lexscript`, defining the
+    macros for reading the input and returning tokens:
+
+        PYBISON_INPUT(buf, result, max_size)
+                               - reads the next block of input, i.e. the
+                                 definition of YY_INPUT
+        PYBISON_TOKEN_TEXT()   - new reference to the matched text as
+                                 str, created without copying yytext first
+        PYBISON_TOKEN(tok)     - sets the token value to the matched text,
+                                 as declared by BisonParser.token_values,
+                                 and returns `tok`
+        PYBISON_TOKEN_OFFSET() - offset of the matched text in the scanned
+                                 buffer, which is only meaningful when
+                                 parsing a buffer rather than read() input
+
+    The value is owned by the parser, which releases it after the rule
+    action using it, or when discarding the token.
+    """
+    if re.search(r'^\s*%option\b.*\bbison-bridge\b', lexscript, re.M):
+        value = '*yylval'
+    else:
+        value = 'yylval'
+    if re.search(r'^\s*%option\b.*\breentrant\b', lexscript, re.M):
+        # the parser run's context is the scanner's extra data
+        context = ['#define PYBISON_CONTEXT ((struct pybison_context *)yyextra)']
+    else:
+        context = ['extern struct pybison_context *pybison_ctx;',
+                   '#define PYBISON_CONTEXT pybison_ctx']
+    return '\n'.join([
+        '%top{',
+        '#include "Python.h"',
+        'struct pybison_context;',
+        'void pybison_input(struct pybison_context *ctx, char *buf, int *result, int max_size);',
+        'void *pybison_token_value(struct pybison_context *ctx, int tok, const char *text, int len, size_t offset);',
+    ] + context + [
+        '#define PYBISON_INPUT(buf, result, max_size) pybison_input(PYBISON_CONTEXT, (buf), &(result), (max_size))',
+        '#define PYBISON_TOKEN_TEXT() ((void *)PyUnicode_FromStringAndSize(yytext, yyleng))',
+        '#define PYBISON_TOKEN_OFFSET() ((size_t)(yytext - YY_CURRENT_BUFFER_LVALUE->yy_ch_buf))',
+        '#define PYBISON_TOKEN(tok) { %s = pybison_token_value(PYBISON_CONTEXT, (tok), yytext, yyleng, PYBISON_TOKEN_OFFSET()); return (tok); }' % value,
+        '}',
+        '',
+    ])
+
+
+def tokenValues(parser):
+    """
+    Returns the kinds of the token values of a parser (see
+    BisonParser.token_values), as dict mapping tokens to kinds, without
+    the tokens whose values are str.
+
+    Raises ValueError for unknown tokens and kinds.
+    """
+    kinds = {}
+    for token, kind in (parser.token_values or {}).items():
+        if token not in parser.tokens:
+            raise ValueError("Token value of unknown token {!r}".format(token))
+        if kind not in TOKEN_VALUES:
+            raise ValueError("Unknown value {!r} of token {}, expected one of {}".format(
+                kind, token, ', '.join(TOKEN_VALUES)))
+        if kind != 'str':
+            kinds[token] = kind
+    return kinds
+
+
+def tokenValuesCode(kinds):
+    """
+    Returns the C code of pybison_token_value(), which the scanner calls to
+    create the value of a token (see tokenMacros), for the token value
+    kinds returned by tokenValues. Interned tokens get a cached string each,
+    which is reused as long as the token's text stays the same. Span tokens
+    are str when the input is read through read(), rather than scanned as a
+    buffer.
+    """
+    interned = sorted(t for t, k in kinds.items() if k == 'interned')
+    lines = [TOKEN_VALUES_C if kinds else '']
+    if interned:
+        lines.append('static PyObject *token_strings[%d];' % len(interned))
+    lines += [
+        'void *pybison_token_value(struct pybison_context *ctx, int tok, const char *text, int len, size_t offset)',
+        '{',
+        '    switch (tok) {',
+    ]
+    spans = sorted(t for t, k in kinds.items() if k == 'span')
+    if spans:
+        lines += ['    case %s:' % t for t in spans]
+        lines += ['        if (ctx->token_span)',
+                  '            return ctx->token_span(ctx->token_source, offset, len);',
+                  '        return PyUnicode_FromStringAndSize(text, len);']
+    for i, token in enumerate(interned):
+        lines += ['    case %s:' % token,
+                  '        return token_interned(&token_strings[%d], text, len);' % i]
+    for kind, code in [('none', 'NULL'),
+                       ('int', 'token_int(text, len)'),
+                       ('float', 'token_float(text, len)'),
+                       ('bytes', 'PyBytes_FromStringAndSize(text, len)')]:
+        tokens = sorted(t for t, k in kinds.items() if k == kind)
+        if tokens:
+            lines += ['    case %s:' % t for t in tokens]
+            lines.append('        return %s;' % code)
+    lines += [
+        '    default:',
+        '        return PyUnicode_FromStringAndSize(text, len);',
+        '    }',
+        '}',
+    ]
+    return '\n'.join(lines)
+
+
+def bisonCommand(parser):
+    """
+    Returns the bison command line of a parser, except for the filename.
+    """
+    return list(parser.bisonCmd) + parserTablesOptions(parser)
+
+
+def flexCommand(parser):
+    """
+    Returns the flex command line of a parser, except for the filename.
+    """
+    return list(parser.flexCmd) + scannerProfileOptions(parser)
+
+
+def profileCacheKey(cacheKey, corpus):
+    """
+    Calculates the key of the profile data of a profile-guided optimized
+    engine in the engine cache, from the engine's cache key and the
+    contents of its training corpus.
+    """
+    hasher = hashlib.new('sha1')
+    hasher.update(cacheKey.encode("utf-8"))
+    for sample in corpus:
+        hasher.update(b"\0")
+        with open(sample, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                hasher.update(block)
 
-    #handlerNames = filter(lambda m: m.startswith('on_'), dir(parser))
-    tmp = []
-    for name in handlerNames:
-        if name.startswith('on_'):
-            tmp.append(name)
-    handlerNames = tmp
-    handlerNames.sort()
-
-    # extract method objects, filter down to callables
-    #handlers = [getattr(parser, m) for m in handlerNames]
-    #handlers = filter(lambda h: callable(h), handlers)
-    tmp = []
-    for m in handlerNames:
-        attr = getattr(parser, m)
-        if callable(attr):
-            tmp.append(attr)
-    handlers = tmp
-
-    # now add in the methods' docstrings
-    for h in handlers:
-        docString = h.__doc__
-        update(docString)
-
-    # done
     return hasher.hexdigest()
+
+
+def supportsProfiles():
+    """
+    Returns True if the C compiler supports gcc's profile-guided
+    optimization, otherwise logs a warning and returns False.
+    """
+    if sys.platform != 'win32':
+        cc = os.environ.get('CC') or sysconfig.get_config_var('CC') or 'cc'
+        version = toolVersion(cc.split()[0])
+        if version and 'clang' not in version.lower():
+            return True
+    LOGGER.warning("profile-guided optimization needs gcc, building the "
+                   "engine without it")
+    return False
+
+
+_toolVersions = {}
+
+def toolVersion(cmd):
+    """
+    Returns the first line of `cmd --version`, or an empty string if the
+    tool is not available. Results are memoized for the process lifetime.
+    """
+    if cmd not in _toolVersions:
+        try:
+            out = subprocess.run([cmd, '--version'], stdout=subprocess.PIPE,
+                                 stderr=subprocess.DEVNULL).stdout
+            _toolVersions[cmd] = out.decode('utf-8', 'replace').strip().split('\n')[0]
+        except OSError:
+            _toolVersions[cmd] = ''
+    return _toolVersions[cmd]
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+import pytest
+
+from parsers import WordsParser
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_jobs(jobs, build_kwargs):
+    parser = WordsParser(build_jobs=jobs, **build_kwargs)
+    assert parser.parse_string("a b") == ["a", "b"]
+
+
+@pytest.mark.parametrize("jobs", [0, -1, 1.5, "2"])
+def test_invalid_build_jobs(jobs, build_kwargs):
+    with pytest.raises(ValueError, match="build_jobs"):
+        WordsParser(build_jobs=jobs, lazy=True, **build_kwargs)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import multiprocessing
+import os
+import sys
+from importlib import machinery
+
+import pytest
+
+from parsers import WordsParser
+
+
+COUNTING_BISON = r"""
+import os
+import sys
+
+with open(os.environ["PYBISON_BUILD_COUNTER"], "a") as f:
+    f.write("bison\n")
+os.execvp("bison", ["bison"] + sys.argv[1:])
+"""
+
+
+def fresh_parser(tmp_path):
+    """
+    Returns a subclass of the words parser, with an engine which no other
+    test loaded into this process, so that the forked processes of a test
+    need to find or build it.
+    """
+    class FreshParser(WordsParser):
+        raw_c_rules = "/* {} */".format(tmp_path)
+
+    return FreshParser
+
+
+def build_and_parse(cls, barrier, results, kwargs):
+    barrier.wait()
+    parser = cls(**kwargs)
+    results.put(parser.parse_string("one two three"))
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="wraps the bison executable")
+def test_concurrent_instantiation_builds_engine_once(tmp_path, monkeypatch, build_kwargs):
+    cls = fresh_parser(tmp_path)
+    script = tmp_path / "bison.py"
+    script.write_text(COUNTING_BISON)
+    counter = tmp_path / "counter"
+    counter.touch()
+    monkeypatch.setenv("PYBISON_BUILD_COUNTER", str(counter))
+    monkeypatch.setattr(cls, "bisonCmd",
+                        [sys.executable, str(script), "-d", "-v", "-t"])
+
+    n = 8
+    ctx = multiprocessing.get_context("fork")
+    barrier = ctx.Barrier(n)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=build_and_parse,
+                         args=(cls, barrier, results, build_kwargs))
+             for _ in range(n)]
+    for p in procs:
+        p.start()
+    parsed = [results.get(timeout=120) for _ in procs]
+    for p in procs:
+        p.join()
+
+    assert all(p.exitcode == 0 for p in procs)
+    assert parsed == [["one", "two", "three"]] * n
+    assert counter.read_text().count("bison") == 1
+
+
+def parse_in_child(cls, kwargs):
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+    proc = ctx.Process(target=build_and_parse, args=(cls, ctx.Barrier(1), results, kwargs))
+    proc.start()
+    parsed = results.get(timeout=120)
+    proc.join()
+    return parsed
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="forks the test process")
+def test_unloadable_cached_engine_is_rebuilt(tmp_path, build_kwargs):
+    cls = fresh_parser(tmp_path)
+    assert parse_in_child(cls, build_kwargs) == ["one", "two", "three"]
+
+    engines = list((tmp_path / "cache").glob("*" + machinery.EXTENSION_SUFFIXES[0]))
+    assert len(engines) == 1
+    engines[0].write_bytes(b"not a library")
+
+    assert parse_in_child(cls, build_kwargs) == ["one", "two", "three"]
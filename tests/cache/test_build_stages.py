@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import os
+import shutil
+import sys
+
+import pytest
+
+from parsers import WordsParser
+
+
+COUNTING_TOOL = r"""
+import os
+import sys
+
+with open(os.environ["PYBISON_BUILD_COUNTER"], "a") as f:
+    f.write(sys.argv[1] + "\n")
+os.execvp(sys.argv[1], sys.argv[1:])
+"""
+
+
+def counted_parser(tmp_path, monkeypatch):
+    """
+    Returns a subclass of the words parser, with an engine of its own,
+    which runs bison and flex through a wrapper counting their runs, and a
+    function returning the runs so far.
+    """
+    script = tmp_path / "tool.py"
+    script.write_text(COUNTING_TOOL)
+    counter = tmp_path / "counter"
+    counter.touch()
+    monkeypatch.setenv("PYBISON_BUILD_COUNTER", str(counter))
+
+    class CountedParser(WordsParser):
+        raw_c_rules = "/* {} */".format(tmp_path)
+        bisonCmd = [sys.executable, str(script), "bison", "-d", "-v", "-t"]
+        flexCmd = [sys.executable, str(script), "flex", "-v", '--header-file="lex.yy.h"']
+
+    # bison and flex run concurrently, in either order
+    return CountedParser, lambda: sorted(counter.read_text().split())
+
+
+def stages(build_kwargs, name):
+    stagesDirectory = os.path.join(build_kwargs["buildDirectory"], "stages")
+    return [d for d in os.listdir(stagesDirectory) if d.startswith(name + "-")]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="wraps the bison and flex executables")
+def test_lexscript_edit_reruns_flex_only(tmp_path, monkeypatch, build_kwargs):
+    cls, runs = counted_parser(tmp_path, monkeypatch)
+    assert cls(**build_kwargs).parse_string("a b") == ["a", "b"]
+    assert runs() == ["bison", "flex"]
+    # the rules hash, the bison and the flex output
+    assert len(stages(build_kwargs, "compile")) == 3
+
+    class EditedParser(cls):
+        lexscript = cls.lexscript.replace(r"[ \r\n]", r"[ \t\r\n]")
+
+    assert EditedParser(**build_kwargs).parse_string("a\tb") == ["a", "b"]
+    assert runs() == ["bison", "flex", "flex"]
+    # the bison output is compiled once, only the other two again
+    assert len(stages(build_kwargs, "compile")) == 5
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="wraps the bison and flex executables")
+def test_vanished_stage_runs_again(tmp_path, monkeypatch, build_kwargs):
+    cls, runs = counted_parser(tmp_path, monkeypatch)
+    cls(**build_kwargs)
+
+    # a concurrent build prunes the bison stage, while it is being copied
+    copyfile = shutil.copyfile
+
+    def pruningCopyfile(src, dst, **kw):
+        stageDirectory = os.path.dirname(src)
+        if os.path.basename(stageDirectory).startswith("bison-"):
+            shutil.rmtree(stageDirectory)
+        return copyfile(src, dst, **kw)
+
+    monkeypatch.setattr(shutil, "copyfile", pruningCopyfile)
+
+    class EditedParser(cls):
+        lexscript = cls.lexscript.replace(r"[ \r\n]", r"[ \t\r\n]")
+
+    assert EditedParser(**build_kwargs).parse_string("a\tb") == ["a", "b"]
+    assert runs() == ["bison", "bison", "flex", "flex"]
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+import os
+
+from bison.cache import EngineCache
+
+
+def make_engine(tmp_path, name, size):
+    filename = tmp_path / name
+    filename.write_bytes(b"\0" * size)
+    return str(filename)
+
+
+def test_lookup_after_store(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache"))
+    assert cache.lookup("a" * 40) is None
+
+    stored = cache.store("a" * 40, make_engine(tmp_path, "engine", 10))
+    assert cache.lookup("a" * 40) == stored
+    assert cache.size() == 10
+
+
+def test_least_recently_used_engine_is_evicted(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache"), maxSize=25)
+    engine = make_engine(tmp_path, "engine", 10)
+
+    first = cache.store("1" * 40, engine)
+    cache.store("2" * 40, engine)
+    # use the first engine again, so the second one is the oldest
+    cache.lookup("1" * 40)
+    cache.store("3" * 40, engine)
+
+    assert os.path.isfile(first)
+    assert cache.lookup("2" * 40) is None
+    assert cache.size() == 20
+
+
+def test_unindexed_engine_is_adopted(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache"))
+    stored = cache.store("a" * 40, make_engine(tmp_path, "engine", 10))
+    os.unlink(cache.indexFile)
+
+    assert cache.lookup("a" * 40) == stored
+    assert cache.size() == 10
+    cache.store("b" * 40, make_engine(tmp_path, "engine", 5))
+    assert cache.size() == 15
+
+
+def test_lookup_leaves_index_alone(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache"))
+    cache.store("a" * 40, make_engine(tmp_path, "engine", 10))
+    before = os.stat(cache.indexFile)
+
+    for _ in range(100):
+        cache.lookup("a" * 40)
+    assert os.stat(cache.indexFile).st_mtime_ns == before.st_mtime_ns
+
+
+def test_lock_files_are_evicted(tmp_path):
+    cache = EngineCache(str(tmp_path / "cache"), maxSize=15)
+    engine = make_engine(tmp_path, "engine", 10)
+    for key in ("1" * 40, "2" * 40):
+        with cache.lock(key):
+            cache.store(key, engine)
+
+    assert not os.path.exists(os.path.join(cache.root, "1" * 40 + ".lock"))
+    assert os.path.exists(os.path.join(cache.root, "2" * 40 + ".lock"))
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import gc
+import shutil
+import sys
+
+import pytest
+
+from parsers import WordsParser
+
+
+class SharedParser(WordsParser):
+    raw_c_rules = "/* shared */"
+
+
+def mapped(filename):
+    with open("/proc/self/maps") as f:
+        return filename in f.read()
+
+
+def test_second_instance_reuses_library(tmp_path, build_kwargs):
+    first = SharedParser(**build_kwargs)
+    filename = first.engine.libFilename_py
+
+    # nothing left on disk to build or load from
+    shutil.rmtree(tmp_path / "build")
+    shutil.rmtree(tmp_path / "cache")
+    second = SharedParser(**build_kwargs)
+    assert second.engine.libFilename_py == filename
+    assert second.parse_string("a b") == ["a", "b"]
+    assert first.parse_string("c") == ["c"]
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="reads /proc/self/maps")
+def test_library_closed_by_last_user(build_kwargs):
+    first = SharedParser(**build_kwargs)
+    second = SharedParser(**build_kwargs)
+    filename = first.engine.libFilename_py
+    assert mapped(filename)
+
+    # lose a race against the first engine: the library is opened again,
+    # and dlopen returns the handle already loaded
+    engine = second.engine
+    engine.closeLib()
+    engine.openLib()
+    engine.registerLib()
+    assert second.parse_string("a b") == ["a", "b"]
+
+    del first
+    gc.collect()
+    assert mapped(filename)
+
+    del second, engine
+    gc.collect()
+    assert not mapped(filename)
@@ -0,0 +1,13 @@
+#!/usr/bin/env python
+import os
+
+import pytest
+
+
+@pytest.fixture
+def build_kwargs(tmp_path):
+    """Keeps the builds and the engine cache of a test to itself."""
+    return {
+        "buildDirectory": str(tmp_path / "build") + os.path.sep,
+        "cacheDirectory": str(tmp_path / "cache"),
+    }
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+from bison.bison_ import hashParserObject, parserGrammar
+
+
+def make_parser_class(rule):
+    # only the grammar attributes matter here, so there is no need to build
+    # an engine
+    class GrammarOnly(object):
+        tokens = ["NUMBER", "PLUS"]
+        precedences = ()
+        lexscript = "%%\n[0-9]+ { returntoken(NUMBER); }\n%%\n"
+
+        def on_expr(self, target, option, names, values):
+            pass
+
+        def on_term(self, target, option, names, values):
+            """
+            term : NUMBER
+            """
+
+    GrammarOnly.on_expr.__doc__ = rule
+    return GrammarOnly
+
+
+def test_grammar_memoized_per_class():
+    cls = make_parser_class("expr : term | expr PLUS term")
+    first, second = cls(), cls()
+
+    assert parserGrammar(first) is parserGrammar(second)
+    assert parserGrammar(first).rules == [
+        ("expr", [["term"], ["expr", "PLUS", "term"]]),
+        ("term", [["NUMBER"]]),
+    ]
+    assert hashParserObject(first) == hashParserObject(second)
+
+
+def test_grammar_redefined_class():
+    old = make_parser_class("expr : term | expr PLUS term")()
+    new = make_parser_class("expr : term | term PLUS expr")()
+
+    assert parserGrammar(old) is not parserGrammar(new)
+    assert hashParserObject(old) != hashParserObject(new)
+
+
+def test_grammar_instance_overrides():
+    cls = make_parser_class("expr : term")
+    parser, other = cls(), cls()
+    other.lexscript = "%%\n[0-9]+ { returntoken(PLUS); }\n%%\n"
+
+    assert hashParserObject(parser) != hashParserObject(other)
+    assert hashParserObject(parser) == hashParserObject(cls())
+
+
+def test_grammar_order_hashed():
+    cls = make_parser_class("expr : term | expr PLUS term")
+
+    # the same rules, defined in the opposite order
+    class Reordered(cls):
+        def on_term(self, target, option, names, values):
+            """
+            term : NUMBER
+            """
+
+        def on_expr(self, target, option, names, values):
+            """
+            expr : term | expr PLUS term
+            """
+
+    assert [target for target, _ in parserGrammar(Reordered()).rules] == ["term", "expr"]
+    assert hashParserObject(Reordered()) != hashParserObject(cls())
+
+
+def test_tokens_and_precedences_hashed():
+    cls = make_parser_class("expr : term | expr PLUS term")
+    parser = cls()
+    key = hashParserObject(parser)
+
+    parser.precedences = (("left", ("PLUS",)),)
+    with_plus = hashParserObject(parser)
+    assert with_plus != key
+
+    # tokens besides the first of a precedence count, too
+    parser.precedences = (("left", ("PLUS", "NUMBER")),)
+    assert hashParserObject(parser) != with_plus
+    parser.precedences = (("left", ("PLUS",)), ("right", ("NUMBER",)))
+    assert hashParserObject(parser) != with_plus
+
+    parser.precedences = ()
+    assert hashParserObject(parser) == key
+    parser.tokens = ["NUMBER", "PLUS", "MINUS"]
+    assert hashParserObject(parser) != key
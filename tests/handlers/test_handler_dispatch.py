@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import pytest
+
+from bison import positional
+from parsers import PairsParser
+
+
+def test_direct_dispatch(build_kwargs):
+    parser = PairsParser(**build_kwargs)
+    result = parser.parse_string("a=1 b=fail")
+
+    assert result[0] == ("pair", 0, ("WORD", "EQUAL", "WORD"), "a", "1")
+    # exceptions raised by handlers are passed on as values
+    assert isinstance(result[1], ValueError)
+    assert result[1].args == ("b",)
+    assert parser.last is result
+
+
+def test_names_built_once(build_kwargs):
+    parser = PairsParser(**build_kwargs)
+    first, second = parser.parse_string("a=1 b=2")
+
+    assert first[2] == ("WORD", "EQUAL", "WORD")
+    assert first[2] is second[2]
+
+
+def test_hook_handler(build_kwargs):
+    hooked = []
+
+    class HookedParser(PairsParser):
+        def hook_handler(self, target, option, names, values, retval):
+            hooked.append((target, option))
+            return retval
+
+    assert HookedParser(**build_kwargs).parse_string("a=1") == \
+        [("pair", 0, ("WORD", "EQUAL", "WORD"), "a", "1")]
+    assert hooked == [("input", 0), ("pair", 0), ("input", 1)]
+
+
+def test_overridden_handle(build_kwargs):
+    class NodesParser(PairsParser):
+        def _handle(self, targetname, option, names, values):
+            self.last = (targetname, option, values)
+            return self.last
+
+    assert NodesParser(**build_kwargs).parse_string("a=1") == \
+        ("input", 1, (("input", 0, ()), ("pair", 0, ("a", "=", "1"))))
+
+
+def test_positional_convention(build_kwargs):
+    class PositionalParser(PairsParser):
+        handler_convention = "positional"
+
+        @staticmethod
+        def on_input(option, values):
+            """
+            input :
+                  | input pair
+            """
+            return [] if option == 0 else values[0] + [values[1]]
+
+        def on_pair(self, target, values):
+            """
+            pair : WORD EQUAL WORD
+            """
+            return target, values
+
+    assert PositionalParser(**build_kwargs).parse_string("a=1") == \
+        [("pair", ("a", "=", "1"))]
+
+
+def test_positional_decorator(build_kwargs):
+    class DecoratedParser(PairsParser):
+        @staticmethod
+        @positional
+        def on_pair(names, values):
+            """
+            pair : WORD EQUAL WORD
+            """
+            return dict(zip(names, values))
+
+    for verbose in (False, True):
+        parser = DecoratedParser(verbose=verbose, **build_kwargs)
+        assert parser.parse_string("a=1") == \
+            [{"WORD": "1", "EQUAL": "="}]
+
+
+def test_handler_table_kept(build_kwargs):
+    parser = PairsParser(**build_kwargs)
+    table = parser._handler_table()
+    parser.parse_string("a=1")
+    assert parser._handler_table() is table
+
+    # handlers set on the instance are picked up
+    def on_pair(target, option, names, values):
+        """
+        pair : WORD EQUAL WORD
+        """
+        return values[2]
+
+    parser.on_pair = on_pair
+    assert parser._handler_table() is not table
+    assert parser.parse_string("a=1 b=2") == ["1", "2"]
+
+
+def test_misspelled_convention(build_kwargs):
+    class MisspelledParser(PairsParser):
+        handler_convention = "posiitonal"
+
+    with pytest.raises(ValueError, match="posiitonal"):
+        MisspelledParser(**build_kwargs)
+
+    parser = PairsParser(**build_kwargs)
+    parser.handler_convention = "posiitonal"
+    with pytest.raises(ValueError, match="posiitonal"):
+        parser.parse_string("a=1")
+    with pytest.raises(ValueError, match="posiitonal"):
+        parser.parse_bytes(b"a=1")
+
+
+def test_unknown_positional_parameter(build_kwargs):
+    class UnknownParser(PairsParser):
+        @positional
+        def on_pair(self, values, extra):
+            """
+            pair : WORD EQUAL WORD
+            """
+
+    with pytest.raises(TypeError):
+        UnknownParser(**build_kwargs)
+
+    lazy = UnknownParser(lazy=True, **build_kwargs)
+    with pytest.raises(TypeError):
+        lazy.parse_bytes(b"a=1")
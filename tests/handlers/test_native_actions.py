@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+import pytest
+
+from parsers import PairsParser
+
+
+class NativeParser(PairsParser):
+    native_actions = {
+        ("input", 0): "list_append",
+        ("input", 1): "list_append",
+        "pair": "tuple(1, 3)",
+    }
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input pair
+        """
+        raise AssertionError("native action not used")
+
+
+def test_native_actions(build_kwargs):
+    parser = NativeParser(**build_kwargs)
+    result = parser.parse_string("a=1 b=2 c=3")
+
+    assert result == [("a", "1"), ("b", "2"), ("c", "3")]
+    # the start target's value still becomes the parse result
+    assert parser.last is result
+
+
+def test_native_dict_and_passthrough(build_kwargs):
+    class DictParser(PairsParser):
+        native_actions = {
+            "input": "dict_from_pairs(1)",
+            ("pairs", 0): "list_append",
+            ("pairs", 1): "list_append",
+            "pair": "tuple(1, 3)",
+        }
+
+        def on_input(self, target, option, names, values):
+            """
+            input : pairs
+            """
+
+        def on_pairs(self, target, option, names, values):
+            """
+            pairs :
+                  | pairs pair
+            """
+
+    assert DictParser(**build_kwargs).parse_string("a=1 b=2 a=3") == \
+        {"a": "3", "b": "2"}
+
+
+@pytest.mark.parametrize("action", ["tuple(4)", "passthrough", "frobnicate(1)", "tuple(x)"])
+def test_invalid_native_actions(build_kwargs, action):
+    with pytest.raises(ValueError):
+        NativeParser(native_actions={"pair": action}, **build_kwargs)
+
+
+def test_native_right_recursive_lists(build_kwargs):
+    class ListsParser(PairsParser):
+        native_actions = {
+            "pairs": "list",
+            "pair": "tuple(1, 3)",
+        }
+
+        def on_input(self, target, option, names, values):
+            """
+            input : pairs
+            """
+            return values[0]
+
+        def on_pairs(self, target, option, names, values):
+            """
+            pairs : pair
+                  | pair pairs
+            """
+
+    # more pairs than fit on bison's stack, unless the list gets rotated
+    # into a left-recursive one
+    text = " ".join("k%d=%d" % (i, i) for i in range(20000))
+    result = ListsParser(**build_kwargs).parse_string(text)
+    assert result == [("k%d" % i, str(i)) for i in range(20000)]
+
+
+def test_native_reversed_lists(build_kwargs):
+    class WordsParser(PairsParser):
+        native_actions = {"words": "list"}
+
+        def on_input(self, target, option, names, values):
+            """
+            input : words EQUAL words
+            """
+            return values[0], values[2]
+
+        def on_words(self, target, option, names, values):
+            """
+            words :
+                  | WORD words
+            """
+
+    assert WordsParser(**build_kwargs).parse_string("a b c = d e") == \
+        (["a", "b", "c"], ["d", "e"])
+
+
+def test_elide_units(build_kwargs):
+    calls = []
+
+    class UnitsParser(PairsParser):
+        elide_units = ("item", "value")
+
+        def on_input(self, target, option, names, values):
+            """
+            input : item
+                  | input item
+            """
+            calls.append(target)
+            return [values[0]] if option == 0 else values[0] + [values[1]]
+
+        def on_item(self, target, option, names, values):
+            """
+            item : pair
+                 | value
+            """
+            calls.append(target)
+
+        def on_value(self, target, option, names, values):
+            """
+            value : WORD
+            """
+            calls.append(target)
+
+        def on_pair(self, target, option, names, values):
+            """
+            pair : value EQUAL value
+            """
+            calls.append(target)
+            return values[0], values[2]
+
+    assert UnitsParser(**build_kwargs).parse_string("a=1 b c=2") == \
+        [("a", "1"), "b", ("c", "2")]
+    assert calls == ["pair", "input", "input", "pair", "input"]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+import mmap
+
+import pytest
+
+from parsers import CountingParser, PairsParser, global_lexscript
+
+
+def test_parse_buffers(tmp_path, build_kwargs):
+    parser = CountingParser(**build_kwargs)
+
+    assert parser.parse_bytes(b"a b\nc") == ["a", "b", "c"]
+    assert parser.parse_buffer(memoryview(b"xx d e")[3:]) == ["d", "e"]
+
+    # scanned in place, and left as it was
+    data = bytearray(b"f g\0\0")
+    assert parser.parse_buffer(data) == ["f", "g"]
+    assert data == b"f g\0\0"
+
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"h i j\n")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        assert parser.parse_buffer(m) == ["h", "i", "j"]
+
+    assert parser.reads == 0
+
+
+def test_parse_string_uses_read(build_kwargs):
+    # read() is overridden, so parse_string must still go through it
+    parser = CountingParser(**build_kwargs)
+    assert parser.parse_string("k l") == ["k", "l"]
+    assert parser.reads > 0
+
+
+class GlobalPairsParser(PairsParser):
+    """
+    The pairs parser, with an engine which is not reentrant.
+    """
+    options = ["%define api.value.type {void *}"]
+
+    lexscript = global_lexscript("GlobalPairsParser", r"""
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    =           { PYBISON_TOKEN(EQUAL); }
+    [ \n]       { }
+""")
+
+
+@pytest.mark.parametrize("cls", [PairsParser, GlobalPairsParser],
+                         ids=["reentrant", "global"])
+def test_parse_buffer_after_syntax_error(build_kwargs, cls):
+    class SkippingParser(cls):
+        def report_syntax_error(self, msg, yytext, first_line, first_col,
+                                last_line, last_col):
+            self.syntax_errors.append(yytext)
+
+    class ReadingParser(SkippingParser):
+        def read(self, nbytes):
+            return self.file.readline(nbytes)
+
+    text = "a=1 =\nb=2 c=3\n"
+    expected = [("pair", 0, ("WORD", "EQUAL", "WORD"), "b", "2"),
+                ("pair", 0, ("WORD", "EQUAL", "WORD"), "c", "3")]
+    for parser in (SkippingParser(**build_kwargs), ReadingParser(**build_kwargs)):
+        parser.syntax_errors = []
+        # the run aborted by the stray '=' is followed by another one on
+        # the rest of the input, as with read() input
+        assert parser.parse_string(text) == expected
+        assert parser.syntax_errors == ["="]
+        parser.syntax_errors = []
+        assert parser.parse_bytes(b"d=4 = e=5") == [expected[0][:3] + ("e", "5")]
+        assert parser.syntax_errors == ["="]
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import pytest
+
+from parsers import CountingParser
+
+
+@pytest.mark.parametrize("io", ["mmap", "fd", "read"])
+def test_parse_file(tmp_path, build_kwargs, io):
+    parser = CountingParser(**build_kwargs)
+    path = tmp_path / "input.txt"
+
+    path.write_bytes(b"a b\r\nc\rd\n")
+    assert parser.parse_file(str(path), io=io) == ["a", "b", "c", "d"]
+
+    # exactly one page, so the terminating NULs need a page of their own
+    words = [("w%d" % i).encode() for i in range(1000)]
+    text = b" ".join(words)
+    text += b" " * (4096 - len(text) % 4096)
+    path.write_bytes(text)
+    assert parser.parse_file(str(path), io=io) == [w.decode() for w in words]
+
+    path.write_bytes(b"")
+    assert parser.parse_file(str(path), io=io) == []
+
+    assert (parser.reads > 0) == (io == "read")
+
+
+def test_parse_file_default_io(tmp_path, build_kwargs):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"a b")
+
+    # read() is overridden by the test parser, so it is used by default
+    parser = CountingParser(**build_kwargs)
+    assert parser.parse_file(str(path)) == ["a", "b"]
+    assert parser.reads > 0
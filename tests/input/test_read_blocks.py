@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import io
+
+import pytest
+
+from bison import BisonParser
+from parsers import CountingParser, WordsParser
+
+
+def test_read_blocks(build_kwargs):
+    parser = CountingParser(**build_kwargs)
+    text = b"\r\n".join(b"w%d" % i for i in range(20000))
+    assert parser.run(file=io.BytesIO(text)) == ["w%d" % i for i in range(20000)]
+    # read in blocks, not lines
+    assert parser.reads < 100
+
+
+class BlocksFile(io.RawIOBase):
+    """
+    A file returning the given blocks, one per read.
+    """
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        block = self.blocks.pop(0) if self.blocks else b""
+        buffer[:len(block)] = block
+        return len(block)
+
+
+class NewlinesParser(WordsParser):
+    # newlines are words, to see how many there are
+    native_actions = {"input": "list"}
+    lexscript = WordsParser.lexscript.replace(
+        r"[ \r\n]     { }", r"\r|\n       { PYBISON_TOKEN(WORD); }")
+
+
+class HookedNewlinesParser(NewlinesParser):
+    def hook_read_after(self, data):
+        return data
+
+
+@pytest.mark.parametrize("cls, reads", [(NewlinesParser, False), (HookedNewlinesParser, True)],
+                         ids=["readinto", "read"])
+def test_newlines_split_across_blocks(cls, reads, monkeypatch, build_kwargs):
+    calls = []
+    read = BisonParser.read
+
+    def countingRead(self, nbytes):
+        calls.append(nbytes)
+        return read(self, nbytes)
+
+    monkeypatch.setattr(BisonParser, "read", countingRead)
+    blocks = [b"a\r", b"\n", b"b\r", b"\r\nc\r", b"\nd\r\n", b"e"]
+    parser = cls(**build_kwargs)
+    assert parser.run(file=BlocksFile(blocks)) == \
+        ["a", "\n", "b", "\n", "\n", "c", "\n", "d", "\n", "e"]
+    # without hook_read_after, the blocks are read straight into the scanner
+    assert bool(calls) == reads
+
+
+def test_overridden_read(build_kwargs):
+    class RenamingParser(NewlinesParser):
+        def read(self, nbytes):
+            data = super().read(nbytes)
+            assert isinstance(data, bytes)
+            return data.decode().replace("a", "x").encode()
+
+    parser = RenamingParser(**build_kwargs)
+    # what an overridden read() returns is not normalized
+    assert parser.run(file=io.BytesIO(b"a\r\nb")) == ["x", "\r", "\n", "b"]
+
+
+def test_nul_bytes_and_read_hooks(build_kwargs):
+    calls = []
+
+    class HookedParser(CountingParser):
+        lexscript = CountingParser.lexscript.replace(r"[ \r\n]     { }", r"[ \r\n\0]   { }")
+
+        def read(self, nbytes):
+            calls.append("read")
+            # a memoryview over a shared bytearray
+            return memoryview(self.shared)[:self.file.readinto(self.shared)]
+
+        def hook_read_before(self):
+            calls.append("before")
+
+        def hook_read_after(self, data):
+            calls.append("after")
+            return data.replace(b"b", b"x")
+
+    parser = HookedParser(**build_kwargs)
+    parser.shared = bytearray(4)
+    assert parser.run(file=io.BytesIO(b"a\0b c\0")) == ["a", "x", "c"]
+    assert calls == ["before", "read", "after"] * 3
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+import os
+
+from parsers import WordsParser
+
+
+class NumbersParser(WordsParser):
+    """
+    Sums up a whitespace separated list of numbers.
+    """
+    @staticmethod
+    def on_input(target, option, names, values):
+        """
+        input :
+              | input WORD
+        """
+        return 0 if option == 0 else values[0] + int(values[1])
+
+
+def test_lazy_parser_prepares_engine_on_first_run(tmp_path, build_kwargs):
+    parser = NumbersParser(lazy=True, **build_kwargs)
+    assert parser._engine is None
+    assert not os.path.exists(tmp_path / "cache")
+
+    assert parser.parse_string("1 2 3") == 6
+    assert parser._engine is not None
+
+
+def test_prepare_async(build_kwargs):
+    parser = NumbersParser(lazy=True, **build_kwargs)
+
+    future = parser.prepare_async()
+    engine = future.result(timeout=120)
+    assert engine is parser.engine
+    assert parser.prepare_async().result() is engine
+    assert parser.parse_string("40 2") == 42
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+import gc
+import io
+import os
+import sys
+
+import pytest
+
+from parsers import ItemsParser
+
+# handler results, which must be released with the values built from them
+SENTINEL = object()
+
+DOCUMENT = "a b ; c ! d e ;\n" * 20
+
+PARSES = 2000
+
+
+def rss():
+    """Returns the resident set size of the process, or 0 if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+
+def counts(parser):
+    gc.collect()
+    return {
+        'total': sys.gettotalrefcount() if hasattr(sys, 'gettotalrefcount') else 0,
+        # None is immortal from python 3.12 on
+        'None': sys.getrefcount(None) if sys.version_info < (3, 12) else 0,
+        'sentinel': sys.getrefcount(SENTINEL),
+        'parser': sys.getrefcount(parser),
+        'rss': rss(),
+    }
+
+
+def assert_no_growth(parser, parse):
+    parse()
+    before = counts(parser)
+    for _ in range(PARSES):
+        parse()
+    after = counts(parser)
+
+    # a leak per parse, let alone per reduction, would be PARSES or more
+    for name in ('total', 'None', 'sentinel', 'parser'):
+        assert after[name] - before[name] < PARSES // 10, name
+    assert after['rss'] - before['rss'] < 16 * 1024 * 1024
+
+
+class CheckedParser(ItemsParser):
+
+    def on_item(self, target, option, names, values):
+        """
+        item : WORD
+             | WORD WORD SEMI
+             | error SEMI
+        """
+        return SENTINEL
+
+
+class RaisingParser(ItemsParser):
+
+    def on_item(self, target, option, names, values):
+        """
+        item : WORD
+             | WORD WORD SEMI
+             | error SEMI
+        """
+        if option == 0:
+            raise ValueError(values[0])
+        return SENTINEL
+
+
+class HookedParser(CheckedParser):
+
+    def hook_handler(self, target, option, names, values, retval):
+        return retval
+
+    def hook_read_before(self):
+        pass
+
+    def hook_read_after(self, data):
+        return data
+
+
+@pytest.mark.parametrize("cls", [CheckedParser, RaisingParser],
+                         ids=["handlers", "raising"])
+def test_error_rules(build_kwargs, cls):
+    parser = cls(native_actions={"input": "none"}, **build_kwargs)
+    data = DOCUMENT.encode()
+
+    assert_no_growth(parser, lambda: parser.parse_bytes(data))
+    assert parser.syntax_errors == 20 * (PARSES + 1)
+    assert parser.lasterror is None
+
+
+def test_read_hooks(build_kwargs):
+    parser = HookedParser(native_actions={"input": "none"}, **build_kwargs)
+
+    def parse():
+        parser.run(file=io.BytesIO(DOCUMENT.encode()))
+
+    assert_no_growth(parser, parse)
+    assert parser.syntax_errors == 20 * (PARSES + 1)
+
+
+def test_token_refcounts(build_kwargs):
+    tokens = []
+
+    class CollectingParser(ItemsParser):
+
+        def on_item(self, target, option, names, values):
+            """
+            item : WORD
+                 | WORD WORD SEMI
+                 | error SEMI
+            """
+            tokens.extend(v for v in values if isinstance(v, str))
+
+    parser = CollectingParser(native_actions={"input": "none"}, **build_kwargs)
+    parser.parse_bytes(b"word1 word2 ; word3 word4 ; word5 word6 ! word7 ;")
+    parser.last = None
+    gc.collect()
+
+    words = [t for t in tokens if t.startswith("word")]
+    del tokens[:]
+    assert words == ["word1", "word2", "word3", "word4"]
+    assert parser.syntax_errors == 1
+    # only referenced by the list, the loop variable and the argument of
+    # getrefcount
+    assert [sys.getrefcount(w) for w in words] == [3] * 4
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import tracemalloc
+
+import pytest
+
+from parsers import ItemsParser
+
+
+# 1M tokens: 600k words, 200k semicolons and 200k tokens discarded after
+# syntax errors. The words are distinct strings of several characters,
+# rather than single characters python caches.
+DOCUMENT = b"".join(b"a%d bb%d ; c%d ! dd%d e%d ;\n" % ((i,) * 5)
+                    for i in range(125000))
+
+
+@pytest.mark.parametrize("native_actions", [
+    {"input": "none", ("item", 0): "passthrough(1)", ("item", 1): "tuple"},
+    {"input": "none"},
+], ids=["native", "handlers"])
+def test_token_values_released(build_kwargs, native_actions):
+    parser = ItemsParser(native_actions=native_actions, **build_kwargs)
+    parser.parse_bytes(DOCUMENT)
+    assert parser.syntax_errors == 125000
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(2):
+            parser.parse_bytes(DOCUMENT)
+        growth = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+
+    # a leak of one token value per token would be well beyond 50MB
+    assert growth < 1024 * 1024
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+"""
+Grammars shared by the tests, which use them as they are or subclass them.
+"""
+from bison import BisonParser
+
+
+# a pure push parser, which gets the reentrant scanner passed on
+REENTRANT_OPTIONS = [
+    "%define api.pure full",
+    "%define api.push-pull push",
+    "%lex-param {yyscan_t scanner}",
+    "%parse-param {yyscan_t scanner}",
+    "%define api.value.type {void *}",
+]
+
+
+def reentrant_lexscript(name, rules):
+    """
+    Returns the lex script of a reentrant scanner with the given rules,
+    reading its input through the parser.
+    """
+    return r"""
+    %option reentrant bison-bridge bison-locations
+
+    %{
+    #include "tmp.tab.h"
+    #include "Python.h"
+
+    PyMODINIT_FUNC PyInit_""" + name + r"""(void) { /* windows needs this function */ }
+
+    #define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
+    %}
+
+    %%
+""" + rules + r"""
+    %%
+
+    int yywrap(yyscan_t scanner) { return 1; }
+    """
+
+
+def global_lexscript(name, rules):
+    """
+    Returns the lex script of a scanner which is not reentrant, for parsers
+    keeping their state in globals of the engine.
+    """
+    return r"""
+    %{
+    #include "tmp.tab.h"
+    #include "Python.h"
+
+    PyMODINIT_FUNC PyInit_""" + name + r"""(void) { /* windows needs this function */ }
+
+    #define YY_INPUT(buf,result,max_size) PYBISON_INPUT(buf, result, max_size)
+    %}
+
+    %%
+""" + rules + r"""
+    %%
+
+    int yywrap() { return 1; }
+    """
+
+
+class WordsParser(BisonParser):
+    """
+    Collects a whitespace separated list of words.
+    """
+    start = "input"
+    tokens = ["WORD"]
+    precedences = ()
+    options = list(REENTRANT_OPTIONS)
+
+    lexscript = reentrant_lexscript("WordsParser", r"""
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    [ \r\n]     { }
+""")
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input WORD
+        """
+        return [] if option == 0 else values[0] + [values[1]]
+
+
+class CountingParser(WordsParser):
+    """
+    Collects the words natively, and counts the calls of read().
+    """
+    native_actions = {"input": "list"}
+    reads = 0
+
+    def read(self, nbytes):
+        self.reads += 1
+        return super().read(nbytes)
+
+
+class PairsParser(BisonParser):
+    """
+    Parses a list of 'key=value' pairs.
+    """
+    start = "input"
+    tokens = ["WORD", "EQUAL"]
+    precedences = ()
+    options = list(REENTRANT_OPTIONS)
+
+    lexscript = reentrant_lexscript("PairsParser", r"""
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    =           { PYBISON_TOKEN(EQUAL); }
+    [ \n]       { }
+""")
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input pair
+        """
+        return [] if option == 0 else values[0] + [values[1]]
+
+    def on_pair(self, target, option, names, values):
+        """
+        pair : WORD EQUAL WORD
+        """
+        if values[2] == "fail":
+            raise ValueError(values[0])
+        return (target, option, names, values[0], values[2])
+
+
+class ItemsParser(BisonParser):
+    """
+    Parses a list of words and pairs of words, skipping malformed items up
+    to the next semicolon.
+    """
+    start = "input"
+    tokens = ["WORD", "SEMI", "BANG"]
+    precedences = ()
+    options = list(REENTRANT_OPTIONS)
+
+    syntax_errors = 0
+
+    lexscript = reentrant_lexscript("ItemsParser", r"""
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    ;           { PYBISON_TOKEN(SEMI); }
+    !           { PYBISON_TOKEN(BANG); }
+    [ \n]       { }
+""")
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input item
+        """
+
+    def on_item(self, target, option, names, values):
+        """
+        item : WORD
+             | WORD WORD SEMI
+             | error SEMI
+        """
+        return values[0]
+
+    def report_syntax_error(self, msg, yytext, first_line, first_col,
+                            last_line, last_col):
+        self.syntax_errors += 1
+
+
+class ValuesParser(BisonParser):
+    """
+    Collects the values of all tokens.
+    """
+    start = "input"
+    tokens = ["WORD", "KEYWORD", "INTEGER", "REAL", "RAW", "COMMA"]
+    precedences = ()
+    options = list(REENTRANT_OPTIONS)
+
+    lexscript = reentrant_lexscript("ValuesParser", r"""
+    if|else                     { PYBISON_TOKEN(KEYWORD); }
+    [a-z]+                      { PYBISON_TOKEN(WORD); }
+    -?(0x)?[0-9a-f]+            { PYBISON_TOKEN(INTEGER); }
+    -?[0-9]+[.][0-9]*(e-?[0-9]+)? { PYBISON_TOKEN(REAL); }
+    #[a-z]+                     { PYBISON_TOKEN(RAW); }
+    ,                           { PYBISON_TOKEN(COMMA); }
+    [ \n]                       { }
+""")
+
+    token_values = {
+        "KEYWORD": "interned",
+        "INTEGER": "int",
+        "REAL": "float",
+        "RAW": "bytes",
+        "COMMA": "none",
+    }
+
+    native_actions = {"input": "list", "value": "passthrough(1)"}
+
+    def on_input(self, target, option, names, values):
+        """
+        input :
+              | input value
+        """
+
+    def on_value(self, target, option, names, values):
+        """
+        value : WORD
+              | KEYWORD
+              | INTEGER
+              | REAL
+              | RAW
+              | COMMA
+        """
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+import gc
+import logging
+import os
+import sys
+
+import pytest
+
+from parsers import WordsParser
+
+
+class CountingParser(WordsParser):
+    """
+    Counts the words of a whitespace separated list, and records the
+    files it runs on.
+    """
+    runs = []
+
+    @staticmethod
+    def on_input(target, option, names, values):
+        """
+        input :
+              | input WORD
+        """
+        return 0 if option == 0 else values[0] + 1
+
+    def hook_run(self, filename, last):
+        self.runs.append(filename)
+        return last
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs gcc")
+def test_profile_guided_build(tmp_path, caplog, build_kwargs):
+    corpus = tmp_path / "corpus.txt"
+    corpus.write_text("lorem ipsum dolor sit amet\n" * 100)
+    kwargs = dict(build_kwargs, pgo_corpus=[str(corpus)])
+    runs = CountingParser.runs
+    del runs[:]
+
+    parser = CountingParser(**kwargs)
+    assert runs == [str(corpus)]
+    assert parser.parse_string("one two three") == 3
+    assert "no profile data" not in caplog.text
+
+    profiles = [f for f in os.listdir(tmp_path / "cache")
+                if f.endswith(".profile.zip")]
+    assert len(profiles) == 1
+
+    # once the engine is gone, its rebuild reuses the profile data rather
+    # than training again
+    del parser
+    gc.collect()
+    for f in os.listdir(tmp_path / "cache"):
+        if not f.endswith(".profile.zip"):
+            os.unlink(tmp_path / "cache" / f)
+    del runs[:]
+
+    parser = CountingParser(**kwargs)
+    assert runs == []
+    assert parser.parse_string("four five") == 2
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs gcc")
+def test_built_engine_needs_no_corpus(tmp_path, build_kwargs):
+    corpus = tmp_path / "corpus.txt"
+    corpus.write_text("lorem ipsum\n")
+    kwargs = dict(build_kwargs, pgo_corpus=[str(corpus)])
+    CountingParser(**kwargs)
+
+    # a deployment without the corpus still finds the engine
+    os.unlink(corpus)
+    parser = CountingParser(**kwargs)
+    assert parser.parse_string("one two") == 2
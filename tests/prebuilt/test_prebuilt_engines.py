@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import os
+import subprocess
+import sys
+import textwrap
+from importlib import machinery
+
+import pytest
+
+
+TESTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SUFFIX = machinery.EXTENSION_SUFFIXES[0]
+
+# two parser classes in one module, which share the default library name
+MODULE = """
+from parsers import PairsParser, WordsParser
+
+
+class Words(WordsParser):
+    pass
+
+
+class Pairs(PairsParser):
+    pass
+"""
+
+SETUP = """
+from setuptools import setup
+
+from bison.build import build_engines, build_ext
+
+setup(
+    name='shipped',
+    version='0',
+    py_modules=['shipped'],
+    cmdclass={'build_ext': build_ext, 'build_engines': build_engines},
+    options={'build_engines': {'parsers': 'shipped:Words, shipped:Pairs'}},
+)
+"""
+
+PARSE = """
+import shipped
+
+print(shipped.Words().parse_string("a b"), shipped.Pairs().parse_string("a=1"))
+"""
+
+
+def run(args, cwd, **env):
+    """Runs python in `cwd`, which holds the parser module."""
+    env = dict(os.environ, **env)
+    env["PYTHONPATH"] = os.pathsep.join([str(cwd), TESTS, env.get("PYTHONPATH", "")])
+    return subprocess.run([sys.executable] + args, cwd=str(cwd), env=env, check=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def engines(directory):
+    return sorted(f for f in os.listdir(directory) if f.endswith(SUFFIX))
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "shipped.py").write_text(MODULE)
+    (project / "setup.py").write_text(SETUP)
+    return project
+
+
+def test_build_command(tmp_path, project):
+    out = run(["-m", "bison", "build", "shipped:Words", "shipped:Pairs"], project,
+              PYBISON_CACHE_DIR=str(tmp_path / "cache")).stdout
+
+    assert engines(project) == ["shipped_parser.Pairs" + SUFFIX,
+                                "shipped_parser.Words" + SUFFIX]
+    assert "shipped:Words: " in out and "shipped:Pairs: " in out
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="empties PATH")
+def test_prebuilt_engines_need_no_tools(tmp_path, project):
+    run(["-m", "bison", "build", "shipped:Words", "shipped:Pairs"], project,
+        PYBISON_CACHE_DIR=str(tmp_path / "cache"))
+
+    # neither bison, flex nor a compiler to be found, and a new cache
+    cache = tmp_path / "runtime-cache"
+    result = run(["-c", PARSE], project, PATH=str(tmp_path / "nowhere"),
+                 PYBISON_CACHE_DIR=str(cache))
+
+    assert result.stdout.strip() == "['a', 'b'] [('pair', 0, ('WORD', 'EQUAL', 'WORD'), 'a', '1')]"
+    assert "outdated" not in result.stderr
+    assert not os.path.exists(cache)
+
+
+def test_build_engines_command(tmp_path, project):
+    run(["setup.py", "-q", "build_ext"], project,
+        PYBISON_CACHE_DIR=str(tmp_path / "cache"))
+
+    # next to the module which gets installed, not the source
+    lib = project / "build" / "lib"
+    assert (lib / "shipped.py").exists()
+    assert engines(lib) == ["shipped_parser.Pairs" + SUFFIX,
+                            "shipped_parser.Words" + SUFFIX]
+    assert engines(project) == []
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+import os
+
+import pytest
+
+from bison import BisonParser
+from bison.bison_ import bisonCommand, flexCommand
+from parsers import WordsParser
+
+
+class Settings(object):
+    bisonCmd = BisonParser.bisonCmd
+    flexCmd = BisonParser.flexCmd
+    scanner_profile = None
+    parser_tables = None
+
+
+def test_default_commands():
+    settings = Settings()
+    assert bisonCommand(settings) == BisonParser.bisonCmd
+    assert flexCommand(settings) == BisonParser.flexCmd
+
+
+def test_profiles_extend_commands():
+    settings = Settings()
+    settings.scanner_profile = "fast"
+    settings.parser_tables = {"lr.type": "ielr",
+                              "lr.default-reduction": "consistent"}
+
+    assert flexCommand(settings)[-3:] == ["-CF", "-8", "--never-interactive"]
+    assert bisonCommand(settings)[-2:] == ["-Dlr.default-reduction=consistent",
+                                           "-Dlr.type=ielr"]
+
+
+INVALID_PROFILES = [
+    ("scanner_profile", "fastest"),
+    ("parser_tables", {"lr.type": "slr"}),
+    ("parser_tables", {"api.pure": "full"}),
+]
+
+
+@pytest.mark.parametrize("attr, value", INVALID_PROFILES)
+def test_invalid_profiles(attr, value):
+    settings = Settings()
+    setattr(settings, attr, value)
+
+    # each setting only affects the command of its own tool
+    if attr == "scanner_profile":
+        assert bisonCommand(settings) == BisonParser.bisonCmd
+        with pytest.raises(ValueError):
+            flexCommand(settings)
+    else:
+        assert flexCommand(settings) == BisonParser.flexCmd
+        with pytest.raises(ValueError):
+            bisonCommand(settings)
+
+
+@pytest.mark.parametrize("attr, value", INVALID_PROFILES)
+def test_invalid_profiles_rejected_before_building(tmp_path, build_kwargs, attr, value):
+    with pytest.raises(ValueError):
+        WordsParser(**dict(build_kwargs, **{attr: value}))
+    assert not os.path.exists(tmp_path / "build")
+    assert not os.path.exists(tmp_path / "cache")
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+import sys
+import threading
+
+import pytest
+
+from parsers import WordsParser, global_lexscript
+
+
+class ListParser(WordsParser):
+    """
+    Reads its input in small blocks, so the runs of several threads
+    interleave.
+    """
+    def read(self, nbytes):
+        return self.file.read(min(nbytes, 7))
+
+    def hook_read_after(self, data):
+        return data
+
+
+class GlobalListParser(ListParser):
+    """
+    The same parser, with an engine which is not reentrant.
+    """
+    options = ["%define api.value.type {void *}"]
+
+    lexscript = global_lexscript("GlobalListParser", r"""
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    [ \n]       { }
+""")
+
+
+class LegacyListParser(ListParser):
+    """
+    The reentrant parser, with a scanner reading its input by the py_input
+    and py_parser globals of the engine, which serializes its runs.
+    """
+    lexscript = r"""
+    %option reentrant bison-bridge bison-locations
+
+    %{
+    #include "tmp.tab.h"
+    #include "Python.h"
+
+    PyMODINIT_FUNC PyInit_LegacyListParser(void) { /* windows needs this function */ }
+
+    extern void (*py_input)(void *, char *, int *, int);
+    extern void *py_parser;
+    #define YY_INPUT(buf,result,max_size) { (*py_input)(py_parser, buf, &result, max_size); }
+    %}
+
+    %%
+
+    [a-z0-9]+   { PYBISON_TOKEN(WORD); }
+    [ \n]       { }
+
+    %%
+
+    int yywrap(yyscan_t scanner) { return 1; }
+    """
+
+
+THREADS = 8
+RUNS = 50
+
+
+@pytest.fixture
+def switch_often():
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+@pytest.mark.parametrize("cls", [ListParser, GlobalListParser, LegacyListParser],
+                         ids=["reentrant", "serialized", "legacy input"])
+def test_concurrent_runs(build_kwargs, switch_often, cls):
+    parsers = [cls(**build_kwargs) for _ in range(THREADS)]
+    failures = []
+
+    def work(index):
+        parser = parsers[index]
+        words = ["t%dw%d" % (index, i) for i in range(200)]
+        text = " ".join(words)
+        try:
+            for run in range(RUNS):
+                # alternate the read() and the in-memory input
+                if run % 2:
+                    result = parser.parse_string(text)
+                else:
+                    result = parser.parse_bytes(text.encode())
+                if result != words:
+                    failures.append((index, run, result))
+        except Exception as e:
+            failures.append((index, e))
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert failures == []
+
+
+@pytest.mark.parametrize("nested", ["parse_string", "parse_bytes"])
+def test_nested_runs_refused(build_kwargs, nested):
+    class NestingParser(GlobalListParser):
+        def on_input(self, target, option, names, values):
+            """
+            input :
+                  | input WORD
+            """
+            if option == 1 and values[1] == "nest":
+                # another instance, sharing the engine library
+                inner = NestingParser(**build_kwargs)
+                try:
+                    return getattr(inner, nested)("x" if nested == "parse_string" else b"x")
+                except RuntimeError as e:
+                    return [e]
+            return super().on_input(target, option, names, values)
+
+    for method in ("parse_string", "parse_bytes"):
+        parser = NestingParser(**build_kwargs)
+        text = "a nest b"
+        result = getattr(parser, method)(text if method == "parse_string" else text.encode())
+        # the inner run is refused, and the outer one goes on
+        assert isinstance(result[0], RuntimeError)
+        assert result[1:] == ["b"]
+        assert parser.parse_bytes(b"c d") == ["c", "d"]
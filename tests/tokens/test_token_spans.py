@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+import pytest
+
+from bison import TokenSpan
+from parsers import ValuesParser
+
+
+class SpansParser(ValuesParser):
+    token_values = {"WORD": "span", "KEYWORD": "interned", "COMMA": "none"}
+
+
+def test_token_spans(build_kwargs):
+    parser = SpansParser(**build_kwargs)
+    data = b"if abc,\n xyz if"
+    result = parser.parse_bytes(data)
+
+    assert result == ["if", "abc", None, "xyz", "if"]
+    spans = result[1], result[3]
+    assert all(isinstance(s, TokenSpan) for s in spans)
+    assert [(s.start, s.end) for s in spans] == [(3, 6), (9, 12)]
+    assert bytes(spans[0]) == b"abc" and str(spans[1]) == "xyz"
+    assert spans[0] != spans[1] and hash(spans[0]) == hash("abc")
+
+    with pytest.raises(TypeError):
+        TokenSpan()
+
+
+def test_spans_hold_the_buffer(build_kwargs):
+    parser = SpansParser(**build_kwargs)
+    data = bytearray(b"ab cd\0\0")
+    result = parser.parse_buffer(data)
+    assert result == ["ab", "cd"]
+
+    # the buffer can't be resized under the spans
+    with pytest.raises(BufferError):
+        data.extend(b"x")
+    del result
+    parser.last = None
+    data.extend(b"x")
+
+
+class CRLFSpansParser(SpansParser):
+    lexscript = SpansParser.lexscript.replace(r"[ \n]   ", r"[ \r\n] ")
+
+
+@pytest.mark.parametrize("normalize, offsets", [(True, [(3, 6), (7, 10)]), (False, [(4, 7), (8, 11)])],
+                         ids=["normalized", "raw"])
+def test_file_spans(normalize, offsets, tmp_path, build_kwargs):
+    path = tmp_path / "input.txt"
+    path.write_bytes(b"if\r\nabc def")
+    parser = CRLFSpansParser(**build_kwargs)
+    parser.normalize_newlines = normalize
+
+    spans = parser.parse_file(str(path))[1:]
+    # offsets are those in the scanned text: the file with its newlines
+    # normalized, unless that is turned off
+    assert [(s.start, s.end) for s in spans] == offsets
+    assert [s.text for s in spans] == ["abc", "def"]
+
+
+def test_spans_of_read_input(build_kwargs):
+    parser = SpansParser(**build_kwargs)
+    parser.read = lambda nbytes, data=[b"ab cd"]: data.pop() if data else b""
+
+    assert [type(v) for v in parser.parse_string("ab cd")] == [str, str]
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+import pytest
+
+from parsers import ValuesParser
+
+
+def test_token_values(build_kwargs):
+    parser = ValuesParser(**build_kwargs)
+    result = parser.parse_bytes(b"if x, 12 -7 0x1f 007 1.5 -2.e3 #raw else if if")
+
+    assert result == ["if", "x", None, 12, -7, 31, 7, 1.5, -2000.0, b"#raw",
+                      "else", "if", "if"]
+    assert [type(v) for v in result[3:10]] == [int] * 4 + [float] * 2 + [bytes]
+    # keywords are the same strings, as long as the text stays the same
+    assert result[-1] is result[-2]
+    assert result[0] is result[-1]
+
+
+def test_str_token_values(build_kwargs):
+    parser = ValuesParser(token_values={"INTEGER": "str"}, **build_kwargs)
+    assert parser.parse_bytes(b"if 12 , 1.5") == ["if", "12", ",", "1.5"]
+
+
+@pytest.mark.parametrize("token_values", [{"INTEGER": "decimal"}, {"NUMBER": "int"}])
+def test_invalid_token_values(build_kwargs, token_values):
+    with pytest.raises(ValueError):
+        ValuesParser(token_values=token_values, **build_kwargs)